@@ -0,0 +1,189 @@
+"""Benchmark the stages of kappagate's assembly accuracy prediction.
+
+For each combination of number of parts, initial quantities and annealing
+dataset, this measures the wall time of the rules generation, of the
+simulation (KaSim run, ODE solving or population simulation), and of the
+snapshot parsing. The memory usage of the prediction is measured in a
+separate run (in a fresh process): peak of the Python heap, peak resident
+memory of the process, and peak resident memory of the KaSim subprocess.
+The results are written as a JSON file for regression tracking.
+
+Usage:
+
+    python benchmarks/benchmark_prediction.py --output benchmark.json
+    python benchmarks/benchmark_prediction.py --parts 5 10 --quantities 100
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import kappagate
+from kappagate import overhangs_list_to_slots
+from kappagate.annealing_matrix import (random_overhangs,
+                                        get_annealing_matrix)
+from kappagate.predict_assembly_accuracy import (
+    slots_to_agents_and_rules, snapshot_agents_to_constructs)
+from kappagate.ode_simulation import ode_assembly_accuracy
+from kappagate.population_simulation import population_assembly_accuracy
+
+
+def prediction_stages(slots, initial_quantities, annealing_data,
+                      duration=1000, engine='kappa', seed=123):
+    """Run one prediction, return a dict of the timings of its stages."""
+    if engine not in ('kappa', 'ode', 'population'):
+        raise ValueError("Unknown engine: %s" % engine)
+    timings = {}
+
+    t0 = time.perf_counter()
+    agents, rules = slots_to_agents_and_rules(slots,
+                                              annealing_data=annealing_data)
+    timings['rules_generation'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if engine == 'ode':
+        score, _, _ = ode_assembly_accuracy(
+            slots, agents, rules, initial_quantities=initial_quantities,
+            duration=duration)
+        timings['simulation'] = time.perf_counter() - t0
+    elif engine == 'population':
+        score, _, simulation_results = population_assembly_accuracy(
+            slots, agents, rules, initial_quantities=initial_quantities,
+            duration=duration, seed=seed)
+        timings['simulation'] = time.perf_counter() - t0
+        species_counts = simulation_results['species_counts']
+        timings['n_complexes'] = sum(species_counts.values())
+        timings['n_steps'] = simulation_results['n_steps']
+    else:
+        from topkappy import KappaModel
+        model = KappaModel(
+            agents=agents, rules=rules, duration=duration,
+            initial_quantities={a: initial_quantities for a in agents},
+            snapshot_times={'end': duration}
+        )
+        model.parameters.seed = seed
+        simulation_results = model.get_simulation_results()
+        timings['simulation'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        snapshots = simulation_results['snapshots']
+        end_time = 'end' if 'end' in snapshots else 'deadlock'
+        snapshot_agents = snapshots[end_time]['snapshot_agents']
+        score, _, _ = snapshot_agents_to_constructs(slots, snapshot_agents)
+        timings['snapshot_parsing'] = time.perf_counter() - t0
+        timings['n_complexes'] = len(snapshot_agents)
+
+    timings.update(score=score, n_rules=len(rules), n_agents=len(agents))
+    return timings
+
+
+def warm_up(annealing_data):
+    """Import the simulation libraries and load the annealing dataset, so
+    that these one-time costs are not counted in the timings."""
+    import topkappy  # noqa: F401 (imported for its side effects)
+    get_annealing_matrix(annealing_data)
+
+
+def _max_rss_bytes(who):
+    """Return the peak resident memory of the process or its children."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes on Linux.
+    return max_rss if sys.platform == 'darwin' else 1024 * max_rss
+
+
+def _memory_usage(arguments):
+    """Run one prediction in a fresh process, return its memory usage."""
+    slots, initial_quantities, annealing_data, duration, engine, seed = \
+        arguments
+    warm_up(annealing_data)
+    tracemalloc.start()
+    prediction_stages(slots, initial_quantities, annealing_data,
+                      duration=duration, engine=engine, seed=seed)
+    _, python_peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    memory = dict(python_peak_memory=python_peak_memory,
+                  process_peak_rss=_max_rss_bytes(resource.RUSAGE_SELF))
+    if engine == 'kappa':
+        # KaSim is the only child process of this fresh process.
+        memory['kasim_peak_rss'] = _max_rss_bytes(resource.RUSAGE_CHILDREN)
+    return memory
+
+
+def benchmark_prediction(slots, initial_quantities, annealing_data,
+                         duration=1000, engine='kappa', seed=123,
+                         measure_memory=True):
+    """Return a dict of the timings and memory usage of one prediction.
+
+    The libraries and annealing dataset are loaded before the timings, so
+    that their one-time loading is not counted in the rules generation
+    (see ``warm_up``).
+
+    The memory is measured in a separate run, in a fresh process, as tracing
+    the Python memory allocations slows the prediction down:
+    ``python_peak_memory`` is the peak of the Python heap (tracemalloc)
+    during the prediction, ``process_peak_rss`` the peak resident memory of
+    the process running it, and ``kasim_peak_rss`` (with the Kappa engine)
+    the peak resident memory of the KaSim subprocess.
+    """
+    warm_up(annealing_data)
+    result = prediction_stages(slots, initial_quantities, annealing_data,
+                               duration=duration, engine=engine, seed=seed)
+    if measure_memory:
+        arguments = (slots, initial_quantities, annealing_data, duration,
+                     engine, seed)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result.update(executor.submit(_memory_usage, arguments).result())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--parts', type=int, nargs='+',
+                        default=[5, 10, 20, 30, 50])
+    parser.add_argument('--quantities', type=int, nargs='+',
+                        default=[100, 1000, 5000, 20000])
+    parser.add_argument('--datasets', nargs='+',
+                        default=['25C/01h', '25C/18h', '37C/01h', '37C/18h'])
+    parser.add_argument('--engine', default='kappa',
+                        choices=['kappa', 'ode', 'population'])
+    parser.add_argument('--duration', type=float, default=1000)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Only measure the timings.")
+    parser.add_argument('--output', default='benchmark_prediction.json')
+    args = parser.parse_args()
+
+    results = []
+    for dataset in args.datasets:
+        annealing_data = tuple(dataset.split('/'))
+        for n_parts in args.parts:
+            slots = overhangs_list_to_slots(
+                random_overhangs(n_parts + 1, seed=n_parts))
+            for quantities in args.quantities:
+                for repeat in range(args.repeats):
+                    result = benchmark_prediction(
+                        slots, quantities, annealing_data,
+                        duration=args.duration, engine=args.engine,
+                        seed=repeat, measure_memory=not args.no_memory)
+                    result.update(dataset=dataset, n_parts=n_parts,
+                                  initial_quantities=quantities,
+                                  engine=args.engine, repeat=repeat)
+                    print(json.dumps(result))
+                    results.append(result)
+    with open(args.output, 'w') as f:
+        json.dump(dict(
+            kappagate_version=kappagate.__version__,
+            python_version=platform.python_version(),
+            machine=platform.machine(),
+            date=time.strftime('%Y-%m-%d %H:%M:%S'),
+            results=results
+        ), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
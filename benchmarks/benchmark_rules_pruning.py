@@ -0,0 +1,125 @@
+"""Benchmark the speed/accuracy trade-off of pruning negligible rules.
+
+Each assembly (the overhangs sets of kappagate's success rate prediction
+tests, and random sets) is predicted with the full model, then with pruned
+models (see the ``min_rate`` and ``max_rules_per_site`` options of
+``slots_to_agents_and_rules``). For each pruning setting, this reports the
+number of rules, the fraction of the total rate pruned, the prediction
+time, and the difference between the pruned and the full model's
+predictions.
+With the 'kappa' engine, differences smaller than the simulation noise
+(run several seeds with ``--repeats`` to estimate it) are not meaningful.
+
+Usage:
+
+    python benchmarks/benchmark_rules_pruning.py --output pruning.json
+    python benchmarks/benchmark_rules_pruning.py --min-rates 1 10 --engine ode
+"""
+
+import argparse
+import json
+import platform
+import time
+
+import kappagate
+from kappagate import overhangs_list_to_slots
+from kappagate.predict_assembly_accuracy import (
+    slots_to_agents_and_rules, predict_accuracy_from_agents_and_rules)
+from kappagate.annealing_matrix import (random_overhangs,
+                                        get_annealing_matrix)
+
+# Overhangs sets of kappagate's success rate prediction tests.
+OVERHANGS_SETS = {
+    'high_fidelity_13_overhangs': [
+        'GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA', 'GAAT', 'AGTA', 'TCTT',
+        'CAAA', 'GCAC', 'AACG', 'GTCT', 'CCAT'],
+    'high_fidelity_25_overhangs': [
+        'GGAG', 'GATA', 'GGCA', 'GGTC', 'TCGC', 'GAGG', 'CAGT', 'GTAA',
+        'TCCA', 'CACA', 'GAAT', 'ATAG', 'AGTA', 'ATCA', 'TCTT', 'AGGT',
+        'CAAA', 'AAGC', 'GCAC', 'CAAC', 'AACG', 'CGAA', 'GTCT', 'TCAG',
+        'CCAT'],
+    'low_fidelity_13_overhangs': [
+        'GGAG', 'GGTC', 'AGCA', 'CAGT', 'GGTA', 'GAAT', 'GGTT', 'TCTT',
+        'GGTG', 'GCAC', 'AGCG', 'GTCT', 'CCAT'],
+}
+
+
+def benchmark_pruning(slots, min_rate, max_rules_per_site, annealing_data,
+                      initial_quantities, duration, engine, seed):
+    """Return the timings and prediction of one (pruned) model."""
+    t0 = time.perf_counter()
+    agents, rules, report = slots_to_agents_and_rules(
+        slots, annealing_data=annealing_data, min_rate=min_rate,
+        max_rules_per_site=max_rules_per_site, return_pruning_report=True)
+    rules_generation_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    score, _, _ = predict_accuracy_from_agents_and_rules(
+        slots, agents, rules, duration=duration,
+        initial_quantities=initial_quantities, seed=seed, engine=engine)
+    report.update(min_rate=min_rate, max_rules_per_site=max_rules_per_site,
+                  rules_generation_time=rules_generation_time,
+                  simulation_time=time.perf_counter() - t0, score=score)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--random-parts', type=int, nargs='+',
+                        default=[10, 20, 30])
+    parser.add_argument('--min-rates', type=float, nargs='+',
+                        default=[1, 5, 20])
+    parser.add_argument('--max-rules-per-site', type=int, nargs='+',
+                        default=[2, 5])
+    parser.add_argument('--dataset', default='25C/01h')
+    parser.add_argument('--quantities', type=int, default=1000)
+    parser.add_argument('--engine', default='kappa',
+                        choices=['kappa', 'ode', 'population'])
+    parser.add_argument('--duration', type=float, default=1000)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--output', default='benchmark_rules_pruning.json')
+    args = parser.parse_args()
+
+    annealing_data = tuple(args.dataset.split('/'))
+    # Import topkappy and load the dataset first, so that these one-time
+    # costs are not counted as rules generation time.
+    import topkappy  # noqa: F401 (imported for its side effects)
+    get_annealing_matrix(annealing_data)
+    overhangs_sets = dict(OVERHANGS_SETS)
+    for n_parts in args.random_parts:
+        overhangs_sets['random_%d_parts' % n_parts] = random_overhangs(
+            n_parts + 1, seed=n_parts)
+    settings = ([(min_rate, None) for min_rate in args.min_rates] +
+                [(0, n_rules) for n_rules in args.max_rules_per_site])
+
+    results = []
+    for name, overhangs in overhangs_sets.items():
+        slots = overhangs_list_to_slots(overhangs)
+        for repeat in range(args.repeats):
+            reference = None
+            for min_rate, max_rules_per_site in [(0, None)] + settings:
+                result = benchmark_pruning(
+                    slots, min_rate, max_rules_per_site, annealing_data,
+                    initial_quantities=args.quantities,
+                    duration=args.duration, engine=args.engine, seed=repeat)
+                if reference is None:
+                    reference = result
+                result.update(
+                    overhangs_set=name, repeat=repeat, engine=args.engine,
+                    score_difference=result['score'] - reference['score'],
+                    speedup=(reference['simulation_time'] /
+                             result['simulation_time']))
+                print(json.dumps(result))
+                results.append(result)
+    with open(args.output, 'w') as f:
+        json.dump(dict(
+            kappagate_version=kappagate.__version__,
+            python_version=platform.python_version(),
+            machine=platform.machine(),
+            date=time.strftime('%Y-%m-%d %H:%M:%S'),
+            dataset=args.dataset,
+            results=results
+        ), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark the colony picking statistics on many success rates.
+
+This compares the throughput (success rates per second) of calling
+``success_rate_facts`` on each success rate, with that of a single call to
+``success_rate_facts_table`` (with and without the plain texts).
+
+Usage:
+
+    python benchmarks/benchmark_success_rate_facts.py --sizes 1000 100000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from kappagate import success_rate_facts, success_rate_facts_table
+
+
+def throughput(function, rates, repeats):
+    """Return the best throughput (rates per second) of several runs."""
+    best_time = np.inf
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        function(rates)
+        best_time = min(best_time, time.perf_counter() - t0)
+    return len(rates) / best_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(123)
+    methods = [
+        ('scalar_loop', lambda rates: [success_rate_facts(rate, False)
+                                       for rate in rates]),
+        ('table', success_rate_facts_table),
+        ('table_with_text',
+         lambda rates: success_rate_facts_table(rates, with_text=True)),
+    ]
+    for size in args.sizes:
+        # Include the edge cases (no success, certain success).
+        rates = np.concatenate([[0, 1], rng.uniform(0, 1, size - 2)])
+        result = dict(size=size)
+        for name, function in methods:
+            result[name + '_per_second'] = throughput(function, rates,
+                                                      args.repeats)
+        result['table_speedup'] = (result['table_per_second'] /
+                                   result['scalar_loop_per_second'])
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,47 @@
 """ dna_sequencing_viewer/__init__.py """
 
-# __all__ = []
+import importlib
 
 from .predict_assembly_accuracy import predict_assembly_accuracy
+from .batch_prediction import predict_assembly_accuracy_batch
+from .prediction_cache import PredictionCache
+from .optimize_overhangs import optimize_overhangs
+from .interaction_clusters import predict_assembly_accuracy_by_clusters
+from .sweep import sweep
+from .junctions_report import junctions_report
+from .batch_records_loading import load_records_batch
+from .profiling import Profiler
+from .colony_picking import (min_trials_for_one_success,
+                             average_trials_until_success, success_rate_facts,
+                             success_rate_facts_table)
 from .tools import (overhangs_list_to_slots, parts_records_to_slots,
-                    construct_record_to_slots, load_record)
-from .reporting import (plot_colony_picking_graph,
-                        min_trials_for_one_success,
-                        average_trials_until_success,
-                        plot_colony_picking_graph,
-                        plot_circular_interactions,
-                        success_rate_facts)
\ No newline at end of file
+                    construct_record_to_slots, load_record,
+                    clear_digestion_caches)
+from .version import __version__
+
+# These are imported from their modules when first accessed (PEP 562), as
+# the modules import Topkappy, matplotlib or asyncio, which are slow to
+# import.
+_LAZY_ATTRIBUTES = {
+    'IncrementalAssemblyModel': 'incremental_model',
+    'AsyncPredictor': 'service',
+    'predict_assembly_accuracy_adaptive': 'adaptive_prediction',
+    'plot_colony_picking_graph': 'reporting',
+    'plot_colony_picking_graphs': 'reporting',
+    'plot_circular_interactions': 'reporting',
+    'generate_batch_report': 'batch_reports',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module %s has no attribute %s"
+                             % (__name__, name))
+    module = importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
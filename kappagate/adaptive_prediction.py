@@ -0,0 +1,147 @@
+"""Predict the assembly accuracy with simulations only as long and large as
+needed for the estimate to converge."""
+
+import numpy as np
+from scipy.stats import norm
+from topkappy import KappaModel
+
+from .predict_assembly_accuracy import (slots_to_agents_and_rules,
+                                        snapshot_agents_to_constructs)
+
+
+def _confidence_interval(proportion, n_constructs, confidence):
+    """Return the normal-approximation confidence interval of a proportion.
+    """
+    if n_constructs == 0:
+        return (0.0, 1.0)
+    z = norm.ppf(0.5 + confidence / 2.0)
+    half_width = z * np.sqrt(proportion * (1 - proportion) / n_constructs)
+    return (float(max(0.0, proportion - half_width)),
+            float(min(1.0, proportion + half_width)))
+
+
+def predict_assembly_accuracy_adaptive(
+        slots, tolerance=0.01, initial_quantities=(250, 1000, 4000, 16000),
+        duration=1000, n_snapshots=8, confidence=0.95, corrective_factor=1.0,
+        annealing_data=('25C', '01h'), seed=None):
+    """Predict the assembly accuracy, stopping once the estimate is stable.
+
+    Simulations are run with increasing initial quantities. Each simulation
+    records several snapshots, at times spread geometrically from
+    ``duration / 100`` to ``duration``. The proportion of good clones is
+    computed at each snapshot, which tells the time actually needed for the
+    estimate to stabilize. The next (larger) simulation then stops at the
+    snapshot following that time, rather than at ``duration``. No larger
+    simulation is run once the confidence interval of the estimate is
+    narrower than the tolerance, or once the estimate and its confidence
+    interval changed by less than the tolerance since the previous (smaller)
+    simulation.
+
+    A KaSim run cannot be interrupted from its snapshots, so the first
+    simulation always runs for the full ``duration``: the early stop in
+    virtual time only applies to the larger simulations.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    tolerance
+      Tolerance on the proportion of good clones, e.g. 0.01 for +/- 1%.
+
+    initial_quantities
+      Increasing list of initial quantities (same for all agents) to try.
+
+    duration
+      Maximal virtual duration of the Kappa simulations (that of the first
+      simulation).
+
+    n_snapshots
+      Number of snapshots recorded in each simulation. More snapshots sample
+      the same time range more densely.
+
+    confidence
+      Confidence level of the confidence intervals.
+
+    corrective_factor, annealing_data, seed
+      See ``predict_assembly_accuracy``.
+
+    Returns
+    -------
+
+    proportion, other_constructs, report
+      Where proportion is the proportion of good clones, other_constructs is
+      a dict {parts_tuple: proportion} (see ``predict_assembly_accuracy``)
+      and report is a dict with keys ``converged`` (whether the tolerance was
+      reached), ``initial_quantities_needed``, ``time_needed`` (first
+      snapshot time after which the estimate stays within the tolerance of
+      its final value), ``durations`` (list of the virtual durations of the
+      simulations run), ``confidence_interval`` and ``history`` (list of
+      dicts with the estimate at each snapshot of each simulation).
+    """
+    times = np.geomspace(duration / 100.0, duration, n_snapshots)
+    # Kappa alarms are written with 3 decimals: earlier snapshots would be
+    # taken at time 0.
+    if round(times[0], 3) == 0:
+        raise ValueError("The first snapshot time (%s) rounds to 0, use a "
+                         "longer duration than %s." % (times[0], duration))
+    agents, rules = slots_to_agents_and_rules(
+        slots, annealing_data=annealing_data,
+        corrective_factor=corrective_factor)
+    snapshot_times = {'t%d' % i: float(t) for i, t in enumerate(times)}
+    history, durations = [], []
+    previous = None
+    level_duration = float(times[-1])
+    for level, quantity in enumerate(initial_quantities):
+        level_snapshot_times = {name: t for name, t in snapshot_times.items()
+                                if t <= level_duration}
+        model = KappaModel(
+            agents=agents,
+            rules=rules,
+            initial_quantities={a: quantity for a in agents},
+            duration=level_duration,
+            snapshot_times=level_snapshot_times
+        )
+        durations.append(level_duration)
+        model.parameters.seed = None if seed is None else seed + level
+        snapshots = model.get_simulation_results()['snapshots']
+        estimates = []
+        for name, time in level_snapshot_times.items():
+            # Snapshots after a deadlock are missing: the state is final.
+            snapshot = snapshots.get(name, snapshots.get('deadlock'))
+            if snapshot is None:
+                continue
+            score, constructs, n_constructs = snapshot_agents_to_constructs(
+                slots, snapshot['snapshot_agents'])
+            interval = _confidence_interval(score, n_constructs, confidence)
+            estimates.append((time, score, constructs, interval))
+            history.append(dict(initial_quantities=quantity, time=time,
+                                score=score, n_constructs=n_constructs,
+                                confidence_interval=interval))
+        if len(estimates) == 0:
+            raise ValueError(
+                "The simulation with initial quantities %d returned no "
+                "snapshot (nor a deadlock snapshot)." % quantity)
+        time, score, constructs, interval = estimates[-1]
+        time_needed = min(t for (t, s, _, _) in estimates
+                          if all(abs(s2 - score) <= tolerance
+                                 for (t2, s2, _, _) in estimates if t2 >= t))
+        half_width = 0.5 * (interval[1] - interval[0])
+        converged = half_width <= tolerance
+        if previous is not None:
+            previous_score, previous_half_width = previous
+            converged = converged or (
+                (abs(score - previous_score) <= tolerance) and
+                (abs(half_width - previous_half_width) <= tolerance))
+        if converged:
+            break
+        previous = (score, half_width)
+        # Larger simulations only run until the snapshot following the time
+        # the estimate needed to stabilize.
+        later_times = [t for t in times if t > time_needed]
+        level_duration = float(later_times[0] if later_times else times[-1])
+    report = dict(converged=converged, initial_quantities_needed=quantity,
+                  time_needed=time_needed, durations=durations,
+                  confidence_interval=interval, history=history)
+    return score, constructs, report
@@ -0,0 +1,259 @@
+"""Dense NumPy representation of the overhangs annealing data.
+
+The 256 possible 4bp overhangs are represented by integer codes (each
+nucleotide being a base-4 digit), so that annealing rates between any
+overhangs can be looked up in a 256x256 array with fancy indexing, rather
+than with (slow) individual lookups in a pandas dataframe.
+"""
+
+import itertools
+from functools import lru_cache
+
+import numpy as np
+
+NUCLEOTIDES = 'ACGT'
+
+ALL_OVERHANGS = [''.join(nucleotides)
+                 for nucleotides in itertools.product(NUCLEOTIDES, repeat=4)]
+
+OVERHANGS_INDICES = {overhang: i for i, overhang in enumerate(ALL_OVERHANGS)}
+
+COMPLEMENTS = str.maketrans('ACGT', 'TGCA')
+
+
+def reverse_complement(overhang):
+    """Return the reverse-complement of an ATGC sequence."""
+    return overhang.translate(COMPLEMENTS)[::-1]
+
+
+REVERSE_COMPLEMENT_INDICES = np.array([
+    OVERHANGS_INDICES[reverse_complement(overhang)]
+    for overhang in ALL_OVERHANGS
+])
+
+
+def overhangs_to_indices(overhangs):
+    """Return an array of the integer codes of the given overhangs.
+
+    Overhangs which are not 4bp ATGC sequences (such as the "LEFT" and
+    "RIGHT" placeholders used in slots) get the code -1.
+    """
+    return np.array([OVERHANGS_INDICES.get(o, -1) for o in overhangs],
+                    dtype=int)
+
+
+def random_overhangs(n_overhangs, seed=None):
+    """Return a random list of overhangs without palindromes or
+    reverse-complement pairs (e.g. to benchmark random assemblies)."""
+    rng = np.random.RandomState(seed)
+    overhangs, used = [], set()
+    for index in rng.permutation(len(ALL_OVERHANGS)):
+        rc_index = REVERSE_COMPLEMENT_INDICES[index]
+        if (rc_index == index) or (index in used):
+            continue
+        overhangs.append(ALL_OVERHANGS[index])
+        used.update([index, rc_index])
+        if len(overhangs) == n_overhangs:
+            return overhangs
+    raise ValueError("Cannot find %d compatible overhangs" % n_overhangs)
+
+
+def annealing_data_to_matrix(annealing_data):
+    """Convert an annealing dataframe into a 256x256 array.
+
+    The element (i, j) of the array is ``annealing_data[o_i][o_j]`` where
+    o_i is the overhang with code i. Overhangs missing from the dataframe
+    get a rate of zero.
+    """
+    dataframe = annealing_data.reindex(index=ALL_OVERHANGS,
+                                       columns=ALL_OVERHANGS)
+    return dataframe.fillna(0).values.T.astype(float)
+
+
+@lru_cache(maxsize=None)
+def _dataset_matrix(temperature, duration):
+    # Tatapov loads all datasets (and matplotlib) when first imported.
+    import tatapov
+    matrix = annealing_data_to_matrix(
+        tatapov.annealing_data[temperature][duration])
+    matrix.flags.writeable = False
+    return matrix
+
+
+def get_annealing_matrix(annealing_data=('25C', '01h')):
+    """Return the 256x256 annealing matrix for the given annealing data.
+
+    Parameters
+    ----------
+
+    annealing_data
+      Either a pandas dataframe or a couple (temperature, duration) indicating
+      an experimental dataset from Potapov et al. 2018. The matrices of these
+      datasets are only computed once, then cached (and read-only).
+    """
+    if isinstance(annealing_data, tuple):
+        return _dataset_matrix(*annealing_data)
+    return annealing_data_to_matrix(annealing_data)
+
+
+def slots_interaction_rates(slots, annealing_data=('25C', '01h'),
+                            corrective_factor=1.0):
+    """Return the annealing rates between the sites of all slots.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    annealing_data
+      Either a pandas dataframe or a couple (temperature, duration) indicating
+      an experimental dataset from Potapov et al. 2018
+
+    corrective_factor
+      A factor that can be applied to decrease (when <1) or increase (>1)
+      the differences in affinity in the dataset.
+
+    Returns
+    -------
+
+    rates
+      An array of shape (n_slots, n_slots, 2) where ``rates[i, j, 0]`` is the
+      rate at which the right site of slot i anneals to the left site of
+      slot j, and ``rates[i, j, 1]`` the rate at which it anneals to the
+      right site of slot j (i.e. with slot j in reverse orientation).
+    """
+    matrix = get_annealing_matrix(annealing_data)
+    lefts = overhangs_to_indices([left for _, left, _ in slots])
+    rights = overhangs_to_indices([right for _, _, right in slots])
+    valid_lefts, valid_rights = lefts >= 0, rights >= 0
+    lefts_rc = REVERSE_COMPLEMENT_INDICES[np.where(valid_lefts, lefts, 0)]
+    rights = np.where(valid_rights, rights, 0)
+    rates = np.stack([matrix[rights[:, None], lefts_rc[None, :]],
+                      matrix[rights[:, None], rights[None, :]]], axis=-1)
+    rates[~valid_rights] = 0
+    rates[:, ~valid_lefts, 0] = 0
+    rates[:, ~valid_rights, 1] = 0
+    nonzero = rates > 0
+    rates[nonzero] = rates[nonzero] ** corrective_factor
+    return rates
+
+
+def _ranks_within_groups(groups, values):
+    """Return the rank of each value within its group (0 for the highest)."""
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_groups[1:] !=
+                                        sorted_groups[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    ranks = np.empty(len(order), dtype=int)
+    ranks[order] = np.arange(len(order)) - np.repeat(group_starts,
+                                                     group_sizes)
+    return ranks
+
+
+def prune_interaction_rates(rates, min_rate=0, max_rules_per_site=None):
+    """Set the negligible interaction rates to zero.
+
+    The rates of the expected junctions (slot i's right site with slot i+1's
+    left site) are never pruned.
+
+    Parameters
+    ----------
+
+    rates
+      An array of shape (n_slots, n_slots, 2), as returned by
+      ``slots_interaction_rates``.
+
+    min_rate
+      Rates lower than this value (in the units of the annealing data, after
+      application of the corrective factor) are pruned.
+
+    max_rules_per_site
+      If provided, an interaction is pruned unless it is among the
+      ``max_rules_per_site`` strongest (unexpected) interactions of each of
+      its two sites.
+
+    Returns
+    -------
+
+    pruned_rates, report
+      Where pruned_rates is a pruned copy of ``rates`` and report is a dict
+      with keys ``n_rules`` and ``n_pruned_rules`` (number of non-zero
+      rates, i.e. of Kappa rules, before pruning, and number pruned),
+      ``total_rate`` and ``pruned_rate`` (sums of the rates before pruning
+      and of the pruned rates), and ``pruned_rate_fraction``.
+    """
+    n_slots = rates.shape[0]
+    protected = np.zeros(rates.shape, dtype=bool)
+    protected[np.arange(n_slots - 1), np.arange(1, n_slots), 0] = True
+    pruned = (rates > 0) & (rates < min_rate) & ~protected
+    if max_rules_per_site is not None:
+        candidates = (rates > 0) & ~protected
+        slots1, slots2, sides = np.nonzero(candidates)
+        values = rates[candidates]
+        # Sites are numbered 2 * slot_index + side (0 for left, 1 for right).
+        # Each interaction is ranked among all interactions of each site.
+        sites = np.concatenate([2 * slots1 + 1, 2 * slots2 + sides])
+        ranks = _ranks_within_groups(sites, np.concatenate([values, values]))
+        ranks1, ranks2 = ranks[:len(values)], ranks[len(values):]
+        too_weak = ((ranks1 >= max_rules_per_site) |
+                    (ranks2 >= max_rules_per_site))
+        pruned[slots1[too_weak], slots2[too_weak], sides[too_weak]] = True
+    pruned_rates = np.where(pruned, 0, rates)
+    total_rate = float(rates.sum())
+    pruned_rate = float(rates[pruned].sum())
+    report = dict(
+        n_rules=int((rates > 0).sum()), n_pruned_rules=int(pruned.sum()),
+        total_rate=total_rate, pruned_rate=pruned_rate,
+        pruned_rate_fraction=pruned_rate / total_rate if total_rate else 0.0
+    )
+    return pruned_rates, report
+
+
+
+def junctions_rates(rates):
+    """Return the correct and competing rates of each junction of an assembly.
+
+    Junction i is the ligation of the right site of slot i with the left
+    site of slot i+1. Its competing interactions are all the other
+    interactions involving one of these two sites, each counted once (in
+    particular the interaction of slot i's right site with a copy of
+    itself). This takes O(n_slots^2) time and memory.
+
+    Parameters
+    ----------
+
+    rates
+      An array of shape (n_slots, n_slots, 2), as returned by
+      ``slots_interaction_rates``.
+
+    Returns
+    -------
+
+    correct, competing
+      Arrays of the rate of each junction's ligation, and of the sum of the
+      rates of its competing interactions.
+    """
+    junctions = np.arange(rates.shape[0] - 1)
+    correct = rates[junctions, junctions + 1, 0]
+    right_site_rates = (rates[junctions].sum(axis=(1, 2)) +
+                        rates[:, junctions, 1].sum(axis=0) -
+                        rates[junctions, junctions, 1])
+    left_site_rates = rates[:, junctions + 1, 0].sum(axis=0)
+    competing = right_site_rates + left_site_rates - 2 * correct
+    return correct, competing
+
+
+def junctions_fidelities(rates):
+    """Return the expected fidelity of each junction of an assembly.
+
+    The fidelity of a junction is the ratio between the rate of its correct
+    ligation and the sum of the rates of all the interactions involving its
+    two sites (see ``junctions_rates``). This neglects the depletion of the
+    sites over time.
+    """
+    correct, competing = junctions_rates(rates)
+    total = correct + competing
+    return np.divide(correct, total, out=np.zeros(len(total)),
+                     where=total > 0)
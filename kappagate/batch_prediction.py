@@ -0,0 +1,93 @@
+"""Predict the accuracy of many assemblies at once, using a pool of processes.
+"""
+
+import os
+import itertools
+from concurrent.futures import (ProcessPoolExecutor, wait, FIRST_COMPLETED)
+
+from .predict_assembly_accuracy import predict_assembly_accuracy
+
+
+def _predict_job(job):
+    """Run one prediction of a batch. Errors are returned, not raised."""
+    index, slots, seed, parameters = job
+    try:
+        score, other_constructs, _ = predict_assembly_accuracy(
+            slots, seed=seed, **parameters)
+    except Exception as error:
+        return index, None, error
+    return index, score, other_constructs
+
+
+def predict_assembly_accuracy_batch(list_of_slots, n_jobs=None, seed=None,
+                                    max_pending_jobs=None, **parameters):
+    """Predict the accuracy of many assemblies, streaming the results.
+
+    Parameters
+    ----------
+
+    list_of_slots
+      A list (or any iterable, possibly a generator) of slots lists, each of
+      the form [(slot_name, left_overhang, right_overhang), ...]
+
+    n_jobs
+      Number of processes running simulations in parallel. Defaults to the
+      number of CPUs. With ``n_jobs=1`` everything is run in the current
+      process.
+
+    seed
+      If provided, job number ``i`` is simulated with seed ``seed + i``, so
+      the results of a batch are reproducible whatever the order in which
+      the jobs are completed.
+
+    max_pending_jobs
+      Maximal number of jobs submitted to the pool at any time (defaults to
+      twice ``n_jobs``). The slots iterable is only consumed as jobs
+      complete, which keeps the memory footprint bounded for very large
+      batches.
+
+    **parameters
+      Other parameters passed to ``predict_assembly_accuracy`` for every job,
+      e.g. ``duration``, ``initial_quantities``, ``annealing_data``...
+
+    Returns
+    -------
+
+    results
+      A generator of tuples ``(index, score, other_constructs)`` yielded as
+      the jobs complete (i.e. not necessarily in the order of
+      ``list_of_slots``). The index is the position of the job's slots in
+      ``list_of_slots``. If a job failed, its score is None and the
+      exception is given in place of ``other_constructs``. The Kappa
+      simulation results are not returned, to keep memory usage low.
+    """
+    jobs = (
+        (i, slots, None if seed is None else seed + i, parameters)
+        for i, slots in enumerate(list_of_slots)
+    )
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1:
+        for job in jobs:
+            yield _predict_job(job)
+        return
+    if max_pending_jobs is None:
+        max_pending_jobs = 2 * n_jobs
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = {}
+
+        def submit(n_new_jobs):
+            for job in itertools.islice(jobs, n_new_jobs):
+                pending[executor.submit(_predict_job, job)] = job[0]
+
+        submit(max_pending_jobs)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    yield index, None, error
+                else:
+                    yield future.result()
+            submit(max_pending_jobs - len(pending))
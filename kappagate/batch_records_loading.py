@@ -0,0 +1,155 @@
+"""Load the records of many assemblies at once, using a pool of processes.
+"""
+
+import os
+import copy
+import pickle
+import hashlib
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .tools import load_record
+
+
+def _record_cache_filepath(filename, cache_dir, parameters):
+    """Return the cache file of a record, identified by its file's content,
+    modification time, and the loading parameters."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        digest.update(f.read())
+    digest.update(repr(os.stat(filename).st_mtime_ns).encode())
+    digest.update(repr(sorted(parameters.items())).encode())
+    return os.path.join(cache_dir, digest.hexdigest() + '.pickle')
+
+
+def _load_job(job):
+    """Load one record, from the cache if possible."""
+    filename, cache_dir, parameters = job
+    if cache_dir is None:
+        return load_record(filename, **parameters)
+    filepath = _record_cache_filepath(filename, cache_dir, parameters)
+    if os.path.exists(filepath):
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)
+    record = load_record(filename, **parameters)
+    temporary_filepath = '%s.%d.tmp' % (filepath, os.getpid())
+    with open(temporary_filepath, 'wb') as f:
+        pickle.dump(record, f)
+    os.replace(temporary_filepath, filepath)
+    return record
+
+
+def load_records_batch(assemblies, n_jobs=None, cache_dir=None,
+                       max_pending_assemblies=None, **load_record_parameters):
+    """Load the records of many assemblies, streaming them per assembly.
+
+    Examples
+    --------
+
+    >>> assemblies = {'construct_1': ['partA.gb', 'partB.gb'],
+    >>>               'construct_2': ['partA.gb', 'partC.gb']}
+    >>> for name, records, error in load_records_batch(assemblies):
+    >>>     slots = parts_records_to_slots(records)
+
+    Parameters
+    ----------
+
+    assemblies
+      Either a dict {assembly_name: [filename, ...]} or a list (or any
+      iterable, possibly a generator) of lists of filenames.
+
+    n_jobs
+      Number of processes parsing records in parallel. Defaults to the
+      number of CPUs. With ``n_jobs=1`` the files are parsed in a thread of
+      the current process.
+
+    cache_dir
+      If provided, parsed records are saved in this directory, and files
+      with the same content and modification time are not parsed again in
+      later batches.
+
+    max_pending_assemblies
+      Maximal number of assemblies whose files are being parsed at any time
+      (defaults to twice ``n_jobs``). The assemblies iterable is only
+      consumed as assemblies are yielded.
+
+    **load_record_parameters
+      Parameters passed to ``load_record`` for every file, e.g.
+      ``topology``.
+
+    Returns
+    -------
+
+    results
+      A generator of tuples ``(assembly, records, error)`` yielded in the
+      order of ``assemblies``, where ``assembly`` is the assembly name (or
+      its index, if ``assemblies`` is not a dict). If one of the files of an
+      assembly could not be loaded, records is None and the exception is
+      given. Files shared by assemblies which are pending at the same time
+      are parsed only once (each assembly gets its own copy of the record).
+      Only the records of the pending assemblies are kept in memory, so use
+      ``cache_dir`` to avoid parsing again the files of distant
+      assemblies.
+    """
+    if isinstance(assemblies, dict):
+        assemblies = iter(assemblies.items())
+    else:
+        assemblies = enumerate(assemblies)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if max_pending_assemblies is None:
+        max_pending_assemblies = 2 * n_jobs
+    if cache_dir is not None and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    if n_jobs == 1:
+        executor = ThreadPoolExecutor(max_workers=1)
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+    with executor:
+        # Futures (and parsed records) are only kept for the files of the
+        # pending assemblies, so the memory used doesn't grow with the
+        # batch. Files needed again later are reloaded (from the cache_dir,
+        # if any).
+        futures = {}  # {filename: future}
+        n_users = {}  # {filename: number of pending assemblies using it}
+        yielded_files = set()
+        pending = deque()
+
+        def submit(n_new_assemblies):
+            for name, filenames in itertools.islice(assemblies,
+                                                    n_new_assemblies):
+                filenames = list(filenames)
+                for filename in filenames:
+                    if filename not in futures:
+                        job = (filename, cache_dir, load_record_parameters)
+                        futures[filename] = executor.submit(_load_job, job)
+                    n_users[filename] = n_users.get(filename, 0) + 1
+                pending.append((name, filenames))
+
+        def release(filenames):
+            for filename in filenames:
+                n_users[filename] -= 1
+                if n_users[filename] == 0:
+                    n_users.pop(filename)
+                    futures.pop(filename)
+                    yielded_files.discard(filename)
+
+        submit(max_pending_assemblies)
+        while pending:
+            name, filenames = pending.popleft()
+            try:
+                records = [futures[filename].result()
+                           for filename in filenames]
+            except Exception as error:
+                yield name, None, error
+            else:
+                for i, filename in enumerate(filenames):
+                    if filename in yielded_files:
+                        records[i] = copy.deepcopy(records[i])
+                    yielded_files.add(filename)
+                yield name, records, None
+            # New assemblies are submitted first, so that they reuse the
+            # files they share with the assembly just yielded.
+            submit(max_pending_assemblies - len(pending))
+            release(filenames)
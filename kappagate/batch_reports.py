@@ -0,0 +1,270 @@
+"""Generate reports on many assemblies (e.g. a plate of constructs) at once.
+
+The figures of each construct are rendered in a pool of processes, with
+Matplotlib's Agg canvas (no GUI backend involved), and gathered into a
+single multi-page PDF or an HTML bundle (a folder, zip file, or in-memory
+zip written with flametree).
+"""
+
+import os
+import html
+import itertools
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .annealing_matrix import slots_interaction_rates
+from .predict_assembly_accuracy import (slots_to_agents_and_rules,
+                                        predict_accuracy_from_agents_and_rules)
+from .colony_picking import success_rate_facts
+
+
+def _figure(figsize):
+    """Return a figure attached to an Agg canvas (without pyplot)."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _png(figure, dpi):
+    output = BytesIO()
+    figure.savefig(output, format='png', dpi=dpi, bbox_inches='tight')
+    return output.getvalue()
+
+
+def _construct_report(job):
+    """Predict the accuracy of a construct (if not provided) and render its
+    figures as PNG data. Errors are returned, not raised."""
+    from .reporting import (plot_colony_picking_graph,
+                            plot_circular_interactions)
+
+    (name, slots, score, seed, annealing_data, corrective_factor,
+     rules_parameters, plots_parameters, prediction_parameters, dpi) = job
+    result = dict(name=name, score=score, error=None)
+    try:
+        # The interaction rates are computed once, for both the prediction
+        # and the interactions plot.
+        rates = slots_interaction_rates(slots, annealing_data=annealing_data,
+                                        corrective_factor=corrective_factor)
+        if score is None:
+            agents, rules = slots_to_agents_and_rules(slots, rates=rates,
+                                                      **rules_parameters)
+            score, _, _ = predict_accuracy_from_agents_and_rules(
+                slots, agents, rules, seed=seed, **prediction_parameters)
+            result['score'] = score
+        result['facts'] = success_rate_facts(score)
+
+        figure = _figure((15, 5))
+        plot_colony_picking_graph(success_rate=score,
+                                  ax=figure.add_subplot(111))
+        result['colony_picking_png'] = _png(figure, dpi)
+
+        size = min(max(len(slots), 6), 12)
+        figure = _figure((size, size))
+        plot_circular_interactions(slots, rates=rates,
+                                   ax=figure.add_subplot(111),
+                                   **plots_parameters)
+        result['interactions_png'] = _png(figure, dpi)
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    return result
+
+
+def _pdf_page(result):
+    """Return a page (A4 portrait figure) of the PDF report."""
+    from matplotlib.image import imread
+
+    figure = _figure((8.27, 11.69))
+    title = result['name']
+    if result['score'] is not None:
+        title += ' - predicted valid clones: %.1f%%' % (100 * result['score'])
+    figure.text(0.5, 0.96, title, ha='center', va='top', size=14,
+                weight='bold')
+    text = result['error'] or result['facts']
+    figure.text(0.06, 0.92, text, ha='left', va='top', size=9, wrap=True)
+    if result['error'] is None:
+        for png, rectangle in [
+                (result['colony_picking_png'], (0.03, 0.63, 0.94, 0.24)),
+                (result['interactions_png'], (0.1, 0.02, 0.8, 0.58))]:
+            ax = figure.add_axes(rectangle)
+            ax.imshow(imread(BytesIO(png)))
+            ax.axis('off')
+    return figure
+
+
+def _ordered_results(jobs, n_jobs):
+    """Yield the results of the jobs in order, as they are computed, with at
+    most ``2 * n_jobs`` jobs submitted and not yet yielded."""
+    if n_jobs == 1:
+        for job in jobs:
+            yield _construct_report(job)
+        return
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque(executor.submit(_construct_report, job)
+                        for job, _ in zip(jobs, range(2 * n_jobs)))
+        while pending:
+            result = pending.popleft().result()
+            for job in itertools.islice(jobs, 1):
+                pending.append(executor.submit(_construct_report, job))
+            yield result
+
+
+def _html_index(results, title):
+    rows = []
+    for i, result in enumerate(results):
+        score = ('' if result['score'] is None
+                 else '%.1f%%' % (100 * result['score']))
+        if result['error'] is None:
+            figures = ''.join([
+                '<img src="figures/%03d_%s.png" width="%d"/>'
+                % (i, kind, width)
+                for kind, width in [('colony_picking', 600),
+                                    ('interactions', 400)]
+            ])
+            text = result['facts']
+        else:
+            figures, text = '', result['error']
+        rows.append(
+            '<tr><td><b>%s</b></td><td>%s</td><td>%s</td><td>%s</td></tr>'
+            % (html.escape(str(result['name'])), score, html.escape(text),
+               figures))
+    return '\n'.join([
+        '<html><head><meta charset="utf-8"><title>%s</title></head><body>'
+        % html.escape(title),
+        '<h1>%s</h1>' % html.escape(title),
+        '<table border="1" cellpadding="5">',
+        '<tr><th>Construct</th><th>Valid clones</th><th>Colony picking</th>'
+        '<th>Figures</th></tr>',
+    ] + rows + ['</table></body></html>'])
+
+
+def generate_batch_report(assemblies, target, scores=None, report_format=None,
+                          n_jobs=None, seed=None,
+                          annealing_data=('25C', '01h'),
+                          corrective_factor=1.0, min_rate=0,
+                          max_rules_per_site=None, rate_limit=200, top_k=10,
+                          dpi=100, title='Assemblies report',
+                          **prediction_parameters):
+    """Write a report on many assemblies, with one section per construct.
+
+    Each construct's section gives its predicted proportion of valid clones
+    and colony picking facts (see ``success_rate_facts``), its colony
+    picking graph, and the plot of its overhangs interactions. The
+    interaction rates of each construct are computed once and reused for
+    the prediction and the interactions plot. Each construct's section is
+    written as soon as it is ready, so the figures of the whole batch are
+    never held in memory at once.
+
+    Examples
+    --------
+
+    >>> assemblies = {'A1': slots_1, 'A2': slots_2, ...}
+    >>> generate_batch_report(assemblies, 'plate_report.pdf', n_jobs=8)
+    >>> generate_batch_report(assemblies, 'plate_report.zip', scores=scores)
+
+    Parameters
+    ----------
+
+    assemblies
+      A dict {construct_name: slots} (e.g. with well names as keys), or a
+      list of slots (named after their index), where slots are lists
+      [(slot_name, left_overhang, right_overhang), ...]
+
+    target
+      Path of the report. If ``report_format`` is 'pdf', a PDF file path or
+      a file-like object. If it is 'html', a folder path, a path ending in
+      '.zip', or '@memory' to get the zip data returned.
+
+    scores
+      A dict {construct_name: score} of already-predicted accuracies (e.g.
+      from ``predict_assembly_accuracy_batch``). Constructs not in this
+      dict are predicted.
+
+    report_format
+      Either 'pdf' or 'html'. By default, 'pdf' if the target path ends in
+      '.pdf', otherwise 'html'.
+
+    n_jobs
+      Number of processes predicting and rendering constructs in parallel.
+      Defaults to the number of CPUs. With ``n_jobs=1`` everything is run in
+      the current process.
+
+    seed
+      If provided, construct number ``i`` is simulated with seed
+      ``seed + i``, for reproducible reports.
+
+    annealing_data, corrective_factor, min_rate, max_rules_per_site
+      See ``predict_assembly_accuracy``.
+
+    rate_limit, top_k
+      Options of the interactions plots (see
+      ``plot_circular_interactions``).
+
+    dpi
+      Resolution of the figures.
+
+    title
+      Title of the HTML report.
+
+    **prediction_parameters
+      Other parameters of the predictions: ``duration``,
+      ``initial_quantities`` and ``engine`` (see
+      ``predict_assembly_accuracy``).
+
+    Returns
+    -------
+
+    data
+      The zip data if the target is '@memory', else None.
+    """
+    if not isinstance(assemblies, dict):
+        assemblies = dict(enumerate(assemblies))
+    if scores is None:
+        scores = {}
+    if report_format is None:
+        is_pdf = str(target).lower().endswith('.pdf')
+        report_format = 'pdf' if is_pdf else 'html'
+    if report_format not in ('pdf', 'html'):
+        raise ValueError("Unknown report format: %s" % report_format)
+    # Checked here, as errors in the jobs are reported on the constructs'
+    # pages rather than raised.
+    unknown_parameters = set(prediction_parameters).difference(
+        ['duration', 'initial_quantities', 'engine'])
+    if unknown_parameters:
+        raise TypeError("Unknown prediction parameters: %s"
+                        % ', '.join(sorted(unknown_parameters)))
+    rules_parameters = dict(min_rate=min_rate,
+                            max_rules_per_site=max_rules_per_site)
+    plots_parameters = dict(rate_limit=rate_limit, top_k=top_k)
+    jobs = [
+        (name, slots, scores.get(name), None if seed is None else seed + i,
+         annealing_data, corrective_factor, rules_parameters,
+         plots_parameters, prediction_parameters, dpi)
+        for i, (name, slots) in enumerate(assemblies.items())
+    ]
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    results = _ordered_results(jobs, n_jobs)
+
+    if report_format == 'pdf':
+        from matplotlib.backends.backend_pdf import PdfPages
+        with PdfPages(target) as pdf:
+            for result in results:
+                pdf.savefig(_pdf_page(result))
+        return None
+
+    from flametree import file_tree
+    root = file_tree(target)
+    figures = root._dir('figures')
+    index_entries = []
+    for i, result in enumerate(results):
+        if result['error'] is None:
+            for kind in ['colony_picking', 'interactions']:
+                figures._file('%03d_%s.png' % (i, kind)).write(
+                    result.pop(kind + '_png'), mode='wb')
+        index_entries.append(result)
+    root._file('index.html').write(_html_index(index_entries, title))
+    return root._close()
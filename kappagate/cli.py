@@ -0,0 +1,196 @@
+"""Command-line interface to score many assemblies in one process.
+
+Examples
+--------
+
+Score overhangs lists from a CSV or JSONL file, using 4 processes::
+
+    kappagate overhangs.csv --jobs 4 > scores.jsonl
+
+Score assemblies from directories of parts records (one directory per
+assembly) or from records of assembled constructs::
+
+    kappagate --parts-dirs assembly_1/ assembly_2/ --enzyme BsaI
+    kappagate --constructs constructs/ --backbone-annotations AmpR
+
+Results are written to the standard output as JSON lines, as they are
+computed (i.e. not necessarily in the order of the inputs).
+"""
+
+import os
+import csv
+import sys
+import json
+import argparse
+
+from .tools import (overhangs_list_to_slots, parts_records_to_slots,
+                    construct_record_to_slots, load_record)
+from .annealing_matrix import OVERHANGS_INDICES
+from .batch_records_loading import load_records_batch
+from .batch_prediction import predict_assembly_accuracy_batch
+
+RECORDS_EXTENSIONS = ('.gb', '.gbk', '.fa', '.fasta', '.dna')
+
+
+def _records_files(path):
+    """Return the record files of a directory (or the file itself)."""
+    if not os.path.isdir(path):
+        return [path]
+    return [
+        os.path.join(path, filename)
+        for filename in sorted(os.listdir(path))
+        if filename.lower().endswith(RECORDS_EXTENSIONS)
+    ]
+
+
+def _iter_overhangs_file(filepath):
+    """Yield (name, slots) for each overhangs list in a CSV or JSONL file.
+
+    In CSV files, each row is a list of overhangs, possibly preceded by a
+    name. In JSONL files, each line is either a list of overhangs or a dict
+    with a "name" and either "overhangs" or "slots".
+    """
+    basename = os.path.basename(filepath)
+    with open(filepath, 'r') as f:
+        if filepath.lower().endswith(('.jsonl', '.json')):
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if isinstance(data, list):
+                    data = dict(overhangs=data)
+                name = data.get('name', '%s:%d' % (basename, i + 1))
+                if 'slots' in data:
+                    yield name, [tuple(slot) for slot in data['slots']]
+                else:
+                    yield name, overhangs_list_to_slots(data['overhangs'])
+        else:
+            for i, row in enumerate(csv.reader(f)):
+                row = [cell.strip() for cell in row if cell.strip()]
+                if not row:
+                    continue
+                name = '%s:%d' % (basename, i + 1)
+                if row[0].upper() not in OVERHANGS_INDICES:
+                    name, row = row[0], row[1:]
+                yield name, overhangs_list_to_slots(
+                    [cell.upper() for cell in row])
+
+
+def iter_assemblies_slots(overhangs_files=(), parts_dirs=(), constructs=(),
+                          enzyme='auto', backbone_annotations=(),
+                          n_jobs=None, records_cache_dir=None):
+    """Yield (name, slots, error) for all the assemblies of the inputs.
+
+    If the slots of an assembly cannot be computed, slots is None and the
+    error is given. The parts records are parsed in parallel with
+    ``load_records_batch`` (see this function for ``n_jobs`` and
+    ``records_cache_dir``).
+    """
+    for filepath in overhangs_files:
+        for name, slots in _iter_overhangs_file(filepath):
+            yield name, slots, None
+    assemblies_records = load_records_batch(
+        [_records_files(directory) for directory in parts_dirs],
+        n_jobs=n_jobs, cache_dir=records_cache_dir,
+        default_topology='circular')
+    for index, records, error in assemblies_records:
+        name = os.path.basename(os.path.normpath(parts_dirs[index]))
+        if error is not None:
+            yield name, None, error
+            continue
+        try:
+            yield name, parts_records_to_slots(records, enzyme=enzyme), None
+        except Exception as error:
+            yield name, None, error
+    for path in constructs:
+        for filepath in _records_files(path):
+            try:
+                record = load_record(filepath, topology='circular')
+                slots = construct_record_to_slots(
+                    record, backbone_annotations=backbone_annotations)
+                yield record.id, slots, None
+            except Exception as error:
+                yield filepath, None, error
+
+
+def _error_message(error):
+    return '%s: %s' % (type(error).__name__, error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='kappagate',
+        description='Predict the valid-clone rates of Golden Gate assemblies.',
+        epilog=__doc__.split('Examples')[0].strip())
+    parser.add_argument('overhangs_files', nargs='*',
+                        help='CSV or JSONL files of overhangs lists.')
+    parser.add_argument('--parts-dirs', nargs='+', default=[],
+                        help='Directories of parts records, one directory '
+                             'per assembly.')
+    parser.add_argument('--constructs', nargs='+', default=[],
+                        help='Records of assembled constructs, or '
+                             'directories of such records.')
+    parser.add_argument('--enzyme', default='auto')
+    parser.add_argument('--records-cache', default=None,
+                        help='Directory where parsed parts records are '
+                             'cached between runs.')
+    parser.add_argument('--backbone-annotations', nargs='+', default=[])
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Number of parallel processes (default: all '
+                             'CPUs).')
+    parser.add_argument('--engine', default='kappa',
+                        choices=['kappa', 'ode', 'population'])
+    parser.add_argument('--duration', type=float, default=1000)
+    parser.add_argument('--initial-quantities', type=int, default=1000)
+    parser.add_argument('--annealing-data', default='25C/01h',
+                        help='Temperature/duration of the annealing data, '
+                             'e.g. 25C/01h.')
+    parser.add_argument('--corrective-factor', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--with-constructs', action='store_true',
+                        help='Also output the proportions of all observed '
+                             'constructs.')
+    args = parser.parse_args(argv)
+
+    names = []
+
+    def valid_slots():
+        for name, slots, error in iter_assemblies_slots(
+                overhangs_files=args.overhangs_files,
+                parts_dirs=args.parts_dirs, constructs=args.constructs,
+                enzyme=args.enzyme,
+                backbone_annotations=args.backbone_annotations,
+                n_jobs=args.jobs, records_cache_dir=args.records_cache):
+            if error is not None:
+                write_result(name, None, None, error)
+            else:
+                names.append(name)
+                yield slots
+
+    def write_result(name, score, other_constructs, error):
+        result = dict(name=name, score=score)
+        if error is not None:
+            result['error'] = _error_message(error)
+        elif args.with_constructs:
+            result['constructs'] = [
+                dict(slots=list(construct), proportion=proportion)
+                for construct, proportion in sorted(
+                    other_constructs.items(), key=lambda item: -item[1])
+            ]
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
+    predictions = predict_assembly_accuracy_batch(
+        valid_slots(), n_jobs=args.jobs, seed=args.seed, engine=args.engine,
+        duration=args.duration, initial_quantities=args.initial_quantities,
+        annealing_data=tuple(args.annealing_data.split('/')),
+        corrective_factor=args.corrective_factor)
+    for index, score, other_constructs in predictions:
+        if score is None:
+            write_result(names[index], None, None, other_constructs)
+        else:
+            write_result(names[index], score, other_constructs, None)
+
+
+if __name__ == '__main__':
+    main()
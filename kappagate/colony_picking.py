@@ -0,0 +1,163 @@
+"""Colony picking statistics: how many clones to pick given a success rate.
+
+The functions accept single success rates as well as numpy arrays or pandas
+Series of success rates (e.g. the predictions for thousands of constructs),
+and are vectorized.
+"""
+
+import sys
+import math
+
+import numpy as np
+
+
+def _is_scalar(value):
+    return isinstance(value, (int, float, np.number))
+
+
+def _same_type(result, template):
+    """Return the result array as a scalar, an array or a pandas Series,
+    like the template."""
+    pandas = sys.modules.get('pandas')  # Only loaded if already imported.
+    if (pandas is not None) and isinstance(template, pandas.Series):
+        return pandas.Series(result, index=template.index,
+                             name=template.name)
+    if np.ndim(template) == 0:
+        return result[()]
+    return result
+
+
+def min_trials_for_one_success(success_rate, certainty):
+    """Return the minimal number of trials to be X% certain to have at least
+    one success.
+
+    The number of trials is 1 for a success rate of 1, and infinite for a
+    success rate of 0.
+    """
+    if _is_scalar(success_rate):
+        # Faster than the vectorized version, for single success rates.
+        if success_rate >= 1:
+            return 1
+        if success_rate <= 0:
+            return np.inf
+        if math.isnan(success_rate):
+            return np.nan
+        return np.ceil(np.log(1 - certainty) / np.log(1 - success_rate))
+    rates = np.asarray(success_rate, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trials = np.ceil(np.log(1 - certainty) / np.log(1 - rates))
+    trials = np.where(rates >= 1, 1.0, np.where(rates <= 0, np.inf, trials))
+    return _same_type(trials, success_rate)
+
+
+def average_trials_until_success(success_rate):
+    """Return the average number of trials before a success is encountered.
+
+    The number of trials is infinite for a success rate of 0.
+    """
+    if _is_scalar(success_rate):
+        return np.inf if success_rate <= 0 else 1.0 / success_rate
+    rates = np.asarray(success_rate, dtype=float)
+    with np.errstate(divide='ignore'):
+        trials = np.where(rates <= 0, np.inf, 1.0 / rates)
+    return _same_type(trials, success_rate)
+
+
+def _facts_text(facts):
+    if np.isnan(facts['success_rate_percent']):
+        return "The valid colony rate is unknown."
+    if facts['success_rate_percent'] <= 0:
+        return ("The valid colony rate is 0.0%. No valid clone can be "
+                "expected.")
+    return (
+        "The valid colony rate is %(success_rate_percent).1f%%. Expect "
+        "%(average_colonies).1f clones in average until "
+        "success. Pick %(min_trials_q95)d clones or more for 95%% chances of "
+        "at least one success. If no success after %(max_trials_q99)d clones, "
+        "there is likely another problem (p-value=0.01)") % facts
+
+
+def success_rate_facts(success_rate, plain_text=True):
+    """Return relevant stats for the given success rate.
+
+    Parameters
+    ----------
+    success_rate
+      A success rate between 0 and 1, or an array or pandas Series of
+      success rates.
+
+    plain_text
+      If True, a text is returned (or a list of texts, for several success
+      rates), otherwise a dict.
+
+    Returns
+    -------
+    plain_text (if plain_text=True)
+      A plain text as follows: "The valid colony rate is 47.7%. Expect 1.9
+      clones in average until success. Pick 5 clones or more for 95% chances
+      of at least one success. If no success after 8 clones, there is
+      likely another problem (p-value=0.01)"
+
+    dict (if plain_text=False)
+      Dict containing the same infos as above: dict(success_rate_percent,
+      average_colonies, min_trials_q95, max_trials_q99), with arrays (or
+      Series) as values for several success rates.
+    """
+    if _is_scalar(success_rate):
+        percents = 100 * success_rate
+    else:
+        percents = _same_type(100 * np.asarray(success_rate, dtype=float),
+                              success_rate)
+    facts = dict(
+        success_rate_percent=percents,
+        average_colonies=average_trials_until_success(success_rate),
+        min_trials_q95=min_trials_for_one_success(success_rate, 0.95),
+        max_trials_q99=min_trials_for_one_success(success_rate, 0.99)
+    )
+    if not plain_text:
+        return facts
+    if _is_scalar(success_rate):
+        return _facts_text(facts)
+    return [
+        _facts_text(dict(zip(facts, values)))
+        for values in zip(*[np.asarray(v) for v in facts.values()])
+    ]
+
+
+def success_rate_facts_table(success_rates, with_text=False):
+    """Return the colony picking stats of many success rates, as a table.
+
+    Parameters
+    ----------
+    success_rates
+      A list, array, pandas Series or dict {name: success_rate} of success
+      rates. The names (or the Series index) are used as the table's index.
+
+    with_text
+      If True, the table has an extra ``text`` column with the plain text
+      of ``success_rate_facts`` for each success rate (slower).
+
+    Returns
+    -------
+    table
+      A pandas dataframe with columns ``success_rate``,
+      ``success_rate_percent``, ``average_colonies``, ``min_trials_q95``
+      and ``max_trials_q99`` (see ``success_rate_facts``), and one row per
+      success rate.
+    """
+    import pandas
+
+    if isinstance(success_rates, dict):
+        success_rates = pandas.Series(success_rates)
+    index = (success_rates.index
+             if isinstance(success_rates, pandas.Series) else None)
+    rates = np.asarray(success_rates, dtype=float)
+    table = pandas.DataFrame(
+        success_rate_facts(rates, plain_text=False), index=index)
+    table.insert(0, 'success_rate', rates)
+    if with_text:
+        table['text'] = [
+            _facts_text(facts)
+            for facts in table.drop(columns='success_rate').to_dict('records')
+        ]
+    return table
@@ -0,0 +1,194 @@
+"""Assembly model which can be updated one overhang at a time."""
+
+import numpy as np
+from topkappy import KappaAgent
+
+from .annealing_matrix import (get_annealing_matrix, overhangs_to_indices,
+                               REVERSE_COMPLEMENT_INDICES)
+from .predict_assembly_accuracy import (
+    interaction_rule, predict_accuracy_from_agents_and_rules)
+
+# Code of the "null site" (e.g. "LEFT", "RIGHT"), which interacts with nothing.
+NULL_SITE = 256
+
+
+class IncrementalAssemblyModel:
+    """Agents and rules of an assembly, updated incrementally.
+
+    When an overhang of the assembly is changed, only the rates and rules
+    involving the modified slots are recomputed (i.e. O(n) work instead of
+    O(n^2) for ``slots_to_agents_and_rules``). The total misligation rate
+    (sum of the rates of all rules except the ones of the expected
+    junctions) is kept up to date, and the effect of a change on this rate
+    can be computed without applying the change, which makes it a cheap
+    score for local-search algorithms.
+
+    Examples
+    --------
+
+    >>> model = IncrementalAssemblyModel(overhangs_list_to_slots(overhangs))
+    >>> delta = model.delta_misligation_rate(junction=3, overhang='ACTG')
+    >>> if delta < 0:
+    >>>     model.replace_overhang(junction=3, overhang='ACTG')
+    >>> score, _, _ = model.predict_assembly_accuracy()
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    annealing_data
+      Either a pandas dataframe or a couple (temperature, duration) indicating
+      an experimental dataset from Potapov et al. 2018
+
+    corrective_factor
+      A factor that can be applied to decrease (when <1) or increase (>1)
+      the differences in affinity in the dataset.
+    """
+
+    def __init__(self, slots, annealing_data=('25C', '01h'),
+                 corrective_factor=1.0):
+        matrix = get_annealing_matrix(annealing_data)
+        self.matrix = np.zeros((NULL_SITE + 1, NULL_SITE + 1))
+        np.power(matrix, corrective_factor, where=matrix > 0,
+                 out=self.matrix[:NULL_SITE, :NULL_SITE])
+        self.slots = list(slots)
+        self.agents = [KappaAgent(name, (left, right))
+                       for name, left, right in self.slots]
+        self.lefts = self._sites_codes([left for _, left, _ in self.slots])
+        self.rights = self._sites_codes([right for _, _, right in self.slots])
+        all_slots = np.arange(len(self.slots))
+        self.rates, _ = self._slots_rates(all_slots, self.lefts, self.rights)
+        self._rules = {}
+        self._update_rules(all_slots)
+        self.misligation_rate = (self.rates.sum() -
+                                 self._junctions_rates(self.rates).sum())
+
+    @staticmethod
+    def _sites_codes(overhangs):
+        codes = overhangs_to_indices(overhangs)
+        codes[codes < 0] = NULL_SITE
+        return codes
+
+    @staticmethod
+    def _reverse_complement(codes):
+        return np.where(codes == NULL_SITE, NULL_SITE,
+                        REVERSE_COMPLEMENT_INDICES[codes % NULL_SITE])
+
+    @staticmethod
+    def _junctions_rates(rates):
+        n_slots = rates.shape[0]
+        return rates[np.arange(n_slots - 1), np.arange(1, n_slots), 0]
+
+    def _slots_rates(self, slots_indices, lefts, rights):
+        """Return the rates (rows, columns) of the given slots' sites."""
+        lefts_rc = self._reverse_complement(lefts)
+        rows = np.stack([
+            self.matrix[rights[slots_indices, None], lefts_rc[None, :]],
+            self.matrix[rights[slots_indices, None], rights[None, :]]
+        ], axis=-1)
+        columns = np.stack([
+            self.matrix[rights[:, None], lefts_rc[None, slots_indices]],
+            self.matrix[rights[:, None], rights[None, slots_indices]]
+        ], axis=-1)
+        return rows, columns
+
+    def _changed_sites(self, changes):
+        """Return the slots indices and sites codes after the changes.
+
+        ``changes`` is a dict {slot_index: (new_left, new_right)}.
+        """
+        lefts, rights = self.lefts.copy(), self.rights.copy()
+        for index, (left, right) in changes.items():
+            lefts[index], rights[index] = self._sites_codes([left, right])
+        return sorted(changes), lefts, rights
+
+    def _affected_rates_sum(self, slots_indices, lefts, rights):
+        """Sum of the rates involving at least one of the slots' sites,
+        minus the rates of the expected junctions involving these slots."""
+        rows, columns = self._slots_rates(slots_indices, lefts, rights)
+        other_slots = np.ones(len(lefts), dtype=bool)
+        other_slots[slots_indices] = False
+        total = rows.sum() + columns[other_slots].sum()
+        junctions = set([i for index in slots_indices
+                         for i in (index - 1, index)
+                         if 0 <= i < len(lefts) - 1])
+        for i in junctions:
+            code = self._reverse_complement(lefts[i + 1:i + 2])[0]
+            total -= self.matrix[rights[i], code]
+        return total
+
+    def _junction_changes(self, junction, overhang):
+        _, left, _ = self.slots[junction]
+        _, _, next_right = self.slots[junction + 1]
+        return {junction: (left, overhang),
+                junction + 1: (overhang, next_right)}
+
+    def delta_misligation_rate(self, junction=None, overhang=None,
+                               changes=None):
+        """Return the change in misligation rate if an overhang is replaced.
+
+        Either provide a ``junction`` (index i of the junction between slots
+        i and i+1) and the new ``overhang`` at this junction, or a dict of
+        ``changes`` {slot_index: (new_left, new_right)}. The model is not
+        modified.
+        """
+        if changes is None:
+            changes = self._junction_changes(junction, overhang)
+        slots_indices, lefts, rights = self._changed_sites(changes)
+        return (self._affected_rates_sum(slots_indices, lefts, rights) -
+                self._affected_rates_sum(slots_indices, self.lefts,
+                                         self.rights))
+
+    def replace_overhang(self, junction, overhang):
+        """Replace the overhang at the junction between slots i and i+1."""
+        self.set_slots_overhangs(self._junction_changes(junction, overhang))
+
+    def set_slots_overhangs(self, changes):
+        """Change the overhangs of some slots.
+
+        ``changes`` is a dict {slot_index: (new_left, new_right)}.
+        """
+        self.misligation_rate += self.delta_misligation_rate(changes=changes)
+        slots_indices, self.lefts, self.rights = self._changed_sites(changes)
+        for index, (left, right) in changes.items():
+            name = self.slots[index][0]
+            self.slots[index] = (name, left, right)
+            self.agents[index] = KappaAgent(name, (left, right))
+        rows, columns = self._slots_rates(slots_indices, self.lefts,
+                                          self.rights)
+        self.rates[slots_indices] = rows
+        self.rates[:, slots_indices] = columns
+        self._update_rules(slots_indices)
+
+    def _update_rules(self, slots_indices):
+        n_slots = len(self.slots)
+        for index in slots_indices:
+            for other, side in np.ndindex(n_slots, 2):
+                self._rules.pop((index, other, side), None)
+                self._rules.pop((other, index, side), None)
+        for index in slots_indices:
+            row_keys = [(index, i2, side) for i2, side
+                        in zip(*np.nonzero(self.rates[index]))]
+            column_keys = [(i1, index, side) for i1, side
+                           in zip(*np.nonzero(self.rates[:, index]))]
+            for i1, i2, side in row_keys + column_keys:
+                key = (int(i1), int(i2), int(side))
+                self._rules[key] = interaction_rule(
+                    self.agents[i1], self.agents[i2], side,
+                    self.rates[key])
+
+    @property
+    def rules(self):
+        """List of the model's rules, as in ``slots_to_agents_and_rules``."""
+        return [self._rules[key] for key in sorted(self._rules)]
+
+    def predict_assembly_accuracy(self, **parameters):
+        """Predict the accuracy of the assembly in its current state.
+
+        The parameters (duration, initial_quantities, seed, engine) are the
+        same as in ``predict_assembly_accuracy``.
+        """
+        return predict_accuracy_from_agents_and_rules(
+            self.slots, self.agents, self.rules, **parameters)
@@ -0,0 +1,171 @@
+"""Split assemblies into clusters of interacting junctions, solved separately.
+
+In the ODE model of the ligation (see ``ode_simulation``), the quantities of
+free sites only depend on the rules involving these sites. The junctions of
+an assembly can therefore be grouped into clusters, where two junctions are
+in the same cluster if a rule binds a site of one to a site of the other,
+and each cluster can be solved on its own. Ignoring the weakest couplings
+between junctions (with a coupling threshold) gives smaller clusters, so the
+cost of a prediction scales with the largest cluster rather than with the
+whole assembly.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .predict_assembly_accuracy import slots_to_agents_and_rules
+from .ode_simulation import (simulate_ligation_ode, junction_fidelity,
+                             _quantities_by_agent_name)
+
+
+def _sites_junctions(slots):
+    """Return a dict {(slot_name, site): junction_index}.
+
+    The outer sites of the first and last slots, which belong to no
+    junction, are mapped to the first and last junctions.
+    """
+    sites_junctions = {}
+    if len(slots) > 1:
+        sites_junctions[(slots[0][0], slots[0][1])] = 0
+        sites_junctions[(slots[-1][0], slots[-1][2])] = len(slots) - 2
+    for i, ((name1, _, right), (name2, left, _)) in enumerate(
+            zip(slots, slots[1:])):
+        sites_junctions[(name1, right)] = i
+        sites_junctions[(name2, left)] = i
+    return sites_junctions
+
+
+def interaction_clusters(slots, rules, coupling_threshold=0):
+    """Group the junctions of an assembly into clusters of interacting
+    junctions.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    rules
+      List of Topkappy rules, as returned by ``slots_to_agents_and_rules``.
+
+    coupling_threshold
+      Rules with a rate lower than this value do not couple junctions, i.e.
+      they do not bring the junctions of their sites in the same cluster.
+
+    Returns
+    -------
+
+    clusters, clusters_rules, decoupled_rate
+      Where clusters is a list of lists of junctions indices (junction i
+      being between slots i and i+1), clusters_rules gives the list of rules
+      of each cluster, and decoupled_rate is the sum of the rates of the
+      rules ignored because they bind sites from different clusters.
+    """
+    import networkx as nx
+
+    sites_junctions = _sites_junctions(slots)
+    graph = nx.Graph()
+    graph.add_nodes_from(range(len(slots) - 1))
+    rules_junctions = []
+    for rule in rules:
+        site1, site2 = [(reactant.agent, reactant.site)
+                        for reactant in rule.reactants]
+        junctions = (sites_junctions[site1], sites_junctions[site2])
+        rules_junctions.append(junctions)
+        if rule.rate >= coupling_threshold:
+            graph.add_edge(*junctions)
+    clusters = sorted(sorted(c) for c in nx.connected_components(graph))
+    junctions_clusters = {junction: i
+                          for i, cluster in enumerate(clusters)
+                          for junction in cluster}
+    clusters_rules = [[] for _ in clusters]
+    decoupled_rate = 0
+    for rule, (junction1, junction2) in zip(rules, rules_junctions):
+        cluster = junctions_clusters[junction1]
+        if cluster == junctions_clusters[junction2]:
+            clusters_rules[cluster].append(rule)
+        else:
+            decoupled_rate += rule.rate
+    return clusters, clusters_rules, decoupled_rate
+
+
+def _solve_cluster(job):
+    """Return the fidelities of a cluster's junctions, with the ODE model."""
+    cluster, slots, agents, rules, initial_quantities, duration = job
+    bonds = simulate_ligation_ode(agents, rules, initial_quantities,
+                                  duration=duration)
+    bonds = dict(zip([rule.name for rule in rules], bonds.tolist()))
+    return [junction_fidelity(slots[i], slots[i + 1], bonds,
+                              initial_quantities)
+            for i in cluster]
+
+
+def predict_assembly_accuracy_by_clusters(
+        slots, coupling_threshold=0, duration=1000, initial_quantities=1000,
+        corrective_factor=1.0, annealing_data=('25C', '01h'), n_jobs=1):
+    """Predict the assembly accuracy by solving each cluster of interacting
+    junctions separately, with the ODE model.
+
+    With ``coupling_threshold=0`` the prediction is the same as with
+    ``predict_assembly_accuracy(slots, engine='ode')``. Higher thresholds
+    ignore weak couplings between junctions, which gives smaller clusters
+    (faster to solve) at the cost of some accuracy.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    coupling_threshold
+      Rules with a rate lower than this value are ignored when they bind
+      sites of junctions which are not otherwise in the same cluster. See
+      ``interaction_clusters``.
+
+    duration, initial_quantities, corrective_factor, annealing_data
+      See ``predict_assembly_accuracy``.
+
+    n_jobs
+      Number of processes solving clusters in parallel. Solving small
+      clusters is fast, so parallelization only pays off for assemblies with
+      large clusters.
+
+    Returns
+    -------
+
+    proportion, constructs, simulation_results
+      Where proportion is the proportion of good clones, constructs is a
+      dict {slots_order: proportion} with only the expected construct, and
+      simulation_results is a dict with the ``clusters`` (lists of junctions
+      indices), the ``junctions_fidelities``, and the ``decoupled_rate``
+      (see ``interaction_clusters``).
+    """
+    agents, rules = slots_to_agents_and_rules(
+        slots, annealing_data=annealing_data,
+        corrective_factor=corrective_factor)
+    initial_quantities = _quantities_by_agent_name(agents,
+                                                   initial_quantities)
+    clusters, clusters_rules, decoupled_rate = interaction_clusters(
+        slots, rules, coupling_threshold=coupling_threshold)
+    jobs = []
+    for cluster, cluster_rules in zip(clusters, clusters_rules):
+        slots_indices = sorted(set(cluster) | set(i + 1 for i in cluster))
+        cluster_agents = [agents[i] for i in slots_indices]
+        jobs.append((cluster, slots, cluster_agents, cluster_rules,
+                     initial_quantities, duration))
+    if n_jobs == 1:
+        clusters_fidelities = [_solve_cluster(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            clusters_fidelities = list(executor.map(_solve_cluster, jobs))
+    junctions_fidelities = [0] * (len(slots) - 1)
+    for cluster, fidelities in zip(clusters, clusters_fidelities):
+        for junction, fidelity in zip(cluster, fidelities):
+            junctions_fidelities[junction] = fidelity
+    proportion = float(np.prod(junctions_fidelities))
+    expected_slots_order = tuple(name for name, _, _ in slots)
+    simulation_results = dict(clusters=clusters,
+                              junctions_fidelities=junctions_fidelities,
+                              decoupled_rate=decoupled_rate)
+    return proportion, {expected_slots_order: proportion}, simulation_results
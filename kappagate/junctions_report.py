@@ -0,0 +1,114 @@
+"""Report on the fidelity of each junction, computed from the annealing rates
+only (i.e. without simulation)."""
+
+import numpy as np
+
+from .annealing_matrix import (slots_interaction_rates, junctions_rates,
+                               junctions_fidelities)
+
+
+def _junctions_competing_interactions(rates):
+    """Return the interactions competing at each junction, as arrays of
+    shape (n_slots - 1, 4 * n_slots) of their rates (padded with zeros) and
+    of their flat indices in ``rates``. See ``junctions_rates``."""
+    n_slots = rates.shape[0]
+    junctions = np.arange(n_slots - 1)[:, None]
+    slots = np.arange(n_slots)[None, :]
+
+    def flat_indices(slot1, slot2, side):
+        return (slot1 * n_slots + slot2) * 2 + side
+
+    is_other = slots != junctions
+    indices, valid = zip(*[
+        # Slot i's right site, with any site but slot i+1's left site.
+        (flat_indices(junctions, slots, 0), slots != junctions + 1),
+        (flat_indices(junctions, slots, 1), np.ones_like(is_other)),
+        # Slot i's right site as the second site (except with itself).
+        (flat_indices(slots, junctions, 1), is_other),
+        # Slot i+1's left site (except with slot i's right site).
+        (flat_indices(slots, junctions + 1, 0), is_other),
+    ])
+    indices = np.hstack(indices)
+    return np.where(np.hstack(valid), rates.ravel()[indices], 0), indices
+
+
+def junctions_report(slots, annealing_data=('25C', '01h'),
+                     corrective_factor=1.0, n_offenders=3, rates=None):
+    """Return a report on the fidelity of each junction of an assembly.
+
+    The expected fidelity of a junction is the proportion of the annealing
+    rates involving the junction's sites which corresponds to the correct
+    ligation. This approximation (which neglects the depletion of the sites
+    over time) is fast enough to be computed for many candidate assemblies,
+    and points to the bottleneck junctions and the overhangs responsible.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    annealing_data
+      Either a pandas dataframe or a couple (temperature, duration) indicating
+      an experimental dataset from Potapov et al. 2018
+
+    corrective_factor
+      A factor that can be applied to decrease (when <1) or increase (>1)
+      the differences in affinity in the dataset.
+
+    n_offenders
+      Number of strongest competing interactions reported for each junction.
+
+    rates
+      Precomputed interaction rates (see ``slots_interaction_rates``), in
+      which case ``annealing_data`` and ``corrective_factor`` are ignored.
+
+    Returns
+    -------
+
+    report
+      A pandas dataframe with one row per junction and columns ``junction``
+      (index i of the junction between slots i and i+1), ``left_slot``,
+      ``right_slot``, ``overhang``, ``correct_rate``, ``competing_rate``
+      (sum of the rates of all other interactions of the junction's sites),
+      ``correct_to_competing_ratio``, ``expected_fidelity``, and for each of
+      the strongest competing interactions ``offender_i`` (a couple of
+      (slot_name, overhang) sites) and ``offender_i_rate``. The product of
+      the expected fidelities estimates the proportion of good clones.
+    """
+    import pandas
+
+    if rates is None:
+        rates = slots_interaction_rates(slots, annealing_data=annealing_data,
+                                        corrective_factor=corrective_factor)
+    correct, competing = junctions_rates(rates)
+    fidelities = junctions_fidelities(rates)
+    ratios = np.divide(correct, competing, out=np.full(len(correct), np.inf),
+                       where=competing > 0)
+    competing_rates, competing_indices = _junctions_competing_interactions(
+        rates)
+    offenders = np.argsort(-competing_rates, axis=1,
+                           kind='stable')[:, :n_offenders]
+
+    def site(slot_index, side):
+        name, left, right = slots[slot_index]
+        return (name, (left, right)[side])
+
+    rows = []
+    for i in range(len(slots) - 1):
+        row = dict(junction=i, left_slot=slots[i][0],
+                   right_slot=slots[i + 1][0], overhang=slots[i][2],
+                   correct_rate=correct[i], competing_rate=competing[i],
+                   correct_to_competing_ratio=ratios[i],
+                   expected_fidelity=fidelities[i])
+        for k, column in enumerate(offenders[i]):
+            rate = competing_rates[i, column]
+            offender = None
+            if rate > 0:
+                slot1, slot2, side = np.unravel_index(
+                    competing_indices[i, column], rates.shape)
+                offender = (site(slot1, 1), site(slot2, side))
+            row['offender_%d' % (k + 1)] = offender
+            row['offender_%d_rate' % (k + 1)] = rate
+        rows.append(row)
+    return pandas.DataFrame(rows)
@@ -0,0 +1,155 @@
+"""Deterministic (mean-field) simulation of the assembly ligation reaction.
+
+Instead of simulating individual molecules like Kappa does, the reaction is
+modeled at the level of the parts' binding sites: each rule binds two free
+sites at a rate proportional to the product of their free quantities, and
+the resulting system of ODEs is solved numerically. This is fast and
+noise-free, but neglects correlations between the sites of a same complex.
+"""
+
+import numpy as np
+
+
+def _quantities_by_agent_name(agents, initial_quantities):
+    """Return a dict {agent_name: initial_quantity}."""
+    if isinstance(initial_quantities, int):
+        return {agent.name: initial_quantities for agent in agents}
+    return {
+        getattr(agent, 'name', agent): quantity
+        for agent, quantity in initial_quantities.items()
+    }
+
+
+def _check_distinct_sites(agents):
+    """Raise an error if an agent has two sites with the same name.
+
+    Sites are named after their overhang, and rules refer to sites by name,
+    so the sites of a slot with identical left and right overhangs cannot
+    be told apart.
+    """
+    for agent in agents:
+        if len(set(agent.sites)) < len(agent.sites):
+            raise ValueError(
+                "Slot %s has identical left and right overhangs (%s), which "
+                "is not supported." % (agent.name, agent.sites[0]))
+
+
+def simulate_ligation_ode(agents, rules, initial_quantities, duration=1000):
+    """Return the quantity of bonds created by each rule at the given time.
+
+    Parameters
+    ----------
+
+    agents, rules
+      Lists of Topkappy agents and rules, as returned by
+      ``slots_to_agents_and_rules``.
+
+    initial_quantities
+      Either a dict {agent: initial_quantity} (with agents or agent names as
+      keys) or an integer in case all agents start with the same quantity.
+
+    duration
+      Virtual duration of the reaction (same time units as in Kappa).
+
+    Returns
+    -------
+
+    bonds
+      An array with the number of bonds formed by each rule of ``rules``
+      at the end of the reaction.
+    """
+    from scipy.integrate import solve_ivp
+    _check_distinct_sites(agents)
+    initial_quantities = _quantities_by_agent_name(agents,
+                                                   initial_quantities)
+    sites_indices = {}
+    sites_quantities = []
+    for agent in agents:
+        for site in agent.sites:
+            sites_indices[(agent.name, site)] = len(sites_quantities)
+            sites_quantities.append(initial_quantities[agent.name])
+    if len(rules) == 0:
+        return np.zeros(0)
+    reactants = np.array([
+        [sites_indices[(reactant.agent, reactant.site)]
+         for reactant in rule.reactants]
+        for rule in rules
+    ])
+    rates = np.array([float(rule.rate) for rule in rules])
+    site1, site2 = reactants.T
+    n_sites, n_rules = len(sites_quantities), len(rules)
+
+    def derivatives(t, state):
+        free_sites = state[:n_sites]
+        fluxes = rates * free_sites[site1] * free_sites[site2]
+        consumption = (np.bincount(site1, fluxes, minlength=n_sites) +
+                       np.bincount(site2, fluxes, minlength=n_sites))
+        return np.concatenate([-consumption, fluxes])
+
+    initial_state = np.concatenate([sites_quantities, np.zeros(n_rules)])
+    solution = solve_ivp(derivatives, (0, duration), initial_state,
+                         method='LSODA', rtol=1e-8,
+                         atol=1e-10 * max(sites_quantities))
+    return solution.y[n_sites:, -1]
+
+
+def junction_fidelity(slot1, slot2, bonds, initial_quantities):
+    """Return the proportion of correct ligations between two slots.
+
+    ``bonds`` is a dict {rule_name: quantity} and ``initial_quantities`` a
+    dict {agent_name: initial_quantity}.
+    """
+    name1, name2 = slot1[0], slot2[0]
+    return (1.0 * bonds.get('%s-left.%s-left' % (name1, name2), 0) /
+            min(initial_quantities[name1], initial_quantities[name2]))
+
+
+def ode_assembly_accuracy(slots, agents, rules, initial_quantities,
+                          duration=1000):
+    """Predict the proportion of good clones with the ODE model.
+
+    The proportion is computed as the product, over all junctions of the
+    assembly, of the proportion of left-part sites which bonded with the
+    right partner.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    agents, rules
+      Lists of Topkappy agents and rules, as returned by
+      ``slots_to_agents_and_rules``.
+
+    initial_quantities
+      Either a dict {agent: initial_quantity} or an integer in case all
+      agents start with the same initial quantity.
+
+    duration
+      Virtual duration of the reaction (same time units as in Kappa).
+
+    Returns
+    -------
+
+    proportion, constructs, simulation_results
+      Where proportion is the proportion of good clones, constructs is a
+      dict {slots_order: proportion} with only the expected construct, and
+      simulation_results is a dict with the ``bonds`` formed by each rule
+      (as a dict {rule_name: quantity}) and the ``junctions_fidelities``
+      (proportion of correct ligations at each junction).
+    """
+    initial_quantities = _quantities_by_agent_name(agents,
+                                                   initial_quantities)
+    bonds = simulate_ligation_ode(agents, rules, initial_quantities,
+                                  duration=duration)
+    bonds = dict(zip([rule.name for rule in rules], bonds.tolist()))
+    junctions_fidelities = [
+        junction_fidelity(slot1, slot2, bonds, initial_quantities)
+        for slot1, slot2 in zip(slots, slots[1:])
+    ]
+    proportion = float(np.prod(junctions_fidelities))
+    expected_slots_order = tuple(name for name, _, _ in slots)
+    simulation_results = dict(bonds=bonds,
+                              junctions_fidelities=junctions_fidelities)
+    return proportion, {expected_slots_order: proportion}, simulation_results
@@ -0,0 +1,247 @@
+"""Search for sets of overhangs giving high-fidelity assemblies."""
+
+import time
+import heapq
+
+import numpy as np
+import proglog
+
+from .annealing_matrix import (get_annealing_matrix, ALL_OVERHANGS,
+                               OVERHANGS_INDICES, REVERSE_COMPLEMENT_INDICES,
+                               junctions_fidelities)
+from .tools import overhangs_list_to_slots
+from .batch_prediction import predict_assembly_accuracy_batch
+
+
+def overhangs_junctions_fidelities(overhangs_indices, matrix):
+    """Estimate the ligation fidelity at each junction of an assembly.
+
+    The fidelity of a junction is the ratio between the annealing rate of its
+    overhang with its reverse-complement, and the sum of the annealing rates
+    of every interaction involving one of the junction's two sites, mirroring
+    the rules built by ``slots_to_agents_and_rules`` (see
+    ``annealing_matrix.junctions_fidelities``).
+
+    Parameters
+    ----------
+
+    overhangs_indices
+      Array of the integer codes of the assembly's overhangs (see
+      ``annealing_matrix.overhangs_to_indices``).
+
+    matrix
+      A 256x256 annealing matrix, as returned by ``get_annealing_matrix``,
+      possibly with a corrective factor applied.
+
+    Returns
+    -------
+
+    fidelities
+      An array with the estimated fidelity of each junction.
+    """
+    # Rates of the slots of overhangs_list_to_slots (the outer sites of the
+    # first and last slots are placeholders, without interactions).
+    n_overhangs = len(overhangs_indices)
+    rc_indices = REVERSE_COMPLEMENT_INDICES[overhangs_indices]
+    rates = np.zeros((n_overhangs + 1, n_overhangs + 1, 2))
+    rates[:-1, 1:, 0] = matrix[overhangs_indices[:, None], rc_indices[None, :]]
+    rates[:-1, :-1, 1] = matrix[overhangs_indices[:, None],
+                                overhangs_indices[None, :]]
+    return junctions_fidelities(rates)
+
+
+def _overhang_index(overhang):
+    """Return the index of a (case-insensitive) overhang, or raise an error.
+    """
+    index = OVERHANGS_INDICES.get(overhang.upper())
+    if index is None:
+        raise ValueError("Invalid overhang %s (overhangs must be 4bp "
+                         "ATGC sequences)." % overhang)
+    return index
+
+
+def optimize_overhangs(n_parts, fixed=None, forbidden=(),
+                       annealing_data=('25C', '01h'), corrective_factor=1.0,
+                       max_iterations=20000, max_time=None, shortlist_size=10,
+                       initial_temperature=0.1, final_temperature=0.001,
+                       seed=None, n_jobs=1, logger='bar',
+                       **prediction_parameters):
+    """Search for the overhangs set giving the highest predicted accuracy.
+
+    A simulated annealing explores the overhangs sets, ranking them with a
+    fast surrogate score (product of the junctions fidelities, see
+    ``overhangs_junctions_fidelities``). The best sets found are then scored
+    with ``predict_assembly_accuracy``.
+
+    Parameters
+    ----------
+
+    n_parts
+      Number of parts in the assembly (not counting the backbone). The
+      assembly will have ``n_parts + 1`` overhangs.
+
+    fixed
+      A dict {position: overhang} of overhangs which should not be changed,
+      e.g. ``{0: 'GGAG', n_parts: 'CGCT'}`` for fixed backbone overhangs.
+
+    forbidden
+      A list of overhangs (and implicitly their reverse-complements) which
+      should not appear in the final set. Palindromic overhangs are always
+      forbidden. Fixed and forbidden overhangs are case-insensitive.
+
+    annealing_data
+      Either a pandas dataframe or a couple (temperature, duration) indicating
+      an experimental dataset from Potapov et al. 2018
+
+    corrective_factor
+      A factor that can be applied to decrease (when <1) or increase (>1)
+      the differences in affinity in the dataset.
+
+    max_iterations
+      Number of steps of the simulated annealing.
+
+    max_time
+      Maximal duration of the simulated annealing, in seconds. The search
+      stops when either ``max_iterations`` or ``max_time`` is reached.
+
+    shortlist_size
+      Number of best sets (according to the surrogate score) which are
+      scored with ``predict_assembly_accuracy`` at the end of the search.
+
+    initial_temperature, final_temperature
+      Temperatures of the simulated annealing (the temperature decreases
+      geometrically between these two values). The temperature applies to
+      the logarithm of the surrogate score.
+
+    seed
+      Seed of the random number generators, for reproducible searches.
+
+    n_jobs
+      Number of processes used to score the shortlisted sets.
+
+    logger
+      Either "bar" for a progress bar, None for no logging, or any Proglog
+      logger.
+
+    **prediction_parameters
+      Other parameters passed to ``predict_assembly_accuracy``, e.g.
+      ``engine``, ``duration``, ``initial_quantities``...
+
+    Returns
+    -------
+
+    overhangs, score, shortlist
+      Where overhangs is the best list of overhangs found, score its
+      predicted accuracy, and shortlist a list of the shortlisted sets, of
+      the form [(overhangs, predicted_score, surrogate_score), ...], sorted
+      from best to worst predicted score.
+    """
+    logger = proglog.default_bar_logger(logger)
+    rng = np.random.RandomState(seed)
+    fixed = {} if fixed is None else fixed
+    matrix = get_annealing_matrix(annealing_data)
+    matrix = np.power(matrix, corrective_factor, where=matrix > 0,
+                      out=np.zeros(matrix.shape))
+    n_overhangs = n_parts + 1
+
+    forbidden_indices = set(_overhang_index(o) for o in forbidden)
+    forbidden_indices.update(
+        [REVERSE_COMPLEMENT_INDICES[i] for i in forbidden_indices])
+    allowed = np.array([
+        i for i in range(len(ALL_OVERHANGS))
+        if (REVERSE_COMPLEMENT_INDICES[i] != i)
+        and (i not in forbidden_indices)
+    ])
+    fixed_indices = {position: _overhang_index(overhang)
+                     for position, overhang in fixed.items()}
+    for position, index in fixed_indices.items():
+        if not (0 <= position < n_overhangs):
+            raise ValueError("Fixed position %d out of range." % position)
+        if index not in allowed:
+            raise ValueError("Fixed overhang %s is palindromic or forbidden."
+                             % fixed[position])
+    free_positions = [i for i in range(n_overhangs) if i not in fixed_indices]
+
+    # INITIAL RANDOM SET
+
+    used = set()
+    for index in fixed_indices.values():
+        if index in used:
+            raise ValueError("Fixed overhangs are not compatible.")
+        used.update([index, REVERSE_COMPLEMENT_INDICES[index]])
+    available = [i for i in rng.permutation(allowed) if i not in used]
+    if len(available) < 2 * len(free_positions):
+        raise ValueError("Not enough allowed overhangs for %d parts."
+                         % n_parts)
+    state = np.zeros(n_overhangs, dtype=int)
+    for position, index in fixed_indices.items():
+        state[position] = index
+    for position in free_positions:
+        index = available.pop()
+        while index in used:
+            index = available.pop()
+        state[position] = index
+        used.update([index, REVERSE_COMPLEMENT_INDICES[index]])
+    available = [i for i in allowed if i not in used]
+
+    def swap_availability(old_index, new_index):
+        for index in (new_index, REVERSE_COMPLEMENT_INDICES[new_index]):
+            if index in available:
+                available.remove(index)
+        available.extend([old_index, REVERSE_COMPLEMENT_INDICES[old_index]])
+
+    def log_score(state):
+        fidelities = overhangs_junctions_fidelities(state, matrix)
+        return np.log(np.maximum(fidelities, 1e-300)).sum()
+
+    # SIMULATED ANNEALING
+
+    current_log_score = log_score(state)
+    shortlist = [(current_log_score, tuple(state))]
+    shortlisted = {tuple(state)}
+    temperatures = np.geomspace(initial_temperature, final_temperature,
+                                max(max_iterations, 1))
+    start_time = time.time()
+    iterations = range(max_iterations) if free_positions else []
+    for iteration in logger.iter_bar(iteration=iterations):
+        if (max_time is not None) and (time.time() - start_time > max_time):
+            break
+        position = free_positions[rng.randint(len(free_positions))]
+        new_index = available[rng.randint(len(available))]
+        new_state = state.copy()
+        new_state[position] = new_index
+        new_log_score = log_score(new_state)
+        delta = new_log_score - current_log_score
+        temperature = temperatures[iteration]
+        if (delta >= 0) or (rng.rand() < np.exp(delta / temperature)):
+            swap_availability(state[position], new_index)
+            state, current_log_score = new_state, new_log_score
+            key = tuple(state)
+            if key not in shortlisted:
+                shortlisted.add(key)
+                heapq.heappush(shortlist, (current_log_score, key))
+                if len(shortlist) > shortlist_size:
+                    shortlisted.remove(heapq.heappop(shortlist)[1])
+
+    # SCORING OF THE SHORTLIST WITH FULL PREDICTIONS
+
+    shortlist = [([ALL_OVERHANGS[i] for i in key], float(np.exp(score)))
+                 for score, key in sorted(shortlist, reverse=True)]
+    list_of_slots = [overhangs_list_to_slots(overhangs)
+                     for overhangs, _ in shortlist]
+    predictions = predict_assembly_accuracy_batch(
+        list_of_slots, n_jobs=n_jobs, seed=seed,
+        annealing_data=annealing_data, corrective_factor=corrective_factor,
+        **prediction_parameters)
+    predicted_scores = {}
+    candidates = logger.iter_bar(candidate=range(len(list_of_slots)))
+    for (index, score, error), _ in zip(predictions, candidates):
+        if score is None:
+            raise error
+        predicted_scores[index] = score
+    shortlist = sorted([
+        (overhangs, predicted_scores[i], surrogate_score)
+        for i, (overhangs, surrogate_score) in enumerate(shortlist)
+    ], key=lambda candidate: -candidate[1])
+    best_overhangs, best_score, _ = shortlist[0]
+    return best_overhangs, best_score, shortlist
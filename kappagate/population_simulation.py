@@ -0,0 +1,352 @@
+"""Stochastic simulation of the ligation reaction at the level of complexes
+species, rather than individual molecules.
+
+The Kappa simulator represents every molecule of the reaction, so its memory
+and time grow with the initial quantities. Here the state of the reaction is
+the number of copies of each complex species (a linear chain of parts, in
+a given orientation, or a circular one), and reactions are fired with a
+tau-leaping algorithm (many firings at once, drawn from Poisson
+distributions), falling back to exact Gillespie steps when few reactions
+are expected. The cost then scales with the number of distinct species,
+not with the number of molecules.
+
+The model is the Kappa model built by ``slots_to_agents_and_rules``: each
+rule binds a free site of a complex to a free site of another complex (at a
+rate per pair of sites), or to a free site of the same complex (which
+circularizes it).
+"""
+
+from collections import Counter
+
+import numpy as np
+
+from .ode_simulation import _quantities_by_agent_name, _check_distinct_sites
+
+
+def _reverse(chain):
+    """Return the same linear chain, read from the other end."""
+    return tuple((agent, not flipped) for agent, flipped in chain[::-1])
+
+
+def _linear_species(chain):
+    return min(chain, _reverse(chain))
+
+
+def _circular_species(chain):
+    rotations = [chain[i:] + chain[:i] for i in range(len(chain))]
+    reversed_chain = _reverse(chain)
+    rotations += [reversed_chain[i:] + reversed_chain[:i]
+                  for i in range(len(chain))]
+    return ('circular',) + min(rotations)
+
+
+def _chain_ends(chain):
+    """Return the sites at the left and right ends of a linear chain.
+
+    The sites of agent k are numbered 2k (left site) and 2k + 1 (right).
+    """
+    (first, first_flipped), (last, last_flipped) = chain[0], chain[-1]
+    return (2 * first + int(first_flipped), 2 * last + 1 - int(last_flipped))
+
+
+class _PopulationState:
+    """Species counts of a population simulation, and reaction propensities.
+
+    The sites of agent k are numbered 2k (left) and 2k + 1 (right). Each
+    linear species has two free ends (end 0 and end 1, carrying sites given
+    by ``_chain_ends``); the ends of circular species carry a dummy site
+    which no rule involves. The propensity of a rule (site1, site2) is its
+    rate times the number of pairs of free ends with these sites which are
+    on different molecules, and each species also has a circularization
+    propensity (rules binding its two ends together). Propensities are thus
+    computed per rule and per species, from the counts of free sites,
+    without enumerating pairs of species.
+    """
+
+    def __init__(self, rules_rates, quantities):
+        # rules_rates is a dict {(site1, site2): rate}.
+        self.n_sites = 2 * len(quantities) + 1  # The last site is a dummy.
+        rules = sorted(rules_rates.items())
+        self.rules_sites = np.array([sites for sites, _ in rules],
+                                    dtype=int).reshape(-1, 2)
+        self.rules_rates = np.array([rate for _, rate in rules], dtype=float)
+        self.rates_matrix = np.zeros((self.n_sites, self.n_sites))
+        for (site1, site2), rate in rules:
+            self.rates_matrix[site1, site2] = rate
+        self.species = []
+        self.species_indices = {}
+        self.n_species = 0
+        self.counts = np.zeros(len(quantities), dtype=np.int64)
+        self.ends_sites = np.zeros((len(quantities), 2), dtype=int)
+        self.sites_ends = [[] for _ in range(self.n_sites)]
+        self.sites_ends_arrays = [np.zeros(0, dtype=int)] * self.n_sites
+        self.products = {}
+        for agent, quantity in enumerate(quantities):
+            index = self.species_index(((agent, False),))
+            self.counts[index] = quantity
+
+    def species_index(self, species):
+        """Return the index of a species, adding it if it is new."""
+        if species in self.species_indices:
+            return self.species_indices[species]
+        index = self.n_species
+        if index == len(self.counts):
+            # Grow the arrays by doubling their capacity.
+            self.counts = np.concatenate([self.counts,
+                                          np.zeros_like(self.counts)])
+            self.ends_sites = np.concatenate([self.ends_sites,
+                                              np.zeros_like(self.ends_sites)])
+        self.n_species += 1
+        self.species.append(species)
+        self.species_indices[species] = index
+        if species[0] == 'circular':
+            ends = (self.n_sites - 1, self.n_sites - 1)
+        else:
+            ends = _chain_ends(species)
+            for end, site in enumerate(ends):
+                self.sites_ends[site].append(2 * index + end)
+        self.ends_sites[index] = ends
+        return index
+
+    def site_ends(self, site):
+        """Return an array of the free ends (2 * species + end) of a site."""
+        if len(self.sites_ends_arrays[site]) != len(self.sites_ends[site]):
+            self.sites_ends_arrays[site] = np.array(self.sites_ends[site])
+        return self.sites_ends_arrays[site]
+
+    def propensities(self):
+        """Return the propensities of the rules, of the circularizations
+        (an array of shape (n_species, 2), where [x, i] is the binding of
+        end i of species x, as first site of a rule, to its other end) and
+        the rate at which each species is consumed."""
+        n, n_sites = self.n_species, self.n_sites
+        counts = self.counts[:n].astype(float)
+        ends_sites = self.ends_sites[:n]
+        free_sites = np.bincount(ends_sites.ravel(), np.repeat(counts, 2),
+                                 minlength=n_sites)
+        # Pairs of free ends on a same molecule, by pair of sites.
+        pairs = (ends_sites[:, [0, 0, 1, 1]] * n_sites +
+                 ends_sites[:, [0, 1, 0, 1]])
+        same_molecule = np.bincount(pairs.ravel(), np.repeat(counts, 4),
+                                    minlength=n_sites ** 2)
+        site1, site2 = self.rules_sites.T
+        rules_propensities = self.rules_rates * (
+            free_sites[site1] * free_sites[site2] -
+            same_molecule[site1 * n_sites + site2])
+        circularizations = counts[:, None] * np.stack([
+            self.rates_matrix[ends_sites[:, 0], ends_sites[:, 1]],
+            self.rates_matrix[ends_sites[:, 1], ends_sites[:, 0]]
+        ], axis=1)
+        sites_consumptions = (self.rates_matrix.dot(free_sites) +
+                              self.rates_matrix.T.dot(free_sites))
+        consumptions = (counts * sites_consumptions[ends_sites].sum(axis=1) +
+                        circularizations.sum(axis=1))
+        return rules_propensities, circularizations, consumptions
+
+    def draw_ends(self, rng, site, size):
+        """Draw free ends of a site at random (weighted by species counts)."""
+        ends = self.site_ends(site)
+        weights = self.counts[ends // 2].astype(float)
+        return ends[rng.choice(len(ends), size=size,
+                               p=weights / weights.sum())]
+
+    def product(self, end1, end2=None):
+        """Return the index of the species created by binding two free ends
+        (2 * species + end), or by circularizing a species from end1."""
+        key = (end1, end2)
+        if key not in self.products:
+            x, i = divmod(end1, 2)
+            chain_x = self.species[x]
+            if i == 0:
+                chain_x = _reverse(chain_x)
+            if end2 is None:
+                species = _circular_species(chain_x)
+            else:
+                y, j = divmod(end2, 2)
+                chain_y = self.species[y]
+                if j == 1:
+                    chain_y = _reverse(chain_y)
+                species = _linear_species(chain_x + chain_y)
+            self.products[key] = self.species_index(species)
+        return self.products[key]
+
+    def fire(self, bindings, circularizations):
+        """Apply reactions to the species counts.
+
+        ``bindings`` is a dict {(end1, end2): n_reactions} and
+        ``circularizations`` a dict {end1: n_reactions}. Return False (and
+        leave the counts unchanged) if this would make some counts negative.
+        """
+        consumed = Counter()
+        for (end1, end2), n_reactions in bindings.items():
+            consumed[end1 // 2] += n_reactions
+            consumed[end2 // 2] += n_reactions
+        for end1, n_reactions in circularizations.items():
+            consumed[end1 // 2] += n_reactions
+        if any(self.counts[x] < n for x, n in consumed.items()):
+            return False
+        produced = Counter()
+        for (end1, end2), n_reactions in bindings.items():
+            produced[self.product(end1, end2)] += n_reactions
+        for end1, n_reactions in circularizations.items():
+            produced[self.product(end1)] += n_reactions
+        for x, n_reactions in consumed.items():
+            self.counts[x] -= n_reactions
+        for x, n_reactions in produced.items():
+            self.counts[x] += n_reactions
+        return True
+
+
+def simulate_ligation_population(agents, rules, initial_quantities,
+                                 duration=1000, seed=None, epsilon=0.03,
+                                 min_leap_events=10):
+    """Simulate the ligation reaction with a population-based algorithm.
+
+    Parameters
+    ----------
+
+    agents, rules
+      Lists of Topkappy agents and rules, as returned by
+      ``slots_to_agents_and_rules``.
+
+    initial_quantities
+      Either a dict {agent: initial_quantity} (with agents or agent names as
+      keys) or an integer in case all agents start with the same quantity.
+
+    duration
+      Virtual duration of the reaction (same time units as in Kappa).
+
+    seed
+      Seed of the random number generator.
+
+    epsilon
+      Maximal expected relative change of any species' count in one leap.
+      Lower values are more accurate, but slower.
+
+    min_leap_events
+      When fewer reactions than this are expected in a leap, exact
+      (one-reaction) Gillespie steps are used instead.
+
+    Returns
+    -------
+
+    species_counts, n_steps
+      Where species_counts is a dict {species: count} of the species present
+      at the end of the reaction, each species being either a tuple
+      ``((agent_name, is_flipped), ...)`` for a linear complex or
+      ``('circular', (agent_name, is_flipped), ...)`` for a circular one,
+      and n_steps is the number of steps (leaps and exact steps) simulated.
+    """
+    rng = np.random.RandomState(seed)
+    _check_distinct_sites(agents)
+    initial_quantities = _quantities_by_agent_name(agents,
+                                                   initial_quantities)
+    sites_indices = {}
+    for k, agent in enumerate(agents):
+        for side, site in enumerate(agent.sites):
+            sites_indices[(agent.name, site)] = 2 * k + side
+    rules_rates = {}
+    for rule in rules:
+        site1, site2 = [sites_indices[(reactant.agent, reactant.site)]
+                        for reactant in rule.reactants]
+        rules_rates[(site1, site2)] = (rules_rates.get((site1, site2), 0) +
+                                       float(rule.rate))
+    state = _PopulationState(
+        rules_rates, [initial_quantities[agent.name] for agent in agents])
+
+    time, n_steps = 0.0, 0
+    while time < duration:
+        rules_propensities, circularizations, consumptions = \
+            state.propensities()
+        total_propensity = rules_propensities.sum() + circularizations.sum()
+        if total_propensity <= 0:
+            break
+        n_steps += 1
+        consumed = consumptions > 0
+        counts = state.counts[:state.n_species][consumed]
+        tau = min(duration - time, np.min(
+            np.maximum(epsilon * counts, 1) / consumptions[consumed]))
+        if total_propensity * tau < min_leap_events:
+            # Exact Gillespie step.
+            time += rng.exponential(1.0 / total_propensity)
+            if time > duration:
+                break
+            propensities = np.concatenate([rules_propensities,
+                                           circularizations.ravel()])
+            reaction = rng.choice(len(propensities),
+                                  p=propensities / propensities.sum())
+            if reaction >= len(rules_propensities):
+                state.fire({}, {reaction - len(rules_propensities): 1})
+                continue
+            site1, site2 = state.rules_sites[reaction]
+            while True:
+                # Both ends are drawn until they are on different molecules.
+                end1 = state.draw_ends(rng, site1, 1)[0]
+                end2 = state.draw_ends(rng, site2, 1)[0]
+                x, y = end1 // 2, end2 // 2
+                if (x != y) or (rng.random_sample() * state.counts[x] >= 1):
+                    break
+            state.fire({(end1, end2): 1}, {})
+            continue
+        while True:
+            bindings = Counter()
+            rules_firings = rng.poisson(rules_propensities * tau)
+            for rule in np.flatnonzero(rules_firings):
+                site1, site2 = state.rules_sites[rule]
+                n_firings = rules_firings[rule]
+                bindings.update(zip(
+                    state.draw_ends(rng, site1, n_firings).tolist(),
+                    state.draw_ends(rng, site2, n_firings).tolist()))
+            circularizations_firings = rng.poisson(
+                circularizations.ravel() * tau)
+            ends = np.flatnonzero(circularizations_firings)
+            circularized = dict(zip(ends.tolist(),
+                                    circularizations_firings[ends].tolist()))
+            if state.fire(bindings, circularized):
+                break
+            tau /= 2
+        time += tau
+
+    names = [agent.name for agent in agents]
+    species_counts = {}
+    for species, count in zip(state.species, state.counts):
+        if count == 0:
+            continue
+        prefix, chain = (), species
+        if species[0] == 'circular':
+            prefix, chain = species[:1], species[1:]
+        species = prefix + tuple((names[k], flipped) for k, flipped in chain)
+        species_counts[species] = int(count)
+    return species_counts, n_steps
+
+
+def population_assembly_accuracy(slots, agents, rules, initial_quantities,
+                                 duration=1000, seed=None):
+    """Predict the proportion of good clones with a population simulation.
+
+    See ``simulate_ligation_population`` for the simulation, and
+    ``predict_assembly_accuracy`` for the parameters.
+
+    Returns
+    -------
+
+    proportion, constructs, simulation_results
+      Where proportion is the proportion of good clones, constructs is a
+      dict {parts_tuple: proportion} (as with the Kappa engine), and
+      simulation_results is a dict with the final ``species_counts`` and the
+      number of simulation steps ``n_steps``.
+    """
+    from .predict_assembly_accuracy import constructs_proportions
+
+    species_counts, n_steps = simulate_ligation_population(
+        agents, rules, initial_quantities, duration=duration, seed=seed)
+    first_slot, second_slot = slots[0][0], slots[1][0]
+    constructs_counter = Counter()
+    for species, count in species_counts.items():
+        chain = species[1:] if species[0] == 'circular' else species
+        names = tuple(name for name, _ in chain)
+        if (first_slot in names) and (second_slot in names):
+            constructs_counter[names] += count
+    score, constructs, _ = constructs_proportions(slots, constructs_counter)
+    simulation_results = dict(species_counts=species_counts, n_steps=n_steps)
+    return score, constructs, simulation_results
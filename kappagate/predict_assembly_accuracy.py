@@ -1,15 +1,45 @@
 """This application is experimental."""
 
-import itertools
-import networkx
-import tatapov
-from topkappy import (KappaAgent, KappaSiteState, KappaRule, KappaModel,
-                      snapshot_agent_nodes_to_graph)
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from .tools import overhangs_list_to_slots, linear_graph_to_nodes_list
+import numpy as np
+
+# Topkappy (which imports matplotlib) and scipy.stats are slow to import, so
+# they are only imported when first needed, in the functions below.
+from .ode_simulation import ode_assembly_accuracy
+from .population_simulation import population_assembly_accuracy
+from .annealing_matrix import (slots_interaction_rates, get_annealing_matrix,
+                               prune_interaction_rates)
+from .profiling import Profiler
+
+def interaction_rule(agent1, agent2, side, rate):
+    """Return a rule binding agent1's right site to one of agent2's sites.
+
+    ``side`` is 0 for agent2's left site, 1 for agent2's right site.
+    """
+    from topkappy import KappaSiteState, KappaRule
+    site1, site2 = agent1.sites[1], agent2.sites[side]
+    a2_side = ('left', 'right')[side]
+    return KappaRule(
+        '%s-left.%s-%s' % (agent1.name, agent2.name, a2_side),
+        [
+            KappaSiteState(agent1.name, site1, '.'),
+            KappaSiteState(agent2.name, site2, '.')
+        ],
+        '->',
+        [
+            KappaSiteState(agent1.name, site1, '1'),
+            KappaSiteState(agent2.name, site2, '1')
+        ],
+        rate=float(rate)
+    )
 
 def slots_to_agents_and_rules(slots, annealing_data=('25C', '01h'),
-                              corrective_factor=1.0):
+                              corrective_factor=1.0, min_rate=0,
+                              max_rules_per_site=None,
+                              return_pruning_report=False, profiler=None,
+                              rates=None):
     """Generate Topkappy rules and agents objects modeling parts interactions.
     
     Parameters
@@ -25,58 +55,69 @@ def slots_to_agents_and_rules(slots, annealing_data=('25C', '01h'),
     corrective_factor
       A factor that can be applied to decrease (when <1) or increase (>1)
       the differences in affinity in the dataset.
+
+    min_rate, max_rules_per_site
+      Options to skip the rules of negligible interactions, which makes Kappa
+      simulations faster at the cost of some accuracy. See
+      ``annealing_matrix.prune_interaction_rates``. The rules of the expected
+      junctions are always kept.
+
+    return_pruning_report
+      If True, a report on the pruned rules (see
+      ``annealing_matrix.prune_interaction_rates``) is also returned.
+
+    profiler
+      A ``Profiler`` recording the time spent loading the annealing data,
+      computing the interaction rates and building the rules, and the
+      numbers of agents and rules.
+
+    rates
+      Precomputed interaction rates (see ``slots_interaction_rates``), in
+      which case ``annealing_data`` and ``corrective_factor`` are ignored.
     
     Returns
     -------
 
     agents, rules
       Lists of Topkappy agents and rules, ready to be fed to a KappaModel
+      (followed by the pruning report if ``return_pruning_report`` is True).
     """
-    if isinstance(annealing_data, tuple):
-        ad_temp, ad_duration = annealing_data
-        annealing_data = tatapov.annealing_data[ad_temp][ad_duration]
-    agents = [
-        KappaAgent(pos, (left, right))
-        for pos, left, right in slots
-    ]
-    all_overhangs = set([o for (pos, l, r) in slots for o in (l, r)
-                    if set(o) <= set('ATGC')])
-    rules = []
-    for agent1, agent2 in itertools.product(agents, agents):
-        _, a1_right = agent1.sites
-        a2_left, a2_right = agent2.sites
-        for site1, site2, a2_side in ((a1_right, a2_left, 'left'),
-                                      (a1_right, a2_right, 'right')):
-            if (site1 not in all_overhangs) or (site2 not in all_overhangs):
-                continue
-            if a2_side == 'left':
-                ov1, ov2 = site1, tatapov.reverse_complement(site2)
-            else:
-                ov1, ov2 = site1, site2
-            # rev_ov1 = tatapov.reverse_complement(ov1)
-            # rev_ov2 = tatapov.reverse_complement(ov2)
-            
-            rate = annealing_data[ov1][ov2] #+ annealing_data[rev_ov2][rev_ov1]
-            if rate == 0:
-                continue
-            rules.append(KappaRule(
-                '%s-left.%s-%s' % (agent1.name, agent2.name, a2_side),
-                [
-                    KappaSiteState(agent1.name, site1, '.'),
-                    KappaSiteState(agent2.name, site2, '.')
-                ],
-                '->',
-                [
-                    KappaSiteState(agent1.name, site1, '1'),
-                    KappaSiteState(agent2.name, site2, '1')
-                ],
-                rate=rate ** corrective_factor
-            ))
+    if profiler is None:
+        profiler = Profiler()
+    if rates is None:
+        with profiler.stage('annealing_data'):
+            if isinstance(annealing_data, tuple):
+                # Loads the dataset (only the first time), then caches it.
+                get_annealing_matrix(annealing_data)
+        with profiler.stage('interaction_rates'):
+            rates = slots_interaction_rates(
+                slots, annealing_data=annealing_data,
+                corrective_factor=corrective_factor)
+    with profiler.stage('rules'):
+        from topkappy import KappaAgent
+        agents = [
+            KappaAgent(pos, (left, right))
+            for pos, left, right in slots
+        ]
+        rates, pruning_report = prune_interaction_rates(
+            rates, min_rate=min_rate, max_rules_per_site=max_rules_per_site)
+        rules = [
+            interaction_rule(agents[i1], agents[i2], side,
+                             rates[i1, i2, side])
+            for i1, i2, side in zip(*np.nonzero(rates))
+        ]
+    profiler.record('n_agents', len(agents))
+    profiler.record('n_rules', len(rules))
+    if return_pruning_report:
+        return agents, rules, pruning_report
     return agents, rules
 
 def predict_assembly_accuracy(slots, duration=1000, initial_quantities=1000,
                               corrective_factor=1.0,
-                              annealing_data=('25C', '01h')):
+                              annealing_data=('25C', '01h'), seed=None,
+                              engine='kappa', cache=None, replicates=None,
+                              n_jobs=None, min_rate=0,
+                              max_rules_per_site=None, profiler=None):
     """Predict the accuracy of the assembly (proportion of good clones).
     
     Parameters
@@ -102,6 +143,59 @@ def predict_assembly_accuracy(slots, duration=1000, initial_quantities=1000,
     corrective_factor
       A factor that can be applied to decrease (when <1) or increase (>1)
       the differences in affinity in the dataset.
+
+    seed
+      Seed of the Kappa simulator's random number generator. Providing a seed
+      makes the prediction reproducible.
+
+    engine
+      Either 'kappa' (stochastic simulation of the ligation reaction with
+      Kappa), 'population' (same simulation, with a population-based
+      algorithm) or 'ode' (deterministic, mean-field model of the reaction,
+      solved numerically, much faster and noise-free but approximative).
+      With the 'ode' engine, other_constructs only features the expected
+      construct, and simulation_results is a dict giving the bonds formed
+      by each rule and the fidelity of each junction. The 'population'
+      engine simulates the same stochastic reaction as Kappa, but counts
+      complexes species rather than representing each molecule, which is
+      much faster for large initial quantities (see
+      ``population_simulation``).
+
+    cache
+      A ``PredictionCache``. If a prediction for the same assembly (same
+      overhangs, possibly with other slots names) and the same parameters is
+      in the cache, it is returned without running any simulation (and the
+      returned simulation_results is None). Otherwise the new prediction is
+      added to the cache.
+
+    replicates
+      Number of independent simulations to run (each with the provided
+      initial quantities, and with seeds ``seed``, ``seed + 1``, etc. if a
+      seed is provided). The returned proportions are averaged over the
+      replicates, and simulation_results is a dict with the ``replicates``
+      simulation results, the replicates ``scores``, and their ``mean``,
+      ``std`` and 95% ``confidence_interval`` (of the mean). Several small
+      simulations run in parallel often give a better estimate than one
+      large simulation in the same time.
+
+    n_jobs
+      Number of replicates simulated in parallel (defaults to all replicates
+      at once). The simulations run in Kappa subprocesses, so threads are
+      used.
+
+    min_rate, max_rules_per_site
+      Options to skip the rules of negligible interactions, for faster Kappa
+      simulations (see ``slots_to_agents_and_rules``).
+
+    profiler
+      A ``Profiler`` recording the wall time of each stage of the prediction
+      (``annealing_data`` loading, ``interaction_rates``, ``rules``
+      building, then ``kappa_model`` writing, ``kappa_simulation`` and
+      ``snapshot_processing``, or ``ode_simulation``, or
+      ``population_simulation``), and metrics such as ``n_agents``,
+      ``n_rules``, ``n_complexes`` and ``n_complex_species`` (complexes,
+      and distinct complexes, in the final state of the simulation). See
+      ``profiling.Profiler``.
     
     Returns
     -------
@@ -112,36 +206,194 @@ def predict_assembly_accuracy(slots, duration=1000, initial_quantities=1000,
       constructs (in bad clones), and simulation_results is the topkappy
       simulation results object.
     """
+    if (replicates is not None) and (replicates < 1):
+        raise ValueError("The number of replicates must be at least 1 (got "
+                         "%s)." % replicates)
+    if profiler is None:
+        profiler = Profiler()
+    if cache is not None:
+        parameters = dict(duration=duration,
+                          initial_quantities=initial_quantities,
+                          corrective_factor=corrective_factor,
+                          annealing_data=annealing_data, seed=seed,
+                          engine=engine, replicates=replicates,
+                          min_rate=min_rate,
+                          max_rules_per_site=max_rules_per_site)
+        with profiler.stage('cache_lookup'):
+            cached_prediction = cache.get(slots, **parameters)
+        profiler.record('cache_hit', cached_prediction is not None)
+        if cached_prediction is not None:
+            score, other_constructs = cached_prediction
+            return score, other_constructs, None
+        score, other_constructs, simulation_results = \
+            predict_assembly_accuracy(slots, n_jobs=n_jobs, profiler=profiler,
+                                      **parameters)
+        cache.set(slots, score, other_constructs, **parameters)
+        return score, other_constructs, simulation_results
     agents, rules = slots_to_agents_and_rules(
         slots, annealing_data=annealing_data,
-        corrective_factor=corrective_factor)
-    if isinstance(initial_quantities, int):
-        initial_quantities = {a: initial_quantities for a in agents}
-    model = KappaModel(
-        agents=agents,
-        rules=rules,
-        initial_quantities=initial_quantities,
-        duration=duration,
-        snapshot_times={'end': duration}
+        corrective_factor=corrective_factor, min_rate=min_rate,
+        max_rules_per_site=max_rules_per_site, profiler=profiler)
+    if replicates is not None:
+        return _predict_replicates(
+            slots, agents, rules, replicates=replicates, n_jobs=n_jobs,
+            duration=duration, initial_quantities=initial_quantities,
+            seed=seed, engine=engine, profiler=profiler)
+    return predict_accuracy_from_agents_and_rules(
+        slots, agents, rules, duration=duration,
+        initial_quantities=initial_quantities, seed=seed, engine=engine,
+        profiler=profiler)
+
+def _predict_replicates(slots, agents, rules, replicates, n_jobs=None,
+                        seed=None, **parameters):
+    """Run several predictions in parallel threads, return statistics."""
+    from scipy.stats import t as t_distribution
+    seeds = [None if seed is None else seed + i for i in range(replicates)]
+    with ThreadPoolExecutor(max_workers=n_jobs or replicates) as executor:
+        results = list(executor.map(
+            lambda replicate_seed: predict_accuracy_from_agents_and_rules(
+                slots, agents, rules, seed=replicate_seed, **parameters),
+            seeds))
+    scores = np.array([score for score, _, _ in results])
+    other_constructs = {}
+    for _, constructs, _ in results:
+        for construct, proportion in constructs.items():
+            other_constructs[construct] = (
+                other_constructs.get(construct, 0) + proportion / replicates)
+    mean = scores.mean()
+    std = scores.std(ddof=1) if replicates > 1 else 0.0
+    half_width = (t_distribution.ppf(0.975, replicates - 1) * std /
+                  np.sqrt(replicates)) if replicates > 1 else 0.0
+    simulation_results = dict(
+        replicates=[simulation_results for _, _, simulation_results
+                    in results],
+        scores=scores.tolist(), mean=float(mean), std=float(std),
+        confidence_interval=(float(mean - half_width),
+                             float(mean + half_width))
     )
-    simulation_results = model.get_simulation_results()
+    return float(mean), other_constructs, simulation_results
+
+def predict_accuracy_from_agents_and_rules(slots, agents, rules,
+                                           duration=1000,
+                                           initial_quantities=1000,
+                                           seed=None, engine='kappa',
+                                           profiler=None):
+    """Predict the assembly accuracy from precomputed agents and rules.
+
+    This is the second half of ``predict_assembly_accuracy``, useful when the
+    agents and rules have already been computed (or modified). See
+    ``predict_assembly_accuracy`` for the meaning of the parameters and
+    returned values.
+    """
+    if profiler is None:
+        profiler = Profiler()
+    if engine == 'ode':
+        with profiler.stage('ode_simulation'):
+            return ode_assembly_accuracy(
+                slots, agents, rules, duration=duration,
+                initial_quantities=initial_quantities)
+    if engine == 'population':
+        with profiler.stage('population_simulation'):
+            prediction = population_assembly_accuracy(
+                slots, agents, rules, duration=duration,
+                initial_quantities=initial_quantities, seed=seed)
+        species_counts = prediction[2]['species_counts']
+        profiler.record('n_complexes', sum(species_counts.values()))
+        profiler.record('n_complex_species', len(species_counts))
+        return prediction
+    if engine != 'kappa':
+        raise ValueError("Unknown engine: %s" % engine)
+    with profiler.stage('kappa_model'):
+        from topkappy import KappaModel
+        if isinstance(initial_quantities, int):
+            initial_quantities = {a: initial_quantities for a in agents}
+        model = KappaModel(
+            agents=agents,
+            rules=rules,
+            initial_quantities=initial_quantities,
+            duration=duration,
+            snapshot_times={'end': duration}
+        )
+        model.parameters.seed = seed
+    with profiler.stage('kappa_simulation'):
+        simulation_results = model.get_simulation_results()
+    with profiler.stage('snapshot_processing'):
+        snapshots = simulation_results['snapshots']
+        end_time = 'end' if 'end' in snapshots else 'deadlock'
+        end_agents = snapshots[end_time]['snapshot_agents']
+        score, filtered_agents_with_slots, _ = snapshot_agents_to_constructs(
+            slots, end_agents)
+    profiler.record('n_complexes', sum(freq for freq, _ in end_agents))
+    profiler.record('n_complex_species', len(end_agents))
+    return score, filtered_agents_with_slots, simulation_results
+
+def snapshot_agents_to_constructs(slots, snapshot_agents):
+    """Return the proportion of good constructs in a Kappa snapshot.
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    snapshot_agents
+      The list of complexes ``[(frequency, nodes), ...]`` of a Kappa snapshot,
+      as in ``simulation_results['snapshots']['end']['snapshot_agents']``.
+
+    Returns
+    -------
+
+    proportion, constructs, n_constructs
+      Where proportion is the proportion of good clones, constructs is a
+      dict {parts_tuple: proportion}, and n_constructs is the number of
+      complexes the proportions were computed from.
+    """
     expected_slots_order = tuple(pos for pos, _, _ in slots)
     first_slot, last_slot = expected_slots_order[0], expected_slots_order[1]
-    snapshots = simulation_results['snapshots']
-    end_time = 'end' if 'end' in snapshots else 'deadlock'
-    end_agents = snapshots[end_time]['snapshot_agents']
-    filtered_agents = [
-        (freq, snapshot_agent_nodes_to_graph(nodes, with_ports=False))
-        for freq, nodes in end_agents
-        if any(node['node_type'] == first_slot for node in nodes)
-        and any(node['node_type'] == last_slot for node in nodes)
-    ]
-    n_filtered_agents = sum(fa[0] for fa in filtered_agents)
+    constructs_counter = Counter()
+    for freq, nodes in snapshot_agents:
+        nodes_names = [node['node_type'] for node in nodes]
+        if (first_slot in nodes_names) and (last_slot in nodes_names):
+            constructs_counter[snapshot_complex_to_slots_order(nodes)] += freq
+    return constructs_proportions(slots, constructs_counter)
+
+def constructs_proportions(slots, constructs_counter):
+    """Return the proportion of good constructs from constructs counts.
+
+    ``constructs_counter`` is a dict {parts_tuple: count}. The returned
+    values are the same as for ``snapshot_agents_to_constructs``.
+    """
+    expected_slots_order = tuple(pos for pos, _, _ in slots)
+    n_filtered_agents = sum(constructs_counter.values())
     filtered_agents_with_slots = {
-        linear_graph_to_nodes_list(graph, node_name='node_name'):
-        1.0 * freq / n_filtered_agents
-        for freq, graph in filtered_agents
+        construct: 1.0 * freq / n_filtered_agents
+        for construct, freq in constructs_counter.items()
     }
     score = (filtered_agents_with_slots.get(expected_slots_order, 0) +
              filtered_agents_with_slots.get(expected_slots_order[::-1], 0))
-    return score, filtered_agents_with_slots, simulation_results
+    return score, filtered_agents_with_slots, n_filtered_agents
+
+def snapshot_complex_to_slots_order(nodes):
+    """Return the names of the agents of a linear complex, in order.
+
+    The bonds of the complex's nodes (from a Kappa snapshot) are walked from
+    the first node at one end of the complex to the other end.
+    """
+    neighbors = [set() for _ in nodes]
+    for i, node in enumerate(nodes):
+        for site in node['node_sites']:
+            site_type, site_data = site['site_type']
+            if site_type == 'port':
+                for link in site_data['port_links']:
+                    if link[0] != i:
+                        neighbors[i].add(link[0])
+    start = next(i for i, n in enumerate(neighbors) if len(n) == 1)
+    order, visited = [start], {start}
+    while True:
+        next_nodes = neighbors[order[-1]] - visited
+        if not next_nodes:
+            break
+        next_node = next_nodes.pop()
+        order.append(next_node)
+        visited.add(next_node)
+    return tuple(nodes[i]['node_type'] for i in order)
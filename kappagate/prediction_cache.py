@@ -0,0 +1,172 @@
+"""Cache of assembly accuracy predictions, in memory and (optionally) on disk.
+"""
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+from .annealing_matrix import OVERHANGS_INDICES
+
+
+def canonical_slots(slots):
+    """Return a canonical form of the slots' overhangs.
+
+    The canonical form is the same for all slots lists representing the same
+    assembly, whatever the slots names. The orientation of the slots is kept:
+    the model only has rules for right-left and right-right site bindings,
+    so an assembly read in reverse (reversed and reverse-complemented) can
+    have a different predicted accuracy. Non-overhang sites such as "LEFT"
+    and "RIGHT" are represented by None.
+
+    Returns
+    -------
+
+    canonical_overhangs
+      A tuple ((left, right), ...) with the overhangs of each slot.
+    """
+    return tuple(
+        tuple(o if o in OVERHANGS_INDICES else None for o in (left, right))
+        for _, left, right in slots
+    )
+
+
+def constructs_to_indices(slots, other_constructs):
+    """Return constructs as [(slots_indices, proportion), ...].
+
+    The indices are positions in the slots list, so they do not depend on
+    the slots names.
+    """
+    indices = {name: i for i, (name, _, _) in enumerate(slots)}
+    return [
+        (tuple(indices[name] for name in construct), float(proportion))
+        for construct, proportion in other_constructs.items()
+    ]
+
+
+def constructs_from_indices(slots, constructs):
+    """Return a dict {parts_tuple: proportion}, named after the slots.
+
+    This is the reverse of ``constructs_to_indices``.
+    """
+    names = [name for name, _, _ in slots]
+    return {
+        tuple(names[i] for i in indices): proportion
+        for indices, proportion in constructs
+    }
+
+
+def _annealing_data_key(annealing_data):
+    if isinstance(annealing_data, tuple):
+        return annealing_data
+    digest = hashlib.sha1(annealing_data.values.tobytes())
+    digest.update(repr(list(annealing_data.index)).encode())
+    digest.update(repr(list(annealing_data.columns)).encode())
+    return digest.hexdigest()
+
+
+def prediction_key(slots, duration=1000, initial_quantities=1000,
+                   corrective_factor=1.0, annealing_data=('25C', '01h'),
+                   seed=None, engine='kappa', replicates=None, min_rate=0,
+                   max_rules_per_site=None):
+    """Return the key identifying a prediction.
+
+    Equivalent predictions (same canonical overhangs and parameters, see
+    ``canonical_slots``) have the same key.
+    """
+    overhangs = canonical_slots(slots)
+    if not isinstance(initial_quantities, int):
+        initial_quantities = {
+            getattr(agent, 'name', agent): quantity
+            for agent, quantity in initial_quantities.items()
+        }
+        initial_quantities = tuple(
+            initial_quantities[name] for name, _, _ in slots)
+    key = (overhangs, _annealing_data_key(annealing_data),
+           float(corrective_factor), duration, initial_quantities, seed,
+           engine, replicates)
+    if min_rate or (max_rules_per_site is not None):
+        key += (float(min_rate), max_rules_per_site)
+    return key
+
+
+class PredictionCache:
+    """Cache of predictions, with a LRU in-memory tier and a disk tier.
+
+    Predictions are identified by the canonical form of the slots overhangs
+    (see ``canonical_slots``) and the simulation parameters. Slots names
+    don't matter: the constructs of a cached prediction are renamed after
+    the slots of each new query.
+
+    Examples
+    --------
+
+    >>> cache = PredictionCache(cache_dir='kappagate_cache')
+    >>> score, constructs, _ = predict_assembly_accuracy(slots, cache=cache)
+
+    Parameters
+    ----------
+
+    max_size
+      Maximal number of predictions kept in memory. When the cache is full,
+      the least recently used predictions are dropped.
+
+    cache_dir
+      Path to a directory where every prediction is also stored as a JSON
+      file, so it can be reused by other processes or later runs.
+    """
+
+    def __init__(self, max_size=10000, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.memory = OrderedDict()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _filepath(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.json')
+
+    def get(self, slots, **parameters):
+        """Return a cached prediction (score, other_constructs), or None.
+
+        The parameters are the same as for ``predict_assembly_accuracy``
+        (except ``slots`` and ``cache``).
+        """
+        key = prediction_key(slots, **parameters)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            score, constructs = self.memory[key]
+        elif self.cache_dir is not None and os.path.exists(
+                self._filepath(key)):
+            with open(self._filepath(key), 'r') as f:
+                data = json.load(f)
+            score = data['score']
+            constructs = [(tuple(indices), proportion)
+                          for indices, proportion in data['constructs']]
+            self._store_in_memory(key, score, constructs)
+        else:
+            return None
+        return score, constructs_from_indices(slots, constructs)
+
+    def set(self, slots, score, other_constructs, **parameters):
+        """Store a prediction in the cache.
+
+        The parameters are the same as for ``predict_assembly_accuracy``
+        (except ``slots`` and ``cache``).
+        """
+        key = prediction_key(slots, **parameters)
+        constructs = constructs_to_indices(slots, other_constructs)
+        self._store_in_memory(key, float(score), constructs)
+        if self.cache_dir is not None:
+            filepath = self._filepath(key)
+            temporary_filepath = '%s.%d.tmp' % (filepath, os.getpid())
+            with open(temporary_filepath, 'w') as f:
+                json.dump(dict(score=float(score), constructs=constructs), f)
+            os.replace(temporary_filepath, filepath)
+
+    def _store_in_memory(self, key, score, constructs):
+        self.memory[key] = (score, constructs)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
@@ -0,0 +1,96 @@
+"""Timing and memory instrumentation of the stages of a prediction."""
+
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler:
+    """Record the wall time of the stages of a computation, and other metrics.
+
+    A profiler can be passed to ``predict_assembly_accuracy``,
+    ``slots_to_agents_and_rules``, ``parts_records_to_slots`` or
+    ``construct_record_to_slots`` (parameter ``profiler``), which then fill
+    its ``timings`` dict.
+
+    Examples
+    --------
+
+    >>> profiler = Profiler(callback=lambda name, value: print(name, value))
+    >>> predict_assembly_accuracy(slots, profiler=profiler)
+    >>> profiler.timings
+    {'annealing_data_time': 0.51, 'interaction_rates_time': 0.0004,
+     'n_agents': 12, 'rules_time': 0.002, 'n_rules': 87, ...}
+
+    Parameters
+    ----------
+
+    callback
+      Function ``f(name, value)`` called every time a metric is recorded,
+      e.g. to forward the metrics to a monitoring system.
+
+    track_memory
+      If True, the peak memory allocated by Python during the profiled
+      computations is recorded (in bytes) as ``peak_memory``. This uses
+      ``tracemalloc``, which slows down the computations. The memory of the
+      Kappa simulator (which runs in another process) is not counted.
+
+    Attributes
+    ----------
+
+    timings
+      A dict {metric_name: value}. The wall time of each stage (in seconds,
+      summed over all the times the stage was run) is recorded as
+      ``<stage>_time``. The other metrics are counts, such as ``n_agents``,
+      ``n_rules``, or ``n_complexes`` (complexes in the final state of a
+      simulation).
+    """
+
+    def __init__(self, callback=None, track_memory=False):
+        self.callback = callback
+        self.track_memory = track_memory
+        self.timings = {}
+        self._running_stages = 0
+        self._started_tracemalloc = False
+        # Stages may run in parallel threads (e.g. prediction replicates).
+        self._lock = threading.Lock()
+
+    def record(self, name, value):
+        """Record a metric (and send it to the callback, if any)."""
+        with self._lock:
+            self.timings[name] = value
+        if self.callback is not None:
+            self.callback(name, value)
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording the wall time of a stage."""
+        with self._lock:
+            if self.track_memory and (self._running_stages == 0):
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracemalloc = True
+            self._running_stages += 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - t0
+            key = '%s_time' % name
+            with self._lock:
+                self._running_stages -= 1
+                self.timings[key] = self.timings.get(key, 0) + duration
+                metrics = [(key, self.timings[key])]
+                if self.track_memory and (self._running_stages == 0):
+                    _, peak = tracemalloc.get_traced_memory()
+                    self.timings['peak_memory'] = max(
+                        peak, self.timings.get('peak_memory', 0))
+                    metrics.append(('peak_memory',
+                                    self.timings['peak_memory']))
+                    if self._started_tracemalloc:
+                        tracemalloc.stop()
+                        self._started_tracemalloc = False
+            if self.callback is not None:
+                for metric_name, value in metrics:
+                    self.callback(metric_name, value)
@@ -1,10 +1,87 @@
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import numpy as np
-import networkx as nx
-import itertools
+from functools import lru_cache
 
-from .predict_assembly_accuracy import slots_to_agents_and_rules
-from .tools import overhangs_list_to_slots, linear_graph_to_nodes_list
+from .annealing_matrix import slots_interaction_rates
+# Imported here for backward compatibility.
+from .colony_picking import (min_trials_for_one_success,
+                             average_trials_until_success, success_rate_facts)
+
+
+# Levels (numbers of colonies to pick) of the colony picking graph's curves.
+COLONY_PICKING_LEVELS = (list(range(1, 10)) +
+                         list(range(10, 20, 2)) +
+                         list(range(20, 30, 5)) +
+                         list(range(30, 55, 10)))
+COLONY_PICKING_YTICKS = [0.5, 0.2, 0.1, 0.05, 0.01]
+
+
+@lru_cache(maxsize=None)
+def _colony_picking_curves(x_range=(0.05, 0.999), y_range=(0.001, 0.5),
+                           n_points=500):
+    """Return the curves of the colony picking graph, as a list of arrays.
+
+    The curve of level N is the set of points (success rate x, risk y) such
+    that N colonies are needed to get at least one good clone with
+    certainty 1 - y, i.e. y = (1 - x)^N. The curves are computed (once per
+    process) from this equation, with points evenly spaced on the log scale
+    of the y axis.
+    """
+    curves = []
+    for level in COLONY_PICKING_LEVELS:
+        y_max = min(y_range[1], (1 - x_range[0]) ** level)
+        y_min = max(y_range[0], (1 - x_range[1]) ** level)
+        yy = np.geomspace(y_max, y_min, n_points)
+        curve = np.array([1 - yy ** (1.0 / level), yy]).T
+        curve.flags.writeable = False
+        curves.append(curve)
+    return curves
+
+
+def _plot_colony_picking_background(ax):
+    """Plot the axes, curves and labels of the colony picking graph."""
+    ax.set_title("Number of colonies to pick to get at least one "
+                 "good clone with certainty X%\n",
+                 fontdict=dict(size=16))
+    ax.set_xlabel("Proportion of good clones", fontdict=dict(size=16))
+    ax.set_ylabel("Certainty level", fontdict=dict(size=16))
+    ax.set_yscale('log')
+
+    xticks = np.arange(0.1, 1.01, 0.1)
+    yticks = COLONY_PICKING_YTICKS
+    ax.set_xticks(xticks)
+    ax.set_xticklabels([("%.02f" % (x)).rstrip('0') for x in xticks])
+    ax.set_yticks(yticks)
+    ax.set_yticklabels(["%d%%" % (100 * (1 - y)) for y in yticks])
+    ax.set_xlim(0.05, 0.999)
+    ax.set_ylim(0.001, 0.5)
+    ax.add_collection(LineCollection(_colony_picking_curves(),
+                                     colors='black', linewidths=1.5))
+    # Labels are written along the curves, at 97.5% certainty.
+    levels = np.array(COLONY_PICKING_LEVELS, dtype=float)
+    label_x = 1.0 - 0.025 ** (1.0 / levels)
+    label_points = ax.transData.transform(np.array([
+        [label_x, np.full(len(levels), 0.025)],
+        [label_x + 1e-3, (1 - label_x - 1e-3) ** levels]
+    ]).transpose(0, 2, 1).reshape(-1, 2)).reshape(2, -1, 2)
+    dx, dy = (label_points[1] - label_points[0]).T
+    angles = np.degrees(np.arctan(dy / dx))
+    for level, x, angle in zip(COLONY_PICKING_LEVELS, label_x, angles):
+        ax.text(x, 0.025, '%d' % level, fontsize=10, ha='center',
+                va='center', rotation=angle, rotation_mode='anchor',
+                bbox=dict(facecolor='white', edgecolor='none', pad=0.5))
+
+
+def _plot_success_rate_marker(ax, success_rate):
+    """Highlight a success rate on the colony picking graph, return the
+    created artists."""
+    line = ax.axvline(x=success_rate, ls=':', color='red')
+    points = ax.plot(len(COLONY_PICKING_YTICKS) * [success_rate],
+                     COLONY_PICKING_YTICKS,
+                     lw=0, marker='o', c='r', markeredgecolor='r',
+                     markerfacecolor='white')
+    return [line] + points
 
 
 def plot_colony_picking_graph(success_rate=None, ax=None):
@@ -27,93 +104,95 @@ def plot_colony_picking_graph(success_rate=None, ax=None):
     """
     if ax is None:
         fig, ax = plt.subplots(1, figsize=(15, 5))
-    ax.set_title("Number of colonies to pick to get at least one "
-                 "good clone with certainty X%\n",
-                 fontdict=dict(size=16))
-    ax.set_xlabel("Proportion of good clones", fontdict=dict(size=16))
-    ax.set_ylabel("Certainty level", fontdict=dict(size=16))
-    ax.set_yscale('log')
-    # ax.set_xscale('log')
+    _plot_colony_picking_background(ax)
+    if success_rate is not None:
+        _plot_success_rate_marker(ax, success_rate)
+    return ax
 
-    # ax.invert_yaxis()
 
-    X = np.linspace(0.05, 0.999, 1000)
-    Y = np.linspace(0.001, 0.500, 1000)[::-1]
-    XX, YY = np.meshgrid(X, Y)
-    ZZ = np.log(YY)/np.log(1-XX)
-    levels = (list(range(1, 10)) +
-              list(range(10, 20, 2)) +
-              list(range(20, 30, 5)) +
-              list(range(30, 55, 10))) 
-    # ax.contourf(XX, YY, ZZ, levels=levels)
+def plot_colony_picking_graphs(success_rates, ax=None):
+    """Plot the colony picking graphs of many success rates, fast.
 
-    xticks = np.arange(0.1, 1.01, 0.1)
-    yticks = [0.5, 0.2, 0.1, 0.05, 0.01]
-    ax.set_xticks(xticks)
-    ax.set_xticklabels([("%.02f" % (x)).rstrip('0') for x in xticks])
-    ax.set_yticks(yticks)
-    ax.set_yticklabels(["%d%%" % (100 * (1 - y)) for y in yticks])
-    cs = ax.contour(XX, YY, ZZ, levels=levels, colors=['black'])
-    ax.clabel(cs, inline=1, fontsize=10, fmt='%d',
-              manual=[(1.0 - (0.025) ** (1.0/x), 0.025) for x in levels])
-    if success_rate is not None:
-        ax.axvline(x=success_rate, ls=':', color='red')
-        ax.plot(len(yticks) * [success_rate],
-                [y for y in yticks],
-                lw=0, marker='o', c='r', markeredgecolor='r',
-                markerfacecolor='white')
-    return ax
+    The graph is drawn once, then for each success rate the marker of the
+    success rate is added, the graph is yielded (so it can be saved), and
+    the marker is removed. Save each graph before requesting the next one.
+
+    Examples
+    --------
+
+    >>> rates = {'construct_1': 0.95, 'construct_2': 0.4}
+    >>> for name, ax in plot_colony_picking_graphs(rates):
+    >>>     ax.figure.savefig('%s.png' % name)
+
+    Parameters
+    ----------
+
+    success_rates
+      A dict {name: success_rate} or a list of success rates (in which case
+      the names are the indices in the list).
+
+    ax
+      A matplotlib ax (one is created if none is provided)
 
-def min_trials_for_one_success(success_rate, certainty):
-    """Return the minimal number of trials to be X% certain to have at least
-    one success."""
-    if success_rate == 1:
-      return 1
-    if success_rate == 0:
-      return np.Inf
-    return np.ceil(np.log(1 - certainty) / np.log(1 - success_rate))
-
-def average_trials_until_success(success_rate):
-    """Return the average number of trials before a success is encountered."""
-    if success_rate == 0:
-      return np.Inf
-    return 1.0 / success_rate
-
-def success_rate_facts(success_rate, plain_text=True):
-    """Return relevant stats for the given success rate.
-    
-    
     Returns
     -------
-    plain_text (if plain_text=True)
-      A plain text as follows: "The valid colony rate is 47.7%. Expect 1.9
-      clones in average until success. Pick 5 clones or more for 95% chances
-      of at least one success. If no success after 8 clones, there is
-      likely another problem (p-value=0.01)"
 
-    dict (if plain_text=False)
-      Dict containing the same infos as above: dict(success_rate_percent,
-      average_colonies, min_trials_q95, max_trials_q99)
-        )
+    graphs
+      A generator of (name, ax) where ax shows the graph of the success
+      rate with that name.
+    """
+    if not isinstance(success_rates, dict):
+        success_rates = dict(enumerate(success_rates))
+    ax = plot_colony_picking_graph(ax=ax)
+    for name, success_rate in success_rates.items():
+        artists = _plot_success_rate_marker(ax, success_rate)
+        try:
+            yield name, ax
+        finally:
+            for artist in artists:
+                artist.remove()
+
+def _slots_sites_order(slots):
+    """Return the sites (slot_name, overhang) of the slots, in the order of
+    the assembly chain.
 
+    Sites with the same overhang are matched through a dictionary, and the
+    chain is walked from its first end (the first slot's left site, if it
+    has no match). If the slots do not form a chain, the order of the slots
+    is used.
     """
-    if not plain_text:
-        return dict(
-            success_rate_percent=100 * success_rate,
-            average_colonies=average_trials_until_success(success_rate),
-            min_trials_q95=min_trials_for_one_success(success_rate, 0.95),
-            max_trials_q99=min_trials_for_one_success(success_rate, 0.99)
-        )
-    results =  success_rate_facts(success_rate, plain_text=False)
-    return (
-        "The valid colony rate is %(success_rate_percent).1f%%. Expect "
-        "%(average_colonies).1f clones in average until "
-        "success. Pick %(min_trials_q95)d clones or more for 95%% chances of "
-        "at least one success. If no success after %(max_trials_q99)d clones, "
-        "there is likely another problem (p-value=0.01)") % results
+    sites_by_overhang = {}
+    for name, left, right in slots:
+        for site in [(name, left), (name, right)]:
+            sites_by_overhang.setdefault(site[1], []).append(site)
+    other_side = {}
+    for name, left, right in slots:
+        other_side[(name, left)] = (name, right)
+        other_side[(name, right)] = (name, left)
+    ends = [site for sites in sites_by_overhang.values() if len(sites) == 1
+            for site in sites]
+    default_order = [site for name, left, right in slots
+                     for site in [(name, left), (name, right)]]
+    if len(ends) != 2:
+        return default_order
+    ends.sort(key=default_order.index)
+    order, site = [], ends[0]
+    while True:
+        order += [site, other_side[site]]
+        if other_side[site] == ends[1]:
+            break
+        matches = [s for s in sites_by_overhang[other_side[site][1]]
+                   if s != other_side[site]]
+        if (len(matches) != 1) or (len(order) >= len(default_order)):
+            return default_order
+        site = matches[0]
+    return order if len(order) == len(default_order) else default_order
+
 
 def plot_circular_interactions(slots, annealing_data=('25C', '01h'),
-                               corrective_factor=1.0, rate_limit=200, ax=None):
+                               corrective_factor=1.0, rate_limit=200, ax=None,
+                               top_k=None, rasterized=False, rates=None,
+                               max_figure_size=20):
     """Plot the slots circularly, show the strength of overhangs interactions.
     
     Parameters
@@ -135,6 +214,26 @@ def plot_circular_interactions(slots, annealing_data=('25C', '01h'),
     
     ax
       A matplotlib ax (one is created and returned if none is provided)
+
+    top_k
+      If provided, only the ``top_k`` strongest unexpected interactions are
+      shown (the expected interactions, between different sites with the
+      same overhang, are all shown). Useful for large assemblies.
+
+    rasterized
+      If True, the lines and texts are rasterized when the figure is saved
+      in a vector format (PDF, SVG), so that huge designs still render
+      quickly.
+
+    rates
+      Precomputed interaction rates (see
+      ``annealing_matrix.slots_interaction_rates``), in which case
+      ``annealing_data`` and ``corrective_factor`` are ignored.
+
+    max_figure_size
+      Maximal width and height (in inches) of the figure created when no
+      ax is provided. Below this size, the figure grows with the number of
+      slots.
     
     Returns
     -------
@@ -142,73 +241,89 @@ def plot_circular_interactions(slots, annealing_data=('25C', '01h'),
       The matplotlib ax of the plot
 
     """ 
-    agents, rules = slots_to_agents_and_rules(
-        slots, annealing_data=annealing_data,
-        corrective_factor=corrective_factor)
-
-
-    graph = nx.Graph([((s[0], s[1]), (s[0], s[2])) for s in slots])
-    expected_interactions = []
-    for n1, n2 in itertools.combinations(list(graph.nodes()), 2):
-        if n1[1] == n2[1]:
-            graph.add_edge(n1, n2)
-            expected_interactions.append((n1, n2))
-    ordered_nodes = linear_graph_to_nodes_list(graph)
+    if rates is None:
+        rates = slots_interaction_rates(slots, annealing_data=annealing_data,
+                                        corrective_factor=corrective_factor)
+    ordered_nodes = _slots_sites_order(slots)
     positions = {
         node: (np.sin(a), np.cos(a))
         for (node, a) in zip(ordered_nodes,
                              np.linspace(0, 6.28, len(ordered_nodes) + 1))
     }
 
+    # Interactions {(site1, site2): rate}, as the rules of the assembly's
+    # model. Interactions between the same two sites are drawn once.
+    interactions = {}
+    for i1, i2, side in zip(*np.nonzero(rates >= max(rate_limit, 1e-300))):
+        name1, _, right1 = slots[i1]
+        name2 = slots[i2][0]
+        node1, node2 = (name1, right1), (name2, slots[i2][1 + side])
+        interactions.pop((node2, node1), None)
+        interactions[(node1, node2)] = rates[i1, i2, side]
+    interactions = [
+        # Expected if between different sites with the same overhang.
+        (n1, n2, rate, n1 != n2 and n1[1] == n2[1])
+        for (n1, n2), rate in interactions.items()
+    ]
+    if top_k is not None:
+        unexpected = sorted([i for i in interactions if not i[3]],
+                            key=lambda i: -i[2])
+        interactions = ([i for i in interactions if i[3]] +
+                        unexpected[:top_k])
 
-    graph = nx.Graph()
-
-    for a in agents:
-        graph.add_edge(*((a.name, site) for site in a.sites), rate=1.0,
-                       is_slot=True, slot_name=a.name)
-    for rule in rules:
-        if rule.rate < rate_limit:
-            continue
-        graph.add_edge(*((rule.reactants[i].agent, rule.reactants[i].site)
-                         for i in range(2)),
-                       rate=rule.rate, is_interaction=True)
-    
     if ax is None:
-        fig, ax = plt.subplots(1, figsize=(len(slots), len(slots)))
+        size = min(len(slots), max_figure_size)
+        fig, ax = plt.subplots(1, figsize=(size, size))
     ax.axis("off")
-    # ax.set_aspect('equal')
-    for (n1, n2, data) in graph.edges(data=True):
-        (x1, y1), (x2, y2) =  positions[n1], positions[n2]
+    artists = []
+    lines, colors = [], []
+    for n1, n2, rate, is_expected in interactions:
+        (x1, y1), (x2, y2) = positions[n1], positions[n2]
         xmiddle, ymiddle = np.array((0.5 * (x1 + x2), 0.5 * (y1 + y2)))
-        if data.get('is_interaction', False):
-            if any(i in expected_interactions for i in [(n1, n2), (n2, n1)]):
-                color, weight = 'grey', 'normal'
-            else:
-                color, weight = 'red', 'bold'
-            ax.plot([x1, x2], [y1, y2], c=color, ls=':')
-            factor = 1.2 if n1 == n2 else 1.0
-            ax.text(factor * xmiddle, factor * ymiddle, "%d" % data['rate'],
-                    ha='center', va='center',
-                    fontdict=dict(color=color, weight=weight, size=10),
-                    bbox=dict(boxstyle='round',
-                          facecolor='#ffffffcc',
-                          edgecolor='white'), zorder=1000)
-        if data.get('is_slot', False):
-            ax.plot([x1, x2], [y1, y2], c='b', ls='-', lw=6, alpha=0.3)
-            ax.plot([xmiddle, 1.2 * xmiddle], [ymiddle, 1.3 * ymiddle],
-                    c='b', ls='-', alpha=0.3, lw=2)
-            ax.text(1.3 * xmiddle, 1.3 * ymiddle, data['slot_name'],
-                    ha='center', va='center',
-                    fontdict=dict(color='blue', weight='bold'),
-                    bbox=dict(boxstyle='round',
-                          facecolor='white',
-                          edgecolor='white'), zorder=500)
-            
-            
-    for node in graph.nodes():
+        if is_expected:
+            color, weight = 'grey', 'normal'
+        else:
+            color, weight = 'red', 'bold'
+        lines.append([(x1, y1), (x2, y2)])
+        colors.append(color)
+        factor = 1.2 if n1 == n2 else 1.0
+        artists.append(ax.text(
+            factor * xmiddle, factor * ymiddle, "%d" % rate,
+            ha='center', va='center',
+            fontdict=dict(color=color, weight=weight, size=10),
+            bbox=dict(boxstyle='round',
+                      facecolor='#ffffffcc',
+                      edgecolor='white'), zorder=1000))
+    artists.append(ax.add_collection(
+        LineCollection(lines, colors=colors, linestyles=':')))
+
+    slots_lines, ticks_lines = [], []
+    for name, left, right in slots:
+        (x1, y1), (x2, y2) = positions[(name, left)], positions[(name, right)]
+        xmiddle, ymiddle = np.array((0.5 * (x1 + x2), 0.5 * (y1 + y2)))
+        slots_lines.append([(x1, y1), (x2, y2)])
+        ticks_lines.append([(xmiddle, ymiddle),
+                            (1.2 * xmiddle, 1.3 * ymiddle)])
+        artists.append(ax.text(
+            1.3 * xmiddle, 1.3 * ymiddle, name,
+            ha='center', va='center',
+            fontdict=dict(color='blue', weight='bold'),
+            bbox=dict(boxstyle='round',
+                      facecolor='white',
+                      edgecolor='white'), zorder=500))
+    artists.append(ax.add_collection(LineCollection(
+        slots_lines, colors='b', linestyles='-', linewidths=6, alpha=0.3)))
+    artists.append(ax.add_collection(LineCollection(
+        ticks_lines, colors='b', linestyles='-', linewidths=2, alpha=0.3)))
+
+    for node in ordered_nodes:
         x, y = positions[node]
-        ax.text(x, y, node[1], ha='center', va='center',
-                bbox=dict(boxstyle='round',
-                          facecolor='white',
-                          edgecolor='white'))
-    return ax
\ No newline at end of file
+        artists.append(ax.text(x, y, node[1], ha='center', va='center',
+                               bbox=dict(boxstyle='round',
+                                         facecolor='white',
+                                         edgecolor='white')))
+    ax.autoscale_view()
+    if rasterized:
+        for artist in artists:
+            artist.set_rasterized(True)
+    return ax
@@ -0,0 +1,266 @@
+"""Serve on-demand predictions from an asyncio application (e.g. a web
+backend), with a pool of warm worker processes."""
+
+import asyncio
+import functools
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from .annealing_matrix import get_annealing_matrix
+from .predict_assembly_accuracy import predict_assembly_accuracy
+from .prediction_cache import (PredictionCache, prediction_key,
+                               constructs_to_indices,
+                               constructs_from_indices)
+
+
+# Parameters of predict_assembly_accuracy which do not change the prediction.
+EXECUTION_PARAMETERS = ('n_jobs', 'profiler')
+
+
+def _model_parameters(parameters):
+    """Return the parameters identifying a prediction (for the cache)."""
+    return {
+        name: value for name, value in parameters.items()
+        if name not in EXECUTION_PARAMETERS
+    }
+
+
+def _warm_up_worker(datasets):
+    """Import the simulation libraries and load the annealing datasets."""
+    import topkappy  # noqa: F401 (imported for its side effects)
+    for dataset in datasets:
+        get_annealing_matrix(dataset)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _retrieve_exception(future):
+    """Mark the exception of a prediction as retrieved, as all the requests
+    waiting for it may have timed out."""
+    if not future.cancelled():
+        future.exception()
+
+
+def _predict(slots, parameters):
+    """Run a prediction in a worker, return (score, other_constructs)."""
+    score, other_constructs, _ = predict_assembly_accuracy(slots,
+                                                           **parameters)
+    return score, other_constructs
+
+
+class AsyncPredictor:
+    """Predict assemblies accuracies on demand, in warm worker processes.
+
+    The workers are started (with the simulation libraries imported and the
+    annealing datasets loaded) before the first request. Identical requests
+    (same assembly, possibly with other slots names, and same parameters)
+    which are in flight at the same time are coalesced into a single
+    prediction.
+
+    Examples
+    --------
+
+    >>> async def main():
+    >>>     async with AsyncPredictor(n_workers=4, timeout=60) as predictor:
+    >>>         score, other_constructs = await predictor.predict(slots)
+    >>>         print(predictor.metrics())
+
+    Parameters
+    ----------
+
+    n_workers
+      Number of worker processes. Defaults to the number of CPUs.
+
+    timeout
+      Default maximal time (in seconds) a request waits for its prediction
+      before ``asyncio.TimeoutError`` is raised. The prediction still
+      completes in its worker (and is still cached, and served to other
+      identical requests).
+
+    preloaded_datasets
+      Annealing datasets (couples (temperature, duration)) loaded by each
+      worker at startup.
+
+    cache
+      A ``PredictionCache`` in which completed predictions are stored, and
+      from which requests are served when possible. Defaults to an
+      in-memory cache. Use ``cache=False`` for no cache. The reads and
+      writes of a cache with a disk tier are run in a separate thread, so
+      as not to block the event loop.
+
+    latency_window
+      Number of most recent requests used to compute the latency metrics.
+
+    **parameters
+      Default parameters of the predictions (see
+      ``predict_assembly_accuracy``), e.g. ``initial_quantities``.
+    """
+
+    def __init__(self, n_workers=None, timeout=None,
+                 preloaded_datasets=(('25C', '01h'),), cache=None,
+                 latency_window=1000, **parameters):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.preloaded_datasets = preloaded_datasets
+        if cache is None:
+            cache = PredictionCache()
+        self.cache = cache or None
+        self.parameters = parameters
+        self.executor = None
+        self.cache_executor = None
+        self.in_flight = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.counts = dict(requests=0, coalesced=0, cache_hits=0, timeouts=0,
+                           errors=0)
+        self.n_waiting_requests = 0
+
+    async def start(self):
+        """Start the worker processes and wait until they are all warm."""
+        if self.executor is not None:
+            return
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_workers, initializer=_warm_up_worker,
+            initargs=(self.preloaded_datasets,))
+        # A single thread, so the cache is never accessed concurrently.
+        self.cache_executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self.executor, _ping)
+            for _ in range(self.n_workers)
+        ])
+
+    async def close(self):
+        """Shut the worker processes down (after the running predictions)."""
+        if self.executor is None:
+            return
+        executor, self.executor = self.executor, None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, executor.shutdown)
+        self.cache_executor.shutdown()
+        self.cache_executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def predict(self, slots, timeout=None, **parameters):
+        """Predict the accuracy of an assembly.
+
+        Parameters
+        ----------
+
+        slots
+          A list [(slot_name, left_overhang, right_overhang), ...]
+
+        timeout
+          Maximal waiting time for this request, in seconds (defaults to the
+          predictor's timeout).
+
+        **parameters
+          Parameters of ``predict_assembly_accuracy``, overriding the
+          predictor's default parameters. Execution parameters (see
+          ``EXECUTION_PARAMETERS``) are passed to the worker, but do not
+          identify the prediction for caching and coalescing.
+
+        Returns
+        -------
+
+        proportion, other_constructs
+          As returned by ``predict_assembly_accuracy``.
+        """
+        await self.start()
+        t0 = time.perf_counter()
+        self.counts['requests'] += 1
+        parameters = dict(self.parameters, **parameters)
+        if timeout is None:
+            timeout = self.timeout
+        model_parameters = _model_parameters(parameters)
+        if self.cache is not None:
+            cached_prediction = await self._cache_call(
+                self.cache.get, slots, **model_parameters)
+            if cached_prediction is not None:
+                self.counts['cache_hits'] += 1
+                self.latencies.append(time.perf_counter() - t0)
+                return cached_prediction
+        key = prediction_key(slots, **model_parameters)
+        if key in self.in_flight:
+            self.counts['coalesced'] += 1
+        else:
+            self.in_flight[key] = asyncio.ensure_future(
+                self._run_prediction(key, slots, parameters))
+            self.in_flight[key].add_done_callback(_retrieve_exception)
+        self.n_waiting_requests += 1
+        try:
+            # The prediction is shielded, as other requests may be waiting
+            # for it when this request times out.
+            score, constructs = await asyncio.wait_for(
+                asyncio.shield(self.in_flight[key]), timeout)
+        except asyncio.TimeoutError:
+            self.counts['timeouts'] += 1
+            raise
+        except Exception:
+            self.counts['errors'] += 1
+            raise
+        finally:
+            self.n_waiting_requests -= 1
+            self.latencies.append(time.perf_counter() - t0)
+        return score, constructs_from_indices(slots, constructs)
+
+    async def _run_prediction(self, key, slots, parameters):
+        """Return (score, constructs_indices) and cache the prediction."""
+        loop = asyncio.get_running_loop()
+        try:
+            score, other_constructs = await loop.run_in_executor(
+                self.executor, functools.partial(_predict, slots, parameters))
+            # The prediction is cached before it leaves in_flight, so that
+            # identical requests arriving meanwhile are coalesced.
+            if self.cache is not None:
+                await self._cache_call(self.cache.set, slots, score,
+                                       other_constructs,
+                                       **_model_parameters(parameters))
+        finally:
+            self.in_flight.pop(key)
+        return score, constructs_to_indices(slots, other_constructs)
+
+    async def _cache_call(self, method, *args, **kwargs):
+        """Call a method of the cache, in the cache's thread if the cache
+        has a disk tier (in-memory caches are called directly)."""
+        function = functools.partial(method, *args, **kwargs)
+        if getattr(self.cache, 'cache_dir', None) is None:
+            return function()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cache_executor, function)
+
+    def metrics(self):
+        """Return a dict of metrics on the predictor's activity.
+
+        The metrics are ``queue_depth`` (predictions submitted to the workers
+        and not completed), ``waiting_requests`` (requests awaiting a
+        prediction, including coalesced ones), the total numbers of
+        ``requests``, ``coalesced`` requests, ``cache_hits``, ``timeouts``
+        and ``errors``, and the ``latency_mean``, ``latency_p50``,
+        ``latency_p95`` and ``latency_max`` of the most recent requests, in
+        seconds (None before any request).
+        """
+        metrics = dict(queue_depth=len(self.in_flight),
+                       waiting_requests=self.n_waiting_requests,
+                       **self.counts)
+        latencies = np.array(self.latencies)
+        for name, function in [('mean', np.mean),
+                               ('p50', functools.partial(np.percentile,
+                                                         q=50)),
+                               ('p95', functools.partial(np.percentile,
+                                                         q=95)),
+                               ('max', np.max)]:
+            metrics['latency_' + name] = (float(function(latencies))
+                                          if len(latencies) else None)
+        return metrics
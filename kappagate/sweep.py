@@ -0,0 +1,175 @@
+"""Evaluate an assembly's predicted accuracy over a grid of parameters."""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .annealing_matrix import slots_interaction_rates
+from .ode_simulation import ode_assembly_accuracy
+from .population_simulation import population_assembly_accuracy
+from .predict_assembly_accuracy import (interaction_rule,
+                                        snapshot_agents_to_constructs)
+
+
+def _scaled_rules(agents, rates, corrective_factor):
+    """Return the rules of an assembly, with the corrective factor applied to
+    the (uncorrected) rates."""
+    return [
+        interaction_rule(agents[i1], agents[i2], side,
+                         rates[i1, i2, side] ** corrective_factor)
+        for i1, i2, side in zip(*np.nonzero(rates))
+    ]
+
+
+def _sweep_job(job):
+    """Return [(duration, score, constructs), ...] for one grid point."""
+    (slots, agents, rates, corrective_factor, durations, initial_quantities,
+     seed, engine) = job
+    rules = _scaled_rules(agents, rates, corrective_factor)
+    if engine == 'ode':
+        return [
+            (duration,) + ode_assembly_accuracy(
+                slots, agents, rules, initial_quantities=initial_quantities,
+                duration=duration)[:2]
+            for duration in durations
+        ]
+    if engine == 'population':
+        # One simulation per duration, each from the initial state.
+        return [
+            (duration,) + population_assembly_accuracy(
+                slots, agents, rules, initial_quantities=initial_quantities,
+                duration=duration, seed=seed)[:2]
+            for duration in durations
+        ]
+    from topkappy import KappaModel
+    if isinstance(initial_quantities, int):
+        initial_quantities = {a: initial_quantities for a in agents}
+    # A single simulation is run, with a snapshot at each duration.
+    snapshot_times = {'t%d' % i: duration
+                      for i, duration in enumerate(durations)}
+    model = KappaModel(agents=agents, rules=rules,
+                       initial_quantities=initial_quantities,
+                       duration=max(durations),
+                       snapshot_times=snapshot_times)
+    model.parameters.seed = seed
+    snapshots = model.get_simulation_results()['snapshots']
+    results = []
+    for name, duration in snapshot_times.items():
+        # Snapshots after a deadlock are missing: the state is final.
+        snapshot = snapshots.get(name, snapshots.get('deadlock'))
+        if snapshot is None:
+            raise ValueError(
+                "KaSim returned no snapshot at time %s (nor a deadlock "
+                "snapshot) for corrective factor %s." % (
+                    duration, corrective_factor))
+        score, constructs, _ = snapshot_agents_to_constructs(
+            slots, snapshot['snapshot_agents'])
+        results.append((duration, score, constructs))
+    return results
+
+
+def sweep(slots, corrective_factors=(1.0,), annealing_data=(('25C', '01h'),),
+          durations=(1000,), initial_quantities=1000, engine='kappa',
+          seed=None, n_jobs=None, n_misassemblies=3):
+    """Predict the accuracy of an assembly for every point of a parameter grid.
+
+    The interactions between the slots are computed once per annealing
+    dataset, and only rescaled for each corrective factor. With the 'kappa'
+    engine, all durations are read from snapshots of a same simulation (with
+    the 'ode' and 'population' engines, each duration is a new run).
+
+    Examples
+    --------
+
+    >>> table = sweep(slots, corrective_factors=[0.8, 1, 1.2],
+    >>>               annealing_data=[('25C', '01h'), ('37C', '01h')])
+    >>> table.pivot_table('score', 'corrective_factor', 'annealing_data')
+
+    Parameters
+    ----------
+
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...]
+
+    corrective_factors
+      List of corrective factors to evaluate.
+
+    annealing_data
+      List of annealing datasets to evaluate, each being either a couple
+      (temperature, duration) indicating an experimental dataset from
+      Potapov et al. 2018, or a pandas dataframe.
+
+    durations
+      List of virtual durations of the ligation reaction to evaluate.
+
+    initial_quantities, engine
+      See ``predict_assembly_accuracy``.
+
+    seed
+      If provided, the simulations of the grid points are run with seeds
+      ``seed``, ``seed + 1``, etc., for reproducible sweeps.
+
+    n_jobs
+      Number of processes running grid points in parallel. Defaults to the
+      number of CPUs. With ``n_jobs=1`` everything is run in the current
+      process.
+
+    n_misassemblies
+      Number of most frequent misassemblies (constructs other than the
+      expected one) reported for each grid point.
+
+    Returns
+    -------
+
+    table
+      A pandas dataframe with one row per grid point and columns
+      ``annealing_data`` (e.g. "25C/01h", or the index of the dataframe in
+      ``annealing_data``), ``corrective_factor``, ``duration``, ``score``,
+      and for each of the most frequent misassemblies ``misassembly_i``
+      (tuple of slots names) and ``misassembly_i_proportion``.
+    """
+    if engine not in ('kappa', 'ode', 'population'):
+        raise ValueError("Unknown engine: %s" % engine)
+    import pandas
+    from topkappy import KappaAgent
+
+    agents = [KappaAgent(name, (left, right)) for name, left, right in slots]
+    datasets = []
+    for i, dataset in enumerate(annealing_data):
+        name = '/'.join(dataset) if isinstance(dataset, tuple) else i
+        rates = slots_interaction_rates(slots, annealing_data=dataset)
+        datasets.append((name, rates))
+    grid = list(itertools.product(datasets, corrective_factors))
+    jobs = [
+        (slots, agents, rates, corrective_factor, list(durations),
+         initial_quantities, None if seed is None else seed + i, engine)
+        for i, ((_, rates), corrective_factor) in enumerate(grid)
+    ]
+    if n_jobs == 1:
+        jobs_results = [_sweep_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            jobs_results = list(executor.map(_sweep_job, jobs))
+
+    expected_orders = [tuple(name for name, _, _ in slots)]
+    expected_orders.append(expected_orders[0][::-1])
+    rows = []
+    for ((name, _), corrective_factor), results in zip(grid, jobs_results):
+        for duration, score, constructs in results:
+            row = dict(annealing_data=name,
+                       corrective_factor=corrective_factor,
+                       duration=duration, score=score)
+            misassemblies = sorted([
+                (proportion, construct)
+                for construct, proportion in constructs.items()
+                if construct not in expected_orders
+            ], reverse=True)[:n_misassemblies]
+            for i in range(n_misassemblies):
+                proportion, construct = (misassemblies[i]
+                                         if i < len(misassemblies)
+                                         else (0.0, None))
+                row['misassembly_%d' % (i + 1)] = construct
+                row['misassembly_%d_proportion' % (i + 1)] = proportion
+            rows.append(row)
+    return pandas.DataFrame(rows)
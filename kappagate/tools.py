@@ -1,49 +1,190 @@
 import os
-import networkx as nx
-from Bio import SeqIO
-from dnacauldron import (
-    RestrictionLigationMix,
-    autoselect_enzyme,
-    list_overhangs_from_record_annotations,
-    generate_type2s_restriction_mix,
-)
-from dnacauldron.biotools import reverse_complement
-from snapgene_reader import snapgene_file_to_seqrecord
-
-
-def parts_records_to_slots(parts_records, enzyme="auto"):
-    """Return slots from parts records, ready to feed to other methods.
-    
+import hashlib
+from collections import OrderedDict
+
+from .annealing_matrix import reverse_complement
+from .profiling import Profiler
+
+# Biopython, DnaCauldron and snapgene_reader are slow to import, and are not
+# needed to work with overhangs lists, so the functions parsing records
+# import them when first called.
+
+
+# Parts are typically reused in many assemblies, so their digestions are
+# cached, keyed by (sequence_hash, enzyme), in LRU caches of at most
+# DIGESTION_CACHE_MAX_SIZE entries. See ``part_record_digestion`` and
+# ``clear_digestion_caches``.
+DIGESTION_CACHE_MAX_SIZE = 10000
+_PARTS_SLOTS_CACHE = OrderedDict()
+_PARTS_SITES_CACHE = OrderedDict()
+
+
+def _cache_get(cache, key):
+    """Return the cached value of the key (or None), as most recently used."""
+    if key not in cache:
+        return None
+    cache.move_to_end(key)
+    return cache[key]
+
+
+def _cache_set(cache, key, value):
+    """Cache the value, and drop the least recently used values if the cache
+    is full."""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > DIGESTION_CACHE_MAX_SIZE:
+        cache.popitem(last=False)
+
+
+def clear_digestion_caches():
+    """Empty the caches of parts digestions and enzyme sites counts."""
+    _PARTS_SLOTS_CACHE.clear()
+    _PARTS_SITES_CACHE.clear()
+
+
+def _record_hash(record):
+    """Return a hash of the record's sequence and topology."""
+    topology = record.annotations.get("topology", None)
+    data = "%s|%s" % (topology, str(record.seq).upper())
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def part_record_digestion(record, enzyme, cache=True):
+    """Return the overhangs of the fragments of a part digested by an enzyme.
+
     Parameters
     ----------
-    parts_records
-      A list of Biopython records of the parts of the assembly. Do NOT
-      include the backbone.
-    
+    record
+      A Biopython record of a part.
+
     enzyme
-      Name of a Type-2S enzyme or "auto" to select automatically based
-      on restriction sites in the records sequences.
+      Name of a Type-2S enzyme.
+
+    cache
+      If True, the result is cached (keyed by the record's sequence hash and
+      the enzyme), and a part with the same sequence is never digested twice.
+
+    Returns
+    -------
+    overhangs
+      A tuple ((left_overhang, right_overhang), ...) of the overhangs of the
+      part's fragments (only the fragments without restriction sites),
+      in the orientation of the record.
+    """
+    from dnacauldron import generate_type2s_restriction_mix
+
+    key = (_record_hash(record), enzyme)
+    if cache:
+        overhangs = _cache_get(_PARTS_SLOTS_CACHE, key)
+        if overhangs is not None:
+            return overhangs
+    mix = generate_type2s_restriction_mix(parts=[record], enzyme=enzyme)
+    # The fragments' sticky ends are read from DnaCauldron 2's mix internals
+    # (``filtered_fragments``, ``is_reversed``, ``seq.left_end`` and
+    # ``seq.right_end``), hence the dnacauldron version pinned in setup.py.
+    overhangs = tuple(
+        tuple(
+            "" if overhang is None else str(overhang)
+            for overhang in (f.seq.left_end, f.seq.right_end)
+        )
+        for f in mix.filtered_fragments
+        if not f.is_reversed
+    )
+    if cache:
+        _cache_set(_PARTS_SLOTS_CACHE, key, overhangs)
+    return overhangs
+
+
+def _autoselect_enzyme(parts_records, cache=True):
+    """Select the enzyme with the closest to 2 sites in every part.
+
+    This is DnaCauldron's ``autoselect_enzyme``, with the number of sites in
+    each part cached.
+    """
+    from Bio import Restriction
+    from dnacauldron.biotools import record_is_linear
+    from dnacauldron.biotools.autoselect_enzyme import type2S_enzymes
+
+    def number_of_sites(enzyme_name, record):
+        key = (_record_hash(record), enzyme_name)
+        if cache:
+            n_sites = _cache_get(_PARTS_SITES_CACHE, key)
+            if n_sites is not None:
+                return n_sites
+        enzyme = Restriction.__dict__[enzyme_name]
+        linear = record_is_linear(record, default=False)
+        n_sites = len(enzyme.search(record.seq, linear=linear))
+        if cache:
+            _cache_set(_PARTS_SITES_CACHE, key, n_sites)
+        return n_sites
+
+    def enzyme_fit_score(enzyme_name):
+        return sum(
+            [abs(2 - number_of_sites(enzyme_name, r)) for r in parts_records]
+        )
+
+    return min(type2S_enzymes, key=enzyme_fit_score)
+
 
+def _standardized_slot(left, right):
+    return min(
+        (left, right), (reverse_complement(right), reverse_complement(left))
+    )
+
+
+def order_parts_slots(parts_overhangs):
+    """Return slots in assembly order from the overhangs of each part.
+
+    Parameters
+    ----------
+    parts_overhangs
+      A list [(part_name, (left_overhang, right_overhang)), ...] in any order
+      and orientation.
 
     Returns
     -------
     slots
       A list [(slot_name, left_overhang, right_overhang), ...] ready to be fed
-      to the other Kappagate methods.
-
+      to the other Kappagate methods, with the parts ordered and oriented
+      so that each part's right overhang is the next part's left overhang.
     """
+    # Parts with the same standardized overhangs are variants of a same slot.
+    slots_parts = {}
+    for name, (left, right) in parts_overhangs:
+        slots_parts.setdefault(_standardized_slot(left, right), name)
+    slots_list = list(slots_parts)
 
-    if enzyme == "auto":
-        enzyme = autoselect_enzyme(parts_records)
-    # mix = RestrictionLigationMix(parts_records, enzymes=[enzyme])
-    mix = generate_type2s_restriction_mix(parts=parts_records, enzyme=enzyme)
+    # Slots sharing an overhang (or its reverse-complement) are neighbours.
+    slots_by_overhang = {}
+    for i, slot in enumerate(slots_list):
+        for overhang in slot:
+            if overhang != "":
+                std_overhang = min(overhang, reverse_complement(overhang))
+                slots_by_overhang.setdefault(std_overhang, set()).add(i)
+    neighbors = [set() for _ in slots_list]
+    for slots_indices in slots_by_overhang.values():
+        for i in slots_indices:
+            neighbors[i].update(slots_indices - {i})
+
+    # The path starts from the same end as a walk of DnaCauldron's slots
+    # graph would, i.e. the first end slot to appear in the graph's edges.
+    ends = [i for i, n in enumerate(neighbors) if len(n) == 1]
+    if len(slots_list) == 1:
+        start = 0
+    else:
+        start = min(
+            ends,
+            key=lambda i: min((min(i, j), max(i, j)) for j in neighbors[i]),
+        )
+    path, visited = [start], {start}
+    while True:
+        next_slots = neighbors[path[-1]] - visited
+        if not next_slots:
+            break
+        path.append(next_slots.pop())
+        visited.add(path[-1])
+    slots = [(slots_parts[slots_list[i]],) + slots_list[i] for i in path]
 
-    slots_parts = mix.compute_slots()
-    graph = mix.slots_graph(with_overhangs=False)
-    slots = [
-        (list(slots_parts[(s1, s2)])[0], s1, s2)
-        for s1, s2 in linear_graph_to_nodes_list(graph)
-    ]
     for i in list(range(len(slots) - 1)):
         name, left, right = slots[i + 1]
         if slots[i][2] != left:
@@ -67,6 +208,59 @@ def parts_records_to_slots(parts_records, enzyme="auto"):
     )
 
 
+def parts_records_to_slots(
+    parts_records, enzyme="auto", cache=True, profiler=None
+):
+    """Return slots from parts records, ready to feed to other methods.
+    
+    Parameters
+    ----------
+    parts_records
+      A list of Biopython records of the parts of the assembly. Do NOT
+      include the backbone.
+    
+    enzyme
+      Name of a Type-2S enzyme or "auto" to select automatically based
+      on restriction sites in the records sequences.
+
+    cache
+      If True, the digestion of each part (and its number of restriction
+      sites, for the enzyme selection) is cached, so that the slots of new
+      combinations of already-seen parts are computed without any digestion.
+      The caches keep the most recently used parts, and can be emptied with
+      ``clear_digestion_caches``.
+
+    profiler
+      A ``Profiler`` recording the time spent selecting the enzyme,
+      digesting the parts and ordering the slots, and the numbers of parts
+      and slots.
+
+
+    Returns
+    -------
+    slots
+      A list [(slot_name, left_overhang, right_overhang), ...] ready to be fed
+      to the other Kappagate methods.
+
+    """
+    if profiler is None:
+        profiler = Profiler()
+    with profiler.stage("enzyme_selection"):
+        if enzyme == "auto":
+            enzyme = _autoselect_enzyme(parts_records, cache=cache)
+    with profiler.stage("digestion"):
+        parts_overhangs = [
+            (record.id, overhangs)
+            for record in parts_records
+            for overhangs in part_record_digestion(record, enzyme, cache=cache)
+        ]
+    with profiler.stage("slots_ordering"):
+        slots = order_parts_slots(parts_overhangs)
+    profiler.record("n_parts", len(parts_records))
+    profiler.record("n_slots", len(slots))
+    return slots
+
+
 def _find_backbone_center(record, backbone_annotations=()):
     """Find an annotation from the backbone, return the index of its center"""
     record.features = [f for f in record.features if f.location is not None]
@@ -81,7 +275,7 @@ def _find_backbone_center(record, backbone_annotations=()):
     )
 
 
-def construct_record_to_slots(record, backbone_annotations=()):
+def construct_record_to_slots(record, backbone_annotations=(), profiler=None):
     """Return slots from a construct record, ready to feed to other methods.
     
     Parameters
@@ -95,6 +289,10 @@ def construct_record_to_slots(record, backbone_annotations=()):
       Texts that can be found in the annotations located in the "backbone part"
       of the provided record. e.g. ['AmpR', 'Origin'] etc.
 
+    profiler
+      A ``Profiler`` recording the time spent locating the backbone and
+      reading the overhangs annotations, and the number of slots.
+
     Returns
     -------
     slots
@@ -102,12 +300,18 @@ def construct_record_to_slots(record, backbone_annotations=()):
       to the other Kappagate methods.
 
     """
-    backbone_center = _find_backbone_center(
-        record, backbone_annotations=backbone_annotations
-    )
-    overhangs = list_overhangs_from_record_annotations(
-        record, with_locations=True
-    )
+    if profiler is None:
+        profiler = Profiler()
+    with profiler.stage("backbone_location"):
+        backbone_center = _find_backbone_center(
+            record, backbone_annotations=backbone_annotations
+        )
+    with profiler.stage("overhangs_annotations"):
+        from dnacauldron import list_overhangs_from_record_annotations
+
+        overhangs = list_overhangs_from_record_annotations(
+            record, with_locations=True
+        )
     if overhangs is None:
         raise ValueError(
             "Could not find any overhang in the provided record "
@@ -116,13 +320,20 @@ def construct_record_to_slots(record, backbone_annotations=()):
     overhangs = [o for loc, o in overhangs if loc > backbone_center] + [
         o for loc, o in overhangs if loc <= backbone_center
     ]
-    return overhangs_list_to_slots(overhangs)
+    slots = overhangs_list_to_slots(overhangs)
+    profiler.record("n_slots", len(slots))
+    return slots
 
 
 def linear_graph_to_nodes_list(graph, node_name=None):
     """Return a list of node names as they appear in the linear graph."""
     start, end = [n for n in graph.nodes if graph.degree[n] == 1]
-    linear_path_nodes = list(nx.all_simple_paths(graph, start, end))[0]
+    linear_path_nodes, visited = [start], {start}
+    while linear_path_nodes[-1] != end:
+        next_node = next(n for n in graph.neighbors(linear_path_nodes[-1])
+                         if n not in visited)
+        linear_path_nodes.append(next_node)
+        visited.add(next_node)
     if node_name is None:
         return tuple(linear_path_nodes)
     return tuple([graph.nodes[n][node_name] for n in linear_path_nodes])
@@ -174,6 +385,9 @@ def load_record(
     id="auto",
     upperize=True,
 ):
+    from Bio import SeqIO
+    from snapgene_reader import snapgene_file_to_seqrecord
+
     if hasattr(filename, "read"):
         record = SeqIO.read(filename, "genbank")
         if id == "auto":
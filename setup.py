@@ -15,6 +15,8 @@ setup(
     license='MIT',
     keywords="DNA assembly synthetic biology golden gate",
     packages=find_packages(exclude='docs'),
+    python_requires='>=3.7',
     install_requires=['topkappy', 'networkx', 'tatapov', 'matplotlib',
-                      'dnacauldron', 'proglog', 'flametree', 'biopython',
-                      'snapgene_reader'])
+                      'dnacauldron>=2.0,<3', 'proglog', 'flametree', 'biopython',
+                      'snapgene_reader', 'numpy', 'scipy'],
+    entry_points={'console_scripts': ['kappagate=kappagate.cli:main']})
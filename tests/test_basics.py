@@ -1,11 +1,48 @@
 import os
+import numpy as np
 import matplotlib
 matplotlib.use("Agg")
 from kappagate import (overhangs_list_to_slots, predict_assembly_accuracy,
+                       predict_assembly_accuracy_batch, PredictionCache,
+                       optimize_overhangs, IncrementalAssemblyModel,
+                       predict_assembly_accuracy_adaptive,
+                       load_records_batch,
+                       predict_assembly_accuracy_by_clusters, sweep,
+                       junctions_report,
                        plot_colony_picking_graph, success_rate_facts,
+                       plot_colony_picking_graphs,
+                       min_trials_for_one_success,
+                       average_trials_until_success, success_rate_facts_table,
                        plot_circular_interactions, load_record,
-                       parts_records_to_slots, construct_record_to_slots)
+                       parts_records_to_slots, construct_record_to_slots,
+                       clear_digestion_caches, Profiler, AsyncPredictor,
+                       generate_batch_report)
+from kappagate.annealing_matrix import (get_annealing_matrix,
+                                        slots_interaction_rates,
+                                        overhangs_to_indices, ALL_OVERHANGS,
+                                        prune_interaction_rates,
+                                        random_overhangs,
+                                        REVERSE_COMPLEMENT_INDICES)
+from kappagate.predict_assembly_accuracy import (slots_to_agents_and_rules,
+                                                snapshot_agents_to_constructs)
+from kappagate.cli import main as cli_main
+from kappagate.tools import part_record_digestion
+from kappagate.optimize_overhangs import overhangs_junctions_fidelities
+import sys
+import json
+import asyncio
+import threading
+import time
+import shutil
+import subprocess
 import flametree
+import tatapov
+import pandas
+import pytest
+import zipfile
+import weakref
+import gc
+from io import BytesIO
 
 records_dict = {
     name: load_record(os.path.join('tests', 'data', 'records', name + '.gb'),
@@ -49,6 +86,42 @@ def test_plot_circular_interactions():
     slots = overhangs_list_to_slots(overhangs)
     plot_circular_interactions(
         slots, annealing_data=('25C', '01h'), rate_limit=200)
+    # Shuffled slots are plotted in the assembly order, from precomputed
+    # rates, with only the strongest unexpected interaction.
+    shuffled_slots = slots[5:] + slots[:5]
+    rates = slots_interaction_rates(shuffled_slots)
+    ax = plot_circular_interactions(shuffled_slots, rates=rates, rate_limit=0,
+                                    top_k=1, rasterized=True)
+    sites = [text.get_text() for text in ax.texts][-2 * len(slots):]
+    expected_sites = [o for _, left, right in slots for o in (left, right)]
+    assert sites in [expected_sites, expected_sites[::-1]]
+    red_labels = [text for text in ax.texts
+                  if text.get_color() == 'red']
+    assert len(red_labels) == 1
+    # Self-interactions (a site binding another copy of itself) are
+    # unexpected, and drawn in red next to their site.
+    rates = slots_interaction_rates(slots)
+    rates[0, 0, 1] = 50  # The first right site binds its own copies.
+    ax = plot_circular_interactions(slots, rates=rates, rate_limit=0)
+    rate_texts = ax.texts[:-3 * len(slots)]
+    sites_positions = [np.array(text.get_position())
+                       for text in ax.texts[-2 * len(slots):]]
+    self_loop_labels = [
+        text for text in rate_texts
+        if any(np.allclose(text.get_position(), 1.2 * position)
+               for position in sites_positions)
+    ]
+    assert len(self_loop_labels) == np.count_nonzero(
+        rates[range(len(slots)), range(len(slots)), 1])
+    assert '50' in [text.get_text() for text in self_loop_labels]
+    assert all(text.get_color() == 'red' for text in self_loop_labels)
+    n_unexpected = len(set(
+        frozenset([(i1, 1), (i2, side)])
+        for i1, i2, side in zip(*np.nonzero(rates))
+        if (i1, 1) == (i2, side) or slots[i1][2] != slots[i2][1 + side]
+    ))
+    assert len([text for text in rate_texts
+                if text.get_color() == 'red']) == n_unexpected
 
 def test_success_rate_facts():
     overhangs = ['TAGG', 'GACT', 'GGAC', 'CAGC',
@@ -58,6 +131,57 @@ def test_success_rate_facts():
     predicted_rate, _, _ = predict_assembly_accuracy(slots, duration=10)
     plot_colony_picking_graph(success_rate=predicted_rate)
 
+def test_plot_colony_picking_graphs(tmpdir):
+    rates = {'construct_1': 0.95, 'construct_2': 0.4}
+    names = []
+    for name, ax in plot_colony_picking_graphs(rates):
+        assert len(ax.lines) == 2  # Only the markers of this success rate.
+        ax.figure.savefig(os.path.join(str(tmpdir), name + '.png'))
+        names.append(name)
+    assert names == list(rates)
+    assert len(ax.lines) == 0
+
+def test_generate_batch_report(tmpdir):
+    assemblies = {
+        'A1': overhangs_list_to_slots(['TAGG', 'GACT', 'GGAC', 'CAGC']),
+        'A2': overhangs_list_to_slots(['GGTC', 'GCGT', 'TGCT']),
+    }
+    pdf_path = os.path.join(str(tmpdir), 'report.pdf')
+    generate_batch_report(assemblies, pdf_path, n_jobs=1, engine='ode')
+    with open(pdf_path, 'rb') as f:
+        assert f.read(4) == b'%PDF'
+    # Provided scores are not predicted again.
+    data = generate_batch_report(assemblies, '@memory', n_jobs=2,
+                                 scores={'A1': 0.5, 'A2': 0.25})
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        assert 'figures/001_interactions.png' in archive.namelist()
+        index = archive.read('index.html').decode()
+    assert '50.0%' in index and '25.0%' in index
+    # Rules pruning options go to the rules generation.
+    data = generate_batch_report(assemblies, '@memory', n_jobs=1, min_rate=1,
+                                 max_rules_per_site=2, engine='ode')
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        assert 'figures/001_interactions.png' in archive.namelist()
+    with pytest.raises(TypeError):
+        generate_batch_report(assemblies, '@memory', min_rates=1)
+
+def test_success_rate_facts_arrays():
+    rates = np.array([0, 0.5, 1, np.nan])
+    assert min_trials_for_one_success(0, 0.95) == np.inf
+    assert min_trials_for_one_success(1, 0.95) == 1
+    trials = min_trials_for_one_success(rates, 0.95)
+    assert trials[:3].tolist() == [np.inf, 5, 1] and np.isnan(trials[3])
+    assert average_trials_until_success(rates)[:3].tolist() == [np.inf, 2, 1]
+    series = pandas.Series([0.5, 0], index=['a', 'b'])
+    assert list(average_trials_until_success(series).index) == ['a', 'b']
+    texts = success_rate_facts(rates)
+    assert texts[1] == success_rate_facts(0.5)
+    assert "No valid clone" in texts[0]
+    table = success_rate_facts_table({'a': 0.5, 'b': 0.9}, with_text=True)
+    assert list(table.index) == ['a', 'b']
+    assert table.loc['a', 'min_trials_q95'] == 5
+    assert table.loc['b', 'text'] == success_rate_facts(0.9)
+
 def test_parts_records_to_slots():
     records = [records_dict[n] for n in ["partA", "partB", "partC"]]
     slots = parts_records_to_slots(records, enzyme='auto')
@@ -66,7 +190,43 @@ def test_parts_records_to_slots():
                      ('partB', 'GGCT', 'GGGC'),
                      ('partC', 'GGGC', 'GGCA'),
                      ('backbone-right', 'GGCA', 'RIGHT')]
-    
+
+
+def test_parts_records_to_slots_cache():
+    records = [records_dict[n] for n in ["partC", "partA", "partB"]]
+    slots = parts_records_to_slots(records, cache=False)
+    assert parts_records_to_slots(records) == slots
+    # Now the digestions are cached: reversed parts in any order work too.
+    reversed_records = [
+        records_dict[n].reverse_complement(
+            id=n, annotations=records_dict[n].annotations)
+        for n in ["partB", "partC", "partA"]
+    ]
+    assert parts_records_to_slots(reversed_records) == slots
+    assert part_record_digestion(records[1], 'BsmBI') == (('ATTG', 'GGCT'),)
+    clear_digestion_caches()
+    assert parts_records_to_slots(reversed_records) == slots
+
+
+def test_profiler():
+    metrics = []
+    profiler = Profiler(callback=lambda name, value: metrics.append(name),
+                        track_memory=True)
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA'])
+    predict_assembly_accuracy(slots, engine='ode', profiler=profiler)
+    for stage in ['annealing_data', 'interaction_rates', 'rules',
+                  'ode_simulation']:
+        assert profiler.timings[stage + '_time'] >= 0
+    assert profiler.timings['n_agents'] == len(slots)
+    assert profiler.timings['n_rules'] >= len(slots) - 1
+    assert profiler.timings['peak_memory'] > 0
+    assert set(metrics) == set(profiler.timings)
+
+    profiler = Profiler()
+    records = [records_dict[n] for n in ["partC", "partA", "partB"]]
+    parts_records_to_slots(records, profiler=profiler)
+    assert profiler.timings['n_parts'] == 3
+    assert 'digestion_time' in profiler.timings
 
 def test_construct_record_to_slots():
     record = records_dict['assembled_construct']
@@ -75,4 +235,475 @@ def test_construct_record_to_slots():
                      ('p001', 'ATTG', 'GGCT'),
                      ('p002', 'GGCT', 'GGGC'),
                      ('p003', 'GGGC', 'GGCA'),
-                     ('backbone-right', 'GGCA', 'RIGHT')]
\ No newline at end of file
+                     ('backbone-right', 'GGCA', 'RIGHT')]
+
+def test_predict_assembly_accuracy_batch():
+    overhangs_sets = [['GGAG', 'GGCA', 'TCGC', 'CAGT'],
+                      ['TAGG', 'GACT', 'GGAC', 'CAGC']]
+    list_of_slots = [overhangs_list_to_slots(o) for o in overhangs_sets]
+    list_of_slots.append([])  # This job will fail.
+    results = predict_assembly_accuracy_batch(
+        list_of_slots, n_jobs=2, seed=123, duration=10)
+    results = {index: (score, other) for index, score, other in results}
+    assert sorted(results) == [0, 1, 2]
+    assert all(0 <= results[i][0] <= 1 for i in (0, 1))
+    assert results[2][0] is None
+    assert isinstance(results[2][1], Exception)
+
+def test_predict_assembly_accuracy_ode():
+    high_fidelity_overhangs = ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA',
+                               'GAAT', 'AGTA', 'TCTT', 'CAAA', 'GCAC',
+                               'AACG', 'GTCT', 'CCAT']
+    # TGCC (reverse-complement of GGCA) creates a strong misligation
+    low_fidelity_overhangs = ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TGCC',
+                              'GAAT', 'AGTA', 'TCTT', 'CAAA', 'GCAC',
+                              'AACG', 'GTCT', 'CCAT']
+    scores = []
+    for overhangs in (high_fidelity_overhangs, low_fidelity_overhangs):
+        slots = overhangs_list_to_slots(overhangs)
+        score, _, results = predict_assembly_accuracy(slots, engine='ode')
+        assert len(results['junctions_fidelities']) == len(slots) - 1
+        score_2, _, _ = predict_assembly_accuracy(slots, engine='ode')
+        assert score == score_2
+        scores.append(score)
+    assert 0 < scores[1] < scores[0] < 1
+    # A slot with the same overhang on both sides has indistinct sites.
+    slots = overhangs_list_to_slots(['GGAG', 'GGAG', 'TCGC'])
+    for engine in ['ode', 'population']:
+        with pytest.raises(ValueError):
+            predict_assembly_accuracy(slots, engine=engine)
+
+def test_predict_assembly_accuracy_population():
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TGCC',
+                                     'GAAT', 'AGTA', 'TCTT'])
+    score, constructs, results = predict_assembly_accuracy(
+        slots, engine='population', initial_quantities=5000, seed=123)
+    score_2, _, _ = predict_assembly_accuracy(
+        slots, engine='population', initial_quantities=5000, seed=123)
+    assert score == score_2
+    assert results['n_steps'] > 0
+    assert abs(sum(constructs.values()) - 1) < 1e-8
+    ode_score, _, _ = predict_assembly_accuracy(slots, engine='ode')
+    assert abs(score - ode_score) < 0.1
+
+def test_annealing_matrix():
+    data = tatapov.annealing_data['25C']['01h']
+    matrix = get_annealing_matrix(('25C', '01h'))
+    for ov1, ov2 in [('GGAG', 'CTCC'), ('GGAG', 'CTCT'), ('ATGC', 'TTGC')]:
+        i1, i2 = overhangs_to_indices([ov1, ov2])
+        assert matrix[i1, i2] == data[ov1][ov2]
+        rc_i1 = REVERSE_COMPLEMENT_INDICES[i1]
+        assert ALL_OVERHANGS[rc_i1] == tatapov.reverse_complement(ov1)
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA', 'TCGC'])
+    rates = slots_interaction_rates(slots, annealing_data=('25C', '01h'))
+    assert rates.shape == (4, 4, 2)
+    assert rates[0, 1, 0] == data['GGAG']['CTCC']  # expected junction
+    assert (rates[-1] == 0).all()  # "RIGHT" does not interact
+    overhangs = random_overhangs(20, seed=1)
+    assert overhangs == random_overhangs(20, seed=1)
+    rc_overhangs = [tatapov.reverse_complement(o) for o in overhangs]
+    assert len(set(overhangs + rc_overhangs)) == 40
+
+def test_prune_interaction_rates():
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA',
+                                     'GAAT', 'AGTA', 'TTAC'])
+    rates = slots_interaction_rates(slots)
+    junctions = (np.arange(len(slots) - 1), np.arange(1, len(slots)), 0)
+    pruned, report = prune_interaction_rates(rates, min_rate=np.inf)
+    assert (pruned > 0).sum() == len(slots) - 1
+    assert (pruned[junctions] == rates[junctions]).all()
+    assert report['n_pruned_rules'] == report['n_rules'] - len(slots) + 1
+    assert np.isclose(report['pruned_rate'], rates.sum() - pruned.sum())
+    pruned, report = prune_interaction_rates(rates, max_rules_per_site=1)
+    pruned[junctions] = 0
+    slots1, slots2, sides = np.nonzero(pruned)
+    sites = np.concatenate([2 * slots1 + 1, 2 * slots2 + sides])
+    assert np.bincount(sites).max() <= 1 + (slots1 == slots2).sum()
+    agents, rules, report = slots_to_agents_and_rules(
+        slots, min_rate=np.inf, return_pruning_report=True)
+    assert len(rules) == len(slots) - 1
+    score, _, _ = predict_assembly_accuracy(slots, engine='ode',
+                                            min_rate=np.inf)
+    assert score > 0.999
+
+
+def test_predict_assembly_accuracy_by_clusters():
+    overhangs = ['TAGG', 'GACT', 'GGAC', 'CAGC', 'GGTC', 'GCGT', 'TGCT',
+                 'GGTA', 'CGTC', 'CTAC', 'GCAA', 'CCCT']
+    slots = overhangs_list_to_slots(overhangs)
+    score, _, results = predict_assembly_accuracy(slots, engine='ode')
+    clusters_score, constructs, clusters_results = \
+        predict_assembly_accuracy_by_clusters(slots)
+    assert np.isclose(clusters_score, score, rtol=1e-4)
+    assert clusters_results['decoupled_rate'] == 0
+    assert np.allclose(clusters_results['junctions_fidelities'],
+                       results['junctions_fidelities'], rtol=1e-4)
+    score, _, results = predict_assembly_accuracy_by_clusters(
+        slots, coupling_threshold=np.inf, n_jobs=2)
+    assert len(results['clusters']) == len(overhangs)
+    assert results['decoupled_rate'] > 0
+    assert np.isclose(score, 1)
+
+    # Outer overhangs which are not LEFT/RIGHT placeholders.
+    slots = [('p4', 'TGCC', 'GGAG'), ('p5', 'GGAG', 'GGCA'),
+             ('p6', 'GGCA', 'TCGC'), ('p7', 'TCGC', 'TGCC')]
+    score, _, results = predict_assembly_accuracy(slots, engine='ode')
+    clusters_score, _, clusters_results = \
+        predict_assembly_accuracy_by_clusters(slots)
+    assert np.isclose(clusters_score, score, rtol=1e-4)
+    assert np.allclose(clusters_results['junctions_fidelities'],
+                       results['junctions_fidelities'], rtol=1e-4)
+
+
+def test_sweep():
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA'])
+    table = sweep(slots, corrective_factors=[0.8, 1.0],
+                  annealing_data=[('25C', '01h'), ('37C', '01h')],
+                  durations=[100, 1000], initial_quantities=200, seed=123,
+                  n_jobs=2)
+    assert len(table) == 8
+    assert set(table.annealing_data) == {'25C/01h', '37C/01h'}
+    assert ((table.score >= 0) & (table.score <= 1)).all()
+    assert 'misassembly_3_proportion' in table.columns
+    ode_table = sweep(slots, corrective_factors=[1.2],
+                      durations=[1000], engine='ode', n_jobs=1)
+    score, _, _ = predict_assembly_accuracy(slots, corrective_factor=1.2,
+                                            engine='ode')
+    assert np.isclose(ode_table.score[0], score)
+    population_table = sweep(slots, durations=[100, 1000],
+                             initial_quantities=200, engine='population',
+                             seed=123, n_jobs=1)
+    score, _, _ = predict_assembly_accuracy(slots, initial_quantities=200,
+                                            engine='population', seed=123)
+    assert population_table.score[1] == score
+    with pytest.raises(ValueError):
+        sweep(slots, engine='odes')
+
+
+def test_junctions_report():
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TGCC',
+                                     'TCCA'])
+    report = junctions_report(slots, n_offenders=2)
+    assert list(report.overhang) == ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TGCC',
+                                     'TCCA']
+    # Brute-force computation of the rates competing at each junction.
+    rates = slots_interaction_rates(slots)
+    for i, row in report.iterrows():
+        sites = {(i, 1), (i + 1, 0)}
+        competing = sum(
+            rates[j1, j2, side]
+            for j1, j2, side in zip(*np.nonzero(rates))
+            if ({(j1, 1), (j2, side)} & sites) and ((j1, j2, side) !=
+                                                    (i, i + 1, 0))
+        )
+        assert np.isclose(row.competing_rate, competing)
+        assert np.isclose(row.expected_fidelity,
+                          row.correct_rate / (row.correct_rate + competing))
+    # GGCA and its reverse-complement TGCC compete at junctions 1 and 4.
+    worst = report.sort_values('expected_fidelity').junction[:2]
+    assert set(worst) == {1, 4}
+    assert report.offender_1[1] == (('p001', 'GGCA'), ('p004', 'TGCC'))
+    # The overhangs optimizer uses the same fidelities, including with
+    # self-interactions (a site binding a copy of itself), counted once.
+    matrix = np.random.RandomState(123).uniform(0, 100, (256, 256))
+    annealing_data = pandas.DataFrame(matrix.T, index=ALL_OVERHANGS,
+                                      columns=ALL_OVERHANGS)
+    report = junctions_report(slots, annealing_data=annealing_data)
+    rates = slots_interaction_rates(slots, annealing_data=annealing_data)
+    for i, row in report.iterrows():
+        sites = {(i, 1), (i + 1, 0)}
+        competing = sum(
+            rates[j1, j2, side]
+            for j1, j2, side in zip(*np.nonzero(rates))
+            if ({(j1, 1), (j2, side)} & sites) and ((j1, j2, side) !=
+                                                    (i, i + 1, 0))
+        )
+        assert np.isclose(row.competing_rate, competing)
+    fidelities = overhangs_junctions_fidelities(
+        overhangs_to_indices(report.overhang), matrix)
+    assert np.allclose(fidelities, report.expected_fidelity)
+
+
+def test_prediction_cache(tmpdir):
+    overhangs = ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA']
+    slots = overhangs_list_to_slots(overhangs)
+    cache = PredictionCache(cache_dir=os.path.join(str(tmpdir), 'cache'))
+    score, _, results = predict_assembly_accuracy(slots, engine='ode',
+                                                  cache=cache)
+    assert results is not None
+    cached_score, _, results = predict_assembly_accuracy(slots, engine='ode',
+                                                         cache=cache)
+    assert (cached_score == score) and (results is None)
+
+    # Same assembly, with other slot names
+    renamed_slots = [('slot_%d' % i, left, right)
+                     for i, (_, left, right) in enumerate(slots)]
+    new_cache = PredictionCache(cache_dir=os.path.join(str(tmpdir), 'cache'))
+    cached_score, constructs, results = predict_assembly_accuracy(
+        renamed_slots, engine='ode', cache=new_cache)
+    assert (cached_score == score) and (results is None)
+    expected_construct = tuple(name for name, _, _ in renamed_slots)
+    assert constructs == {expected_construct: score}
+
+    # Same assembly, read in the other direction: the model is not symmetric,
+    # so the cached prediction must match an uncached one.
+    reversed_slots = overhangs_list_to_slots(
+        [tatapov.reverse_complement(o) for o in overhangs[::-1]])
+    reversed_score, _, _ = predict_assembly_accuracy(reversed_slots,
+                                                     engine='ode')
+    cached_score, _, results = predict_assembly_accuracy(
+        reversed_slots, engine='ode', cache=cache)
+    assert (cached_score == reversed_score) and (results is not None)
+
+    # Different parameters
+    _, _, results = predict_assembly_accuracy(slots, engine='ode',
+                                              corrective_factor=0.5,
+                                              cache=cache)
+    assert results is not None
+
+def test_async_predictor(tmpdir):
+    overhangs = ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA']
+    slots = overhangs_list_to_slots(overhangs)
+    renamed_slots = [('slot_%d' % i, left, right)
+                     for i, (_, left, right) in enumerate(slots)]
+    reversed_slots = overhangs_list_to_slots(
+        [tatapov.reverse_complement(o) for o in overhangs[::-1]])
+    expected_score, _, _ = predict_assembly_accuracy(slots, engine='ode')
+    reversed_score, _, _ = predict_assembly_accuracy(reversed_slots,
+                                                     engine='ode')
+
+    async def run_requests():
+        cache = PredictionCache(cache_dir=os.path.join(str(tmpdir), 'cache'))
+        async with AsyncPredictor(n_workers=1, cache=cache,
+                                  engine='ode') as predictor:
+            results = await asyncio.gather(
+                predictor.predict(slots), predictor.predict(renamed_slots),
+                predictor.predict(reversed_slots))
+            results.append(await predictor.predict(slots))
+            return results, predictor.metrics()
+
+    results, metrics = asyncio.run(run_requests())
+    assert [score for score, _ in results] == [
+        expected_score, expected_score, reversed_score, expected_score]
+    assert metrics['requests'] == 4
+    assert metrics['coalesced'] == 1
+    assert metrics['cache_hits'] == 1
+    assert metrics['queue_depth'] == 0
+    assert metrics['latency_max'] >= metrics['latency_p50'] > 0
+
+    async def time_out_failing_request():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context))
+        async with AsyncPredictor(n_workers=1, engine='ode') as predictor:
+            with pytest.raises(asyncio.TimeoutError):
+                await predictor.predict(slots, timeout=0.001,
+                                        engine='unknown_engine')
+            while predictor.metrics()['queue_depth']:
+                await asyncio.sleep(0.01)
+        gc.collect()
+        return errors
+
+    assert asyncio.run(time_out_failing_request()) == []
+
+    # A request whose cache lookup completes after the identical prediction
+    # but before it is cached is still coalesced.
+    predicted = threading.Event()
+
+    class SlowCache(PredictionCache):
+
+        n_gets = 0
+
+        def get(self, slots, **parameters):
+            # The second lookup misses, and returns after the prediction.
+            self.n_gets += 1
+            if self.n_gets == 2:
+                predicted.wait(10)
+                time.sleep(0.2)
+            return PredictionCache.get(self, slots, **parameters)
+
+    async def request_during_caching():
+        cache = SlowCache(cache_dir=os.path.join(str(tmpdir), 'slow_cache'))
+        async with AsyncPredictor(n_workers=1, cache=cache,
+                                  engine='ode') as predictor:
+            submit = predictor.executor.submit
+
+            def submit_and_notify(*args, **kwargs):
+                future = submit(*args, **kwargs)
+                future.add_done_callback(lambda future: predicted.set())
+                return future
+
+            predictor.executor.submit = submit_and_notify
+            results = await asyncio.gather(
+                predictor.predict(slots),
+                predictor.predict(slots, n_jobs=1))
+            return results, predictor.metrics()
+
+    results, metrics = asyncio.run(request_during_caching())
+    assert [score for score, _ in results] == 2 * [expected_score]
+    assert (metrics['coalesced'], metrics['cache_hits']) == (1, 0)
+
+def test_optimize_overhangs():
+    overhangs, score, shortlist = optimize_overhangs(
+        n_parts=8, fixed={0: 'GGAG', 8: 'CGCT'}, forbidden=['AATT', 'GGCC'],
+        max_iterations=500, shortlist_size=3, seed=123, engine='ode')
+    assert len(overhangs) == 9
+    assert (overhangs[0], overhangs[-1]) == ('GGAG', 'CGCT')
+    all_overhangs = overhangs + [tatapov.reverse_complement(o)
+                                 for o in overhangs]
+    assert len(set(all_overhangs)) == 18
+    assert not set(['AATT', 'GGCC']).intersection(overhangs)
+    assert len(shortlist) == 3
+    assert score == shortlist[0][1] == max(c[1] for c in shortlist)
+    overhangs, _, _ = optimize_overhangs(
+        n_parts=2, fixed={0: 'ggag'}, forbidden=['aatt'], max_iterations=10,
+        shortlist_size=1, engine='ode')
+    assert overhangs[0] == 'GGAG'
+    for fixed, forbidden in [({0: 'GGAN'}, ()), ({}, ['GGAGA'])]:
+        with pytest.raises(ValueError):
+            optimize_overhangs(n_parts=2, fixed=fixed, forbidden=forbidden,
+                               max_iterations=10, engine='ode')
+
+def test_incremental_assembly_model():
+    overhangs = ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA', 'GAAT', 'AGTA']
+    model = IncrementalAssemblyModel(overhangs_list_to_slots(overhangs))
+    for junction, overhang in [(2, 'TGCC'), (0, 'ACGA'), (6, 'CCAT')]:
+        delta = model.delta_misligation_rate(junction, overhang)
+        misligation_rate = model.misligation_rate
+        model.replace_overhang(junction, overhang)
+        overhangs[junction] = overhang
+        slots = overhangs_list_to_slots(overhangs)
+        _, rules = slots_to_agents_and_rules(slots)
+        assert model.slots == slots
+        assert [r._kappa() for r in model.rules] == [r._kappa() for r in rules]
+        assert abs(model.misligation_rate - misligation_rate - delta) < 1e-6
+    score, _, _ = model.predict_assembly_accuracy(engine='ode')
+    assert 0 < score < 1
+
+def test_predict_assembly_accuracy_adaptive():
+    overhangs = ['GGAG', 'GGCA', 'TCGC', 'CAGT', 'TCCA',
+                 'GAAT', 'AGTA', 'TCTT', 'CAAA', 'GCAC',
+                 'AACG', 'GTCT', 'CCAT']
+    slots = overhangs_list_to_slots(overhangs)
+    score, _, report = predict_assembly_accuracy_adaptive(
+        slots, tolerance=0.05, initial_quantities=(200, 1000), n_snapshots=4,
+        seed=123)
+    assert report['initial_quantities_needed'] in (200, 1000)
+    assert report['time_needed'] <= 1000
+    low, high = report['confidence_interval']
+    assert low <= score <= high
+    assert report['history'][-1]['score'] == score
+    # Without convergence, the larger simulation stops early (in virtual
+    # time) once the smaller one shows the time needed by the estimate.
+    _, _, report = predict_assembly_accuracy_adaptive(
+        slots, tolerance=0, initial_quantities=(200, 400), n_snapshots=4,
+        seed=123)
+    first_duration, second_duration = report['durations']
+    assert first_duration == 1000
+    assert np.isclose(np.geomspace(10, 1000, 4), second_duration).any()
+    assert max(entry['time'] for entry in report['history']
+               if entry['initial_quantities'] == 400) == second_duration
+    assert min(entry['time'] for entry in report['history']) == 10
+    with pytest.raises(ValueError):
+        predict_assembly_accuracy_adaptive(slots, duration=0.01)
+
+def test_predict_assembly_accuracy_replicates():
+    overhangs = ['TAGG', 'GACT', 'GGAC', 'CAGC', 'GGTC', 'GCGT']
+    slots = overhangs_list_to_slots(overhangs)
+    score, _, results = predict_assembly_accuracy(
+        slots, initial_quantities=200, replicates=3, seed=123)
+    assert len(results['scores']) == len(results['replicates']) == 3
+    assert score == results['mean']
+    low, high = results['confidence_interval']
+    assert low <= score <= high
+    with pytest.raises(ValueError):
+        predict_assembly_accuracy(slots, replicates=0)
+
+def test_snapshot_agents_to_constructs():
+    def node(name, links):
+        return dict(node_type=name, node_sites=[
+            dict(site_name=site, site_type=['port', dict(
+                port_links=[] if link is None else [list(link)],
+                port_states=[])])
+            for site, link in zip(('left', 'right'), links)
+        ])
+    slots = overhangs_list_to_slots(['GGAG', 'GGCA'])
+    good_complex = [node('p001', [(2, 1), (1, 0)]),
+                    node('backbone-right', [(0, 1), None]),
+                    node('backbone-left', [None, (0, 0)])]
+    bad_complex = [node('backbone-left', [None, (1, 1)]),
+                   node('p001', [None, (0, 1)])]  # p001 is reversed
+    snapshot_agents = [(3, good_complex), (1, bad_complex), (5, bad_complex)]
+    score, constructs, n_constructs = snapshot_agents_to_constructs(
+        slots, snapshot_agents)
+    assert n_constructs == 9
+    assert score == 3.0 / 9
+    assert constructs == {('backbone-right', 'p001', 'backbone-left'): 3 / 9,
+                          ('backbone-left', 'p001'): 6 / 9}
+
+def test_cli(tmpdir, capsys):
+    csv_path = os.path.join(str(tmpdir), 'overhangs.csv')
+    with open(csv_path, 'w') as f:
+        f.write("set_1,GGAG,GGCA,TCGC,CAGT\nTCCA,AAAA,TGCC\n")
+    parts_dir = os.path.join(str(tmpdir), 'assembly_1')
+    os.mkdir(parts_dir)
+    for name in ("partA", "partB", "partC"):
+        shutil.copy(os.path.join('tests', 'data', 'records', name + '.gb'),
+                    parts_dir)
+    construct = os.path.join('tests', 'data', 'records',
+                             'assembled_construct.gb')
+    cli_main([csv_path, '--parts-dirs', parts_dir, '--constructs', construct,
+              '--backbone-annotations', 'receptor', '--engine', 'ode',
+              '--jobs', '1'])
+    results = [json.loads(line)
+               for line in capsys.readouterr().out.splitlines()]
+    assert [r['name'] for r in results] == [
+        'set_1', 'overhangs.csv:2', 'assembly_1', 'assembled_construct']
+    assert all(0 <= r['score'] <= 1 for r in results)
+
+def test_lazy_imports():
+    """Importing kappagate must not load the heavy dependencies."""
+    script = "; ".join([
+        "import sys, json",
+        "import kappagate",
+        "lazy = sorted(set(kappagate._LAZY_ATTRIBUTES.values()))",
+        "print(json.dumps([sorted(sys.modules), lazy]))",
+    ])
+    output = subprocess.check_output([sys.executable, '-c', script])
+    modules, lazy_modules = json.loads(output.decode())
+    lazy_modules = ['kappagate.' + name for name in lazy_modules]
+    heavy_modules = ['matplotlib', 'Bio', 'dnacauldron', 'snapgene_reader',
+                     'networkx', 'tatapov', 'topkappy', 'scipy', 'pandas']
+    assert [m for m in heavy_modules + lazy_modules if m in modules] == []
+
+def test_load_records_batch(tmpdir):
+    def filepath(name):
+        return os.path.join('tests', 'data', 'records', name + '.gb')
+    assemblies = {
+        'assembly_1': [filepath(n) for n in ("partA", "partB", "partC")],
+        'assembly_2': [filepath(n) for n in ("partA", "partB", "partC")],
+        'broken': [filepath("partA"), filepath("missing_part")]
+    }
+    cache_dir = os.path.join(str(tmpdir), 'records_cache')
+    for n_jobs in (2, 1):  # the second batch loads records from the cache
+        results = list(load_records_batch(assemblies, n_jobs=n_jobs,
+                                          cache_dir=cache_dir,
+                                          topology='circular'))
+        assert [name for name, _, _ in results] == list(assemblies)
+        (_, records_1, _), (_, records_2, _), (_, records, error) = results
+        assert records_1[0] is not records_2[0]
+        assert [r.id for r in records_1] == ["partA", "partB", "partC"]
+        assert records is None and error is not None
+        assert parts_records_to_slots(records_2) == parts_records_to_slots(
+            [records_dict[n] for n in ["partA", "partB", "partC"]])
+    assert len(os.listdir(cache_dir)) == 3
+    # The records of assemblies already yielded are not kept in memory.
+    results = load_records_batch(
+        [[filepath(name)] for name in ("partA", "partB", "partC")],
+        n_jobs=1, max_pending_assemblies=1, topology='circular')
+    _, records, _ = next(results)
+    record_reference = weakref.ref(records[0])
+    del records
+    next(results)
+    gc.collect()
+    assert record_reference() is None